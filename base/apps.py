@@ -2,9 +2,24 @@
 from __future__ import unicode_literals
 from django.utils.translation import ugettext_lazy as _
 
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
 
 
 class BaseConfig(AppConfig):
     name = 'base'
     verbose_name = _("架构")
+
+    def ready(self):
+        from django.conf import settings
+        from base.util.model_version import track_model
+        from base.util.timing import permission_profiler
+        if getattr(settings, 'WL_PERMISSION_PROFILE', False):
+            permission_profiler.enable()
+
+        # Encode the choice bundles once at startup rather than on the first request.
+        from base.views import ChoiceBundleView
+        ChoiceBundleView.warm()
+
+        # Versions must be bumped by every process writing the models, not only by those reading them.
+        for label in getattr(settings, 'WL_MODEL_VERSION_MODELS', []):
+            track_model(apps.get_model(label))
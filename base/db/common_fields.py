@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, migrations
+
+from base.util.fixed_point import to_units, from_units
 
 
 class CurrencyField(models.DecimalField):
@@ -45,3 +47,84 @@ class LngField(models.DecimalField):
             decimal_places=decimal_places,
             **kwargs
         )
+
+
+class FixedPointField(models.BigIntegerField):
+    """
+    Fixed point number stored as the integer count of its units of 10 ** -decimal_places, see
+    base.util.fixed_point. The value of the field is that integer.
+    """
+    description = "Fixed point number stored as an integer"
+    DECIMAL_PLACES = 0
+
+    def __init__(self, *args, **kwargs):
+        self.decimal_places = kwargs.pop('decimal_places', self.DECIMAL_PLACES)
+        super(FixedPointField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(FixedPointField, self).deconstruct()
+        if self.decimal_places != self.DECIMAL_PLACES:
+            kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    def to_decimal(self, units):
+        return None if units is None else from_units(units, self.decimal_places)
+
+    def from_decimal(self, value, rounding=None):
+        return None if value is None else to_units(value, self.decimal_places, rounding)
+
+
+class FixedCurrencyField(FixedPointField):
+    DECIMAL_PLACES = 3
+
+
+class FixedQuantityField(FixedPointField):
+    DECIMAL_PLACES = 6
+
+
+class FixedLatField(FixedPointField):
+    DECIMAL_PLACES = 7
+
+
+class FixedLngField(FixedPointField):
+    DECIMAL_PLACES = 7
+
+
+def decimal_to_fixed_point(app_label, model_name, decimal_field, fixed_field, chunk_size=500):
+    """
+    Migration operation copying the values of a DecimalField column to a FixedPointField column of the same
+    model, and back when it is reversed. Add the fixed point field, run this operation, then remove the
+    decimal field (and rename the fixed point one).
+
+    :return: a RunPython operation.
+    """
+
+    def copy(apps, schema_editor, source, target, convert):
+        model = apps.get_model(app_label, model_name)
+        manager = model._base_manager.using(schema_editor.connection.alias)
+        target_field = model._meta.get_field(target)
+        rows = manager.filter(**{source + '__isnull': False}).order_by('pk').values_list('pk', source)
+        chunk = []
+        for row in rows.iterator():
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                update(manager, target, target_field, chunk, convert)
+                chunk = []
+        if chunk:
+            update(manager, target, target_field, chunk, convert)
+
+    def update(manager, target, target_field, chunk, convert):
+        manager.filter(pk__in=[pk for pk, _ in chunk]).update(**{target: models.Case(
+            *[models.When(pk=pk, then=models.Value(convert(value))) for pk, value in chunk],
+            output_field=target_field
+        )})
+
+    def forward(apps, schema_editor):
+        places = apps.get_model(app_label, model_name)._meta.get_field(fixed_field).decimal_places
+        copy(apps, schema_editor, decimal_field, fixed_field, lambda value: to_units(value, places))
+
+    def backward(apps, schema_editor):
+        places = apps.get_model(app_label, model_name)._meta.get_field(fixed_field).decimal_places
+        copy(apps, schema_editor, fixed_field, decimal_field, lambda units: from_units(units, places))
+
+    return migrations.RunPython(forward, backward)
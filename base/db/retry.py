@@ -0,0 +1,129 @@
+"""
+Retry of transactional funcs
+
+A DB_TRANSACTION func with a RETRY_POLICY is re-run in a fresh transaction when it fails on a transient
+concurrency error: a deadlock or lock wait timeout of MySQL, a serialization failure or deadlock of
+PostgreSQL, a locked SQLite database. Each retry sends func_retried and is counted in retry_stats.
+"""
+import time
+import random
+import logging
+import threading
+from collections import defaultdict
+
+import django.dispatch
+from django.db import transaction, DatabaseError
+
+
+logger = logging.getLogger(__name__)
+
+func_retried = django.dispatch.Signal(
+    providing_args=[
+        "func",
+        "attempt",
+        "exception",
+        "delay",
+    ]
+)
+
+# ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+MYSQL_RETRY_CODES = {1213, 1205}
+# serialization_failure, deadlock_detected
+POSTGRESQL_RETRY_CODES = {'40001', '40P01'}
+SQLITE_RETRY_MESSAGES = ('database is locked', 'database table is locked')
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'retries': 0, 'exhausted': 0})
+
+
+def _func_label(func):
+    return '%s.%s' % (func.__class__.__module__, func.__class__.__name__)
+
+
+def _count(func, key):
+    with _stats_lock:
+        _stats[_func_label(func)][key] += 1
+
+
+def retry_stats():
+    """
+    :return: {func label: {'retries': n, 'exhausted': n}} of this process, exhausted counts the calls
+        which still failed on a retryable error after the last attempt.
+    """
+    with _stats_lock:
+        return {label: dict(stats) for label, stats in _stats.items()}
+
+
+def reset_retry_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def is_transient_error(exc):
+    if not isinstance(exc, DatabaseError):
+        return False
+
+    # Django re-raises the error of the driver as its own, keeping the driver one as the cause.
+    for e in (exc, getattr(exc, '__cause__', None)):
+        if e is None:
+            continue
+        if getattr(e, 'pgcode', None) in POSTGRESQL_RETRY_CODES:
+            return True
+        args = getattr(e, 'args', ())
+        if args and args[0] in MYSQL_RETRY_CODES:
+            return True
+        message = str(e)
+        if any(m in message for m in SQLITE_RETRY_MESSAGES):
+            return True
+
+    return False
+
+
+class RetryPolicy(object):
+    """
+    :param max_attempts: number of attempts, including the first one.
+    :param base_delay: delay in seconds before the first retry, doubled for each following one.
+    :param max_delay: upper bound of the delay.
+    :param retry_on: predicate telling whether an exception may be retried, is_transient_error by default.
+    The actual delay is drawn uniformly between 0 and the bound, so that the transactions which have
+    collided do not collide again.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.05, max_delay=1.0, retry_on=None):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1.")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on if retry_on is not None else is_transient_error
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def run(self, func, call, using=None):
+        """
+        Run call in a transaction, retrying it as the policy allows.
+        Inside an enclosing transaction nothing is retried: the failed transaction is the enclosing one.
+        """
+        if transaction.get_connection(using).in_atomic_block:
+            with transaction.atomic(using=using):
+                return call()
+
+        attempt = 1
+        while True:
+            try:
+                with transaction.atomic(using=using):
+                    return call()
+            except Exception as e:
+                if not self.retry_on(e):
+                    raise
+                if attempt >= self.max_attempts:
+                    _count(func, 'exhausted')
+                    raise
+
+                delay = self.backoff(attempt)
+                _count(func, 'retries')
+                logger.warning("Retrying %s after attempt %d failed: %s", _func_label(func), attempt, e)
+                func_retried.send(sender=func.__class__, func=func, attempt=attempt, exception=e, delay=delay)
+                time.sleep(delay)
+                attempt += 1
@@ -0,0 +1,134 @@
+"""
+Read replica routing
+
+Install with DATABASE_ROUTERS = ['base.db.router.ReplicaRouter'] and list the replica aliases in
+settings.WL_DB_REPLICAS. Reads issued inside a read-only func (AbstractFuncClass.READ_ONLY, or a safe
+method of a MethodRoutedFuncClass) go to one of the replicas, everything else goes to the primary
+(settings.WL_DB_PRIMARY, 'default' by default).
+
+Once a session has written, its reads stick to the primary for settings.WL_DB_STICKY_WINDOW seconds,
+so that it reads its own writes whatever the replication lag is. The marks are kept in
+settings.WL_DB_STICKY_CACHE ('sessions' by default).
+"""
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from base.util.thread import ExecutionLocal
+
+
+def get_primary():
+    return getattr(settings, 'WL_DB_PRIMARY', DEFAULT_DB_ALIAS)
+
+
+def get_replicas():
+    return getattr(settings, 'WL_DB_REPLICAS', ())
+
+
+def _sticky_cache():
+    return caches[getattr(settings, 'WL_DB_STICKY_CACHE', 'sessions')]
+
+
+def _sticky_cache_key(sticky_key):
+    return 'wl_db_sticky:%s' % sticky_key
+
+
+def is_sticky(sticky_key):
+    return sticky_key is not None and bool(_sticky_cache().get(_sticky_cache_key(sticky_key)))
+
+
+def stick(sticky_key):
+    """
+    Pin the reads of sticky_key to the primary for the sticky window.
+    """
+    if sticky_key is not None:
+        _sticky_cache().set(_sticky_cache_key(sticky_key), 1, getattr(settings, 'WL_DB_STICKY_WINDOW', 5))
+
+
+class RoutingScope(object):
+    def __init__(self, read_only, sticky_key):
+        self.read_only = read_only
+        self.sticky_key = sticky_key
+        self.written = False
+        # All the reads of a scope go to the same replica, so that they see the same snapshot.
+        self.replica = None
+
+    @property
+    def use_replica(self):
+        return self.read_only and not self.written
+
+
+class _RoutingState(object):
+    scope = None
+
+
+# Kept per greenlet, as the request scopes are.
+_local = ExecutionLocal(_RoutingState)
+
+
+def current_scope():
+    return _local.get().scope
+
+
+@contextmanager
+def routing_scope(read_only, sticky_key=None):
+    """
+    Route the reads issued inside the block. Nested scopes never read from a replica when the enclosing
+    one does not, e.g. a read-only func called by a func which has written.
+    """
+    if not get_replicas():
+        yield None
+        return
+
+    previous = current_scope()
+    if previous is not None and not previous.use_replica:
+        read_only = False
+    if read_only and is_sticky(sticky_key):
+        read_only = False
+
+    scope = RoutingScope(read_only, sticky_key)
+    state = _local.get()
+    state.scope = scope
+    try:
+        yield scope
+    finally:
+        state.scope = previous
+        if scope.written:
+            stick(sticky_key)
+            if previous is not None:
+                previous.written = True
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if not get_replicas():
+            return None
+
+        scope = current_scope()
+        if scope is None or not scope.use_replica:
+            return get_primary()
+
+        if scope.replica is None:
+            scope.replica = random.choice(get_replicas())
+        return scope.replica
+
+    def db_for_write(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas:
+            return None
+
+        scope = current_scope()
+        if scope is not None:
+            scope.written = True
+        # Without an explicit answer, an instance read from a replica would be saved back to it.
+        return get_primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {get_primary()}
+        pool.update(get_replicas())
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
@@ -1,13 +1,39 @@
 import copy
 from functools import partial
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 from .signals import fields_changed
 
 
+class RecordingDeferredAttribute(DeferredAttribute):
+    """
+    Deferred field which records its original value once it is loaded, post_init has not seen it.
+    """
+
+    def __init__(self, field_name, model, manager_name):
+        super(RecordingDeferredAttribute, self).__init__(field_name, model)
+        self.manager_name = manager_name
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super(RecordingDeferredAttribute, self).__get__(instance, cls)
+        fields_obj = instance.__dict__.get(self.manager_name)
+        if fields_obj is not None:
+            fields_obj.original.setdefault(self.field_name, value)
+        return value
+
+
 class ChangedFieldRecorder(object):
     def update_original(self, sender, instance, calc_changed, **kwargs):
+        # Deferred fields are recorded once loaded, by RecordingDeferredAttribute.
+        # Reading them here would cost a query per field.
+        deferred = instance.get_deferred_fields()
         fields = instance._meta.fields
-        original_value = {field.get_attname(): getattr(instance, field.get_attname()) for field in fields}
+        original_value = {
+            field.get_attname(): getattr(instance, field.get_attname())
+            for field in fields if field.get_attname() not in deferred
+        }
         fields_obj = getattr(instance, self.manager_name, None)
         if fields_obj is None:
             fields_obj = ChangedFields()
@@ -29,6 +55,9 @@ class ChangedFieldRecorder(object):
         models.signals.class_prepared.connect(self.finalize, sender=cls, weak=False)
 
     def finalize(self, sender, **kwargs):
+        for field in sender._meta.concrete_fields:
+            if type(sender.__dict__.get(field.attname)) is DeferredAttribute:
+                setattr(sender, field.attname, RecordingDeferredAttribute(field.attname, sender, self.manager_name))
         models.signals.post_init.connect(partial(self.update_original, calc_changed=False), sender=sender, weak=False)
         models.signals.post_save.connect(partial(self.update_original, calc_changed=True), sender=sender, weak=False)
 
@@ -1,29 +1,137 @@
 # coding=utf_8
+import operator
+import itertools
+from functools import reduce
 
 from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth import get_user_model
+from rest_framework.serializers import BaseSerializer
 from base.exceptions import WLException
-from base.util.pages import get_page_info
-from base.util.thread import LocalThreadContextMixin
+from base.util.pages import get_page_info, get_cursor_page
+from base.util.thread import LocalThreadContextMixin, request_scope, nested_scope, current_scope, in_request_scope
+from base.util.timing import permission_profiler
+from base.serializers.utils import project_queryset, values_queryset
+from base.db.router import routing_scope
+
+
+class _RaisedPermission(object):
+    """
+    Failure of a permission which raises by itself from an overridden check.
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+    def fail(self):
+        raise self.exception
+
+
+def _remember(kwargs, key, compute):
+    """
+    Results computed while the func in kwargs checks its permissions are kept in its context, so that its
+    queryset filters reuse them rather than evaluating the permissions again. They are kept per arguments,
+    a permission checked with other ones is evaluated again.
+    """
+    func = kwargs.get('func')
+    evaluations = func.get_context_dict().get('permission_evaluations') if isinstance(func, AbstractFuncClass) else None
+    if evaluations is None:
+        return compute()
+
+    # The queryset filters are given the model besides the arguments of the check.
+    arguments = {k: v for k, v in kwargs.items() if k != 'model'}
+    for checked, results in evaluations:
+        if checked == arguments:
+            break
+    else:
+        results = {}
+        evaluations.append((arguments, results))
+    try:
+        return results[key]
+    except KeyError:
+        result = results[key] = compute()
+        return result
+
+
+def _and_filters(filters):
+    filters = [q for q in filters if q is not None]
+    return reduce(operator.and_, filters) if filters else None
 
 
 class AbstractPermission(LocalThreadContextMixin):
     FAIL = {"code": 401, "message": "Permission Denied"}
     EXCEPTION = WLException
+    # Cache the result in the request scope, keyed by (permission, user).
+    # Only for permissions whose result depends on nothing but the user.
+    CACHE_RESULT = False
 
     def fail(self):
         raise self.EXCEPTION(**self.FAIL)
 
     def check(self, func, request, user, serializer, **kwargs):
-        if not self.check_permission(func=func, request=request, user=user, serializer=serializer, **kwargs):
-            self.fail()
+        failed = self.evaluate(func=func, request=request, user=user, serializer=serializer, **kwargs)
+        if failed is not None:
+            failed.fail()
+
+    def evaluate(self, **kwargs):
+        """
+        :return: None if the permission is granted, else the permission whose fail() is to be raised.
+        """
+        return _remember(kwargs, self, lambda: self._evaluate_cached(kwargs))
+
+    def _evaluate_cached(self, kwargs):
+        if self.CACHE_RESULT and in_request_scope():
+            memo = current_scope().memo
+            key = (AbstractPermission.evaluate, self, kwargs.get('user'))
+            try:
+                return memo[key]
+            except KeyError:
+                failed = memo[key] = self._evaluate(kwargs)
+                return failed
+
+        return self._evaluate(kwargs)
+
+    def _evaluate(self, kwargs):
+        if permission_profiler.enabled:
+            with permission_profiler.profile(kwargs.get('func'), self):
+                return self.evaluate_permission(**kwargs)
+        return self.evaluate_permission(**kwargs)
+
+    def evaluate_permission(self, **kwargs):
+        if self.check.__func__ is not AbstractPermission.check.__func__:
+            # Legacy permission raising from its own check.
+            try:
+                self.check(**kwargs)
+            except self.EXCEPTION as e:
+                return _RaisedPermission(e)
+            return None
+
+        return None if self.check_permission(**kwargs) else self
 
     def check_permission(self, func, request, user, serializer, **kwargs):
         raise NotImplementedError
 
+    def get_queryset_filter(self, **kwargs):
+        """
+        Row level part of the permission, applied by the list funcs before pagination.
+        :param kwargs: those of check, plus model, the model of the listed queryset.
+        :return: Q selecting the rows the permission grants, None for all of them.
+        """
+        return None
+
+    @property
+    def label(self):
+        return self.__class__.__name__
+
+    def __and__(self, other):
+        return LogicAndPermissions((self, other))
+
     def __or__(self, other):
         return LogicOrPermissions((self, other))
 
+    def __invert__(self):
+        return LogicNotPermission(self)
+
 
 class ConditionalPermission(AbstractPermission):
 
@@ -35,39 +143,105 @@ class ConditionalPermission(AbstractPermission):
 
         self._permission = permission
 
-    def check(self, **kwargs):
-        if self._cond_func(**kwargs):
-            self._permission.check(**kwargs)
-        else:
-            pass
+    def condition(self, **kwargs):
+        return _remember(kwargs, (self, 'condition'), lambda: self._cond_func(**kwargs))
 
-    def check_permission(self, func, request, user, serializer, **kwargs):
-        # Do nothing because we override check method.
-        pass
+    def evaluate_permission(self, **kwargs):
+        if self.condition(**kwargs):
+            return self._permission.evaluate(**kwargs)
+        return None
 
+    def get_queryset_filter(self, **kwargs):
+        if self.condition(**kwargs):
+            return self._permission.get_queryset_filter(**kwargs)
+        return None
+
+    @property
+    def label(self):
+        return 'if(%s)' % self._permission.label
+
+
+class _LogicPermissions(AbstractPermission):
+    OPERATOR = None
 
-class LogicOrPermissions(AbstractPermission):
     def __init__(self, permissions):
         if isinstance(permissions, (list, tuple, set)):
             self._permissions = list(permissions)
         else:
             raise TypeError("permissions must be list, tuple or set")
 
-    def check(self, **kwargs):
-        last_exc = None
+    @property
+    def label(self):
+        return '(%s)' % self.OPERATOR.join(perm.label for perm in self._permissions)
+
+
+class LogicOrPermissions(_LogicPermissions):
+    """
+    Granted as soon as one of the permissions is, else fails as the last one.
+    """
+    OPERATOR = ' | '
+
+    def evaluate_permission(self, **kwargs):
+        failed = None
         for perm in self._permissions:
-            try:
-                perm.check(**kwargs)
-            except perm.EXCEPTION as e:
-                last_exc = e
-            else:
-                return
+            failed = perm.evaluate(**kwargs)
+            if failed is None:
+                return None
 
-        raise last_exc
+        return failed
 
-    def check_permission(self, func, request, user, serializer, **kwargs):
-        # Do nothing because we override check method.
-        pass
+    def get_queryset_filter(self, **kwargs):
+        # Rows granted by any of the operands granting the call.
+        filters = []
+        for perm in self._permissions:
+            if perm.evaluate(**kwargs) is None:
+                q = perm.get_queryset_filter(**kwargs)
+                if q is None:
+                    return None
+                filters.append(q)
+
+        return reduce(operator.or_, filters) if filters else Q(pk__in=[])
+
+
+class LogicAndPermissions(_LogicPermissions):
+    """
+    Granted if all the permissions are, else fails as the first one failing.
+    """
+    OPERATOR = ' & '
+
+    def evaluate_permission(self, **kwargs):
+        for perm in self._permissions:
+            failed = perm.evaluate(**kwargs)
+            if failed is not None:
+                return failed
+
+        return None
+
+    def get_queryset_filter(self, **kwargs):
+        return _and_filters(perm.get_queryset_filter(**kwargs) for perm in self._permissions)
+
+
+class LogicNotPermission(AbstractPermission):
+    """
+    Granted if the permission is not. Fails with its own FAIL, which can be given.
+    """
+
+    def __init__(self, permission, fail=None):
+        self._permission = permission
+        if fail is not None:
+            self.FAIL = fail
+
+    def evaluate_permission(self, **kwargs):
+        return self if self._permission.evaluate(**kwargs) is None else None
+
+    def get_queryset_filter(self, **kwargs):
+        # The rows the permission does not grant. Permissions without row level part restrict no row.
+        q = self._permission.get_queryset_filter(**kwargs)
+        return None if q is None else ~q
+
+    @property
+    def label(self):
+        return '~%s' % self._permission.label
 
 
 class RequireUserLoginPermission(AbstractPermission):
@@ -81,33 +255,104 @@ class RequireUserLoginPermission(AbstractPermission):
 
 
 class AbstractFuncClass(LocalThreadContextMixin):
+    """
+    A func instance is shared by all the requests of its view, see WLAPIGenericView.get_dispatch_plan.
+    It keeps no state of its own once shared, the state of a call is kept in its context (set_context).
+    """
     PERMISSIONS = []
     DB_TRANSACTION = False
+    # Reads of read-only funcs may be served by a replica, see base.db.router.
+    READ_ONLY = False
+    # base.db.retry.RetryPolicy re-running DB_TRANSACTION funcs failing on deadlocks and alike.
+    RETRY_POLICY = None
 
     def __call__(self, request, user, kwargs, serializer):
         def real_call():
+            # A second call within the same scope starts from an empty context as well.
+            self.clean_context()
             self.check_permission(request=request, user=user, serializer=serializer, kwargs=kwargs)
             return self.run(request=request, user=user, serializer=serializer, **kwargs)
 
-        self.clean_context()
-        if self.DB_TRANSACTION:
-            with transaction.atomic():
+        def attempt():
+            # A retried attempt must not reuse what a failed one has computed.
+            with nested_scope():
                 return real_call()
-        else:
-            return real_call()
+
+        # Share the scope of the request (or of the calling func), open a fresh one otherwise.
+        with request_scope(reuse=True):
+            read_only = self.is_read_only(request=request, user=user, kwargs=kwargs)
+            with routing_scope(read_only, self.get_sticky_key(request=request, user=user)):
+                if self.DB_TRANSACTION:
+                    if self.RETRY_POLICY is not None:
+                        return self.RETRY_POLICY.run(self, attempt)
+                    with transaction.atomic():
+                        return real_call()
+                else:
+                    return real_call()
+
+    def share(self):
+        """
+        Mark the func as shared by concurrent calls, setting its attributes raises from then on.
+        """
+        object.__setattr__(self, '_shared', True)
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_shared'):
+            raise AttributeError(
+                "%s is shared by concurrent calls, keep %s in its context instead." % (self.__class__.__name__, name)
+            )
+        super(AbstractFuncClass, self).__setattr__(name, value)
+
+    def is_read_only(self, request, user, kwargs):
+        # Reads of a transaction must see its writes, they never go to a replica.
+        return self.READ_ONLY and not self.DB_TRANSACTION
+
+    def get_sticky_key(self, request, user):
+        """
+        :return: key identifying the session whose reads stick to the primary after it has written.
+        """
+        session_key = getattr(getattr(request, 'session', None), 'session_key', None)
+        if session_key is not None:
+            return 'session:%s' % session_key
+        if isinstance(user, get_user_model()):
+            return 'user:%s' % user.pk
+        return None
 
     def get_permissions(self, request, user, serializer, kwargs):
         return self.PERMISSIONS
 
     def check_permission(self, request, user, serializer, kwargs):
+        # [(arguments, {permission: result})], see _remember.
+        self.set_context('permission_evaluations', [])
         for permission in self.get_permissions(request=request, user=user, serializer=serializer, kwargs=kwargs):
             permission.check(func=self, request=request, user=user, serializer=serializer, **kwargs)
 
+    def get_queryset_filter(self, request, user, serializer, kwargs, model):
+        """
+        :return: Q combining the row level filters of the permissions, None if no row is filtered out.
+        """
+        return _and_filters(
+            permission.get_queryset_filter(
+                func=self, request=request, user=user, serializer=serializer, model=model, **kwargs
+            )
+            for permission in self.get_permissions(request=request, user=user, serializer=serializer, kwargs=kwargs)
+        )
+
+    def filter_queryset(self, queryset, request=None, user=None, serializer=None, **kwargs):
+        """
+        Restrict queryset to the rows the permissions grant to the user.
+        """
+        q = self.get_queryset_filter(
+            request=request, user=user, serializer=serializer, kwargs=kwargs, model=queryset.model
+        )
+        return queryset if q is None else queryset.filter(q)
+
     def run(self, request, user, serializer, **kwargs):
         raise NotImplementedError
 
 
 class MethodRoutedFuncClass(AbstractFuncClass):
+    READ_ONLY_METHODS = {'get', 'head', 'options'}
 
     def __init__(self, *args, **kwargs):
         self._cached_permission_dict = {}
@@ -131,6 +376,11 @@ class MethodRoutedFuncClass(AbstractFuncClass):
 
         return self._cached_permission_dict[method]
 
+    def is_read_only(self, request, user, kwargs):
+        if self.DB_TRANSACTION:
+            return False
+        return self.READ_ONLY or request.method.lower() in self.READ_ONLY_METHODS
+
     def run(self, request, user, serializer, **kwargs):
         func = getattr(self, request.method.lower(), None)
         if callable(func):
@@ -139,27 +389,175 @@ class MethodRoutedFuncClass(AbstractFuncClass):
             raise AssertionError("Method {} not implemented.".format(request.method.lower()))
 
 
-class PagedAbstractFuncClass(AbstractFuncClass):
+_no_element = object()
+
+
+class StreamedResult(object):
+    """
+    Result of a func whose list field is produced lazily.
+    The view serializes and writes the elements one at a time with a streaming response.
+    """
+
+    def __init__(self, field_name, elements, extra=None):
+        self.field_name = field_name
+        self.elements = elements
+        self.extra = extra if extra is not None else {}
+
+
+class ElementsFuncMixin(object):
+    """
+    Helpers of the paged funcs for the elements of a page.
+    """
+    # Serializer of one element of the page, the relations it walks through are joined (select_related) or
+    # prefetched (prefetch_related) automatically. When None, the child of the list field of the elements in the
+    # result serializer of the view calling the func.
+    ELEMENT_SERIALIZER = None
+    # Load only the model fields the element serializer represents, with QuerySet.only(). The elements must
+    # not read the other fields afterwards, in transform_elements for instance, or each read is a query.
+    PROJECT_FIELDS = False
+
+    def get_element_serializer(self, **kwargs):
+        """
+        :return: an element serializer instance, or None.
+        """
+        if self.ELEMENT_SERIALIZER is None:
+            return self.get_result_child(**kwargs)
+        return self.ELEMENT_SERIALIZER(**self.get_element_serializer_kwargs(**kwargs))
+
+    def get_result_serializer(self, request=None, **kwargs):
+        """
+        :return: the result serializer class of the view calling the func, None outside of a view.
+        """
+        view = (getattr(request, 'parser_context', None) or {}).get('view')
+        if not hasattr(view, 'get_result_serializer'):
+            return None
+        return view.get_result_serializer(request)
+
+    def get_result_child(self, field_name=None, **kwargs):
+        """
+        :return: the serializer the result serializer represents the elements with, the child of its field
+            field_name, or None.
+        """
+        result_serializer = self.get_result_serializer(**kwargs)
+        if result_serializer is None or field_name is None:
+            return None
+        child = getattr(result_serializer().fields.get(field_name), 'child', None)
+        return child if isinstance(child, BaseSerializer) else None
+
+    def get_element_serializer_kwargs(self, **kwargs):
+        """
+        :return: kwargs of the element serializer. With a DynamicFieldsMixin serializer, the fields / exclude
+            or the context the elements will be represented with, so that only those are loaded.
+        """
+        return {}
+
+    def apply_related(self, queryset, **kwargs):
+        serializer = self.get_element_serializer(**kwargs)
+        if serializer is None:
+            return queryset
+
+        return project_queryset(queryset, serializer, only=self.PROJECT_FIELDS)
+
+    def transform_elements(self, objs, **kwargs):
+        """
+        Transform all the objects of the page (or of a streamed chunk) at once,
+        override it to enrich the elements with one query per relation.
+        :param objs: list of objects.
+        :return: list of elements.
+        """
+        return [self.transform_element(obj, **kwargs) for obj in objs]
+
+    def transform_element(self, obj, **kwargs):
+        return obj
+
+    def transform_queryset(self, queryset, **kwargs):
+        return queryset
+
+
+class PagedAbstractFuncClass(ElementsFuncMixin, AbstractFuncClass):
+    # Stream the page, the queryset is then fetched in chunks of STREAM_CHUNK_SIZE objects
+    # while the response is written, in the request scope of the func but after run has returned.
+    # The chunks would be read outside of the transaction, so it cannot be combined with DB_TRANSACTION.
+    STREAMING = False
+    STREAM_CHUNK_SIZE = 100
+    # None for an exact count, or an instance of base.util.pages.CachedCount / EstimatedCount.
+    COUNT_PROVIDER = None
+    # Fetch the elements with QuerySet.values(), as dicts the element serializer represents as it does the
+    # model instances, when all its fields are read from model fields. The values are those of the serializer
+    # of the elements in the result serializer of the view, the element serializer outside of a view.
+    # No model instance is created, the elements given to transform_queryset and transform_elements are
+    # dicts then.
+    VALUES_LIST = False
+
     def run(self, page, count_per_page, **kwargs):
+        if self.STREAMING and self.DB_TRANSACTION:
+            raise AssertionError("STREAMING cannot be combined with DB_TRANSACTION.")
+
         qs, field_name, extra = self.get_paged_qs(page=page, count_per_page=count_per_page, **kwargs)
 
         if extra is None:
             extra = {}
 
+        qs = self.filter_queryset(qs, page=page, count_per_page=count_per_page, **kwargs)
+        count_provider = self.get_count_provider(page=page, count_per_page=count_per_page, **kwargs)
+        out_of_range_exception = self.out_of_range_exception(page=page, count_per_page=count_per_page, **kwargs)
         start, end, n_pages = get_page_info(
             qs, count_per_page, page,
-            index_error_excepiton=self.out_of_range_exception(page=page, count_per_page=count_per_page, **kwargs)
+            index_error_excepiton=out_of_range_exception,
+            count_provider=count_provider,
         )
+
+        qs = self.apply_related(qs, field_name=field_name, page=page, count_per_page=count_per_page, **kwargs)
+
+        if self.STREAMING:
+            # Chunks are fetched after run has returned, pin them to the database routed now.
+            qs = qs.using(qs.db)
+            elements = self.iter_elements(qs, start, end, page=page, count_per_page=count_per_page, **kwargs)
+            if page != 0 and count_provider is not None and not count_provider.exact:
+                # A page beyond the last one must fail before the response is started,
+                # the first chunk is fetched now to find out.
+                first = next(elements, _no_element)
+                if first is _no_element:
+                    raise out_of_range_exception
+                elements = itertools.chain([first], elements)
+
+            return StreamedResult(field_name, elements, dict({'n_pages': n_pages}, **extra))
+
         qs_paged = qs[start:end]
         qs_transformed = self.transform_queryset(qs_paged, page=page, count_per_page=count_per_page, **kwargs)
+        elements = self.transform_elements(list(qs_transformed), page=page, count_per_page=count_per_page, **kwargs)
+        if not elements and page != 0 and count_provider is not None and not count_provider.exact:
+            # The estimated count let a page beyond the last one through.
+            raise out_of_range_exception
+
         return dict({
-            field_name: [
-                self.transform_element(obj, page=page, count_per_page=count_per_page, **kwargs)
-                for obj in qs_transformed
-            ],
+            field_name: elements,
             'n_pages': n_pages,
         }, **extra)
 
+    def apply_related(self, queryset, **kwargs):
+        if self.VALUES_LIST:
+            # The elements are represented by the result serializer, whatever ELEMENT_SERIALIZER is.
+            serializer = self.get_result_child(**kwargs)
+            if serializer is None:
+                serializer = self.get_element_serializer(**kwargs)
+            if serializer is not None:
+                values = values_queryset(queryset, serializer)
+                if values is not None:
+                    return values
+
+        return super(PagedAbstractFuncClass, self).apply_related(queryset, **kwargs)
+
+    def iter_elements(self, qs, start, end, **kwargs):
+        for chunk_start in range(start, end, self.STREAM_CHUNK_SIZE):
+            chunk = qs[chunk_start:min(end, chunk_start + self.STREAM_CHUNK_SIZE)]
+            objs = list(self.transform_queryset(chunk, **kwargs))
+            for element in self.transform_elements(objs, **kwargs):
+                yield element
+
+            if len(objs) < self.STREAM_CHUNK_SIZE:
+                break
+
     def get_paged_qs(self, **kwargs):
         """
 
@@ -168,11 +566,48 @@ class PagedAbstractFuncClass(AbstractFuncClass):
         """
         raise NotImplementedError
 
+    def get_count_provider(self, **kwargs):
+        return self.COUNT_PROVIDER
+
     def out_of_range_exception(self, **kwargs):
         return WLException(400, u"页码超出范围")
 
-    def transform_element(self, obj, **kwargs):
-        return obj
 
-    def transform_queryset(self, queryset, **kwargs):
-        return queryset
+class CursorPagedAbstractFuncClass(ElementsFuncMixin, AbstractFuncClass):
+    """
+    Keyset paginated sibling of PagedAbstractFuncClass: neither COUNT(*) nor OFFSET is issued,
+    pages are located through the cursors returned along with each page.
+    The queryset must be ordered by field paths, the primary key is appended to make the ordering total.
+    """
+
+    def run(self, count_per_page, cursor=None, **kwargs):
+        qs, field_name, extra = self.get_paged_qs(cursor=cursor, count_per_page=count_per_page, **kwargs)
+
+        if extra is None:
+            extra = {}
+
+        qs = self.filter_queryset(qs, cursor=cursor, count_per_page=count_per_page, **kwargs)
+        qs = self.apply_related(qs, field_name=field_name, cursor=cursor, count_per_page=count_per_page, **kwargs)
+        qs = self.transform_queryset(qs, cursor=cursor, count_per_page=count_per_page, **kwargs)
+        objs, next_cursor, prev_cursor = get_cursor_page(
+            qs, count_per_page, cursor,
+            invalid_cursor_exception=self.invalid_cursor_exception(
+                cursor=cursor, count_per_page=count_per_page, **kwargs
+            )
+        )
+        return dict({
+            field_name: self.transform_elements(objs, cursor=cursor, count_per_page=count_per_page, **kwargs),
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+        }, **extra)
+
+    def get_paged_qs(self, **kwargs):
+        """
+
+        :param kwargs:
+        :return: queryset, field name, extra fields.
+        """
+        raise NotImplementedError
+
+    def invalid_cursor_exception(self, **kwargs):
+        return WLException(400, u"分页游标无效")
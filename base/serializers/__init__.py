@@ -10,15 +10,22 @@ from .login import (
 from .page import (
     PageApiSerializer,
     PagedListSerializerMixin,
+    CursorPageApiSerializer,
+    CursorPagedListSerializerMixin,
 )
 from .api import (
     ReadonlySerializer,
     ApiSerializer,
+    ModelSerializer,
 )
 from .gps import (
     GPSInfoSerializer,
     OptionalGPSInfoSerializer,
 )
+from .batch import (
+    BatchItemApiSerializer,
+    BatchApiSerializer,
+)
 from .aggregate import (
     AggregateListSerializer,
 )
@@ -1,12 +1,36 @@
 # coding=utf-8
+import operator
+from collections import OrderedDict
+
+import six
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models.query import QuerySet
 from rest_framework import serializers
-from rest_framework.fields import get_attribute
+from rest_framework.fields import get_attribute, SkipField
+from rest_framework.relations import PKOnlyObject
 from .api import ReadonlySerializer
 
 
+def _count(lhs, rhs):
+    return lhs + (rhs is not None)
+
+
+# reduction: (database aggregate, reduction of a value, combination of the initial value with the aggregate)
+REDUCTIONS = {
+    'sum': (models.Sum, operator.add, operator.add),
+    'min': (models.Min, min, min),
+    'max': (models.Max, max, max),
+    'count': (models.Count, _count, operator.add),
+}
+
+
 # A helper serializer for aggregations.
 class AggregateListSerializer(ReadonlySerializer):
     aggregates = serializers.ListField(read_only=True)
+    # One of REDUCTIONS. When the instance is a queryset not evaluated yet and all the aggregated fields are
+    # model fields, the totals are computed by the database, unless top_level_reduce is overridden.
+    REDUCTION = 'sum'
 
     def __init__(self, child=None, *args, **kwargs):
         self.child = child
@@ -42,7 +66,43 @@ class AggregateListSerializer(ReadonlySerializer):
         return 'total_%s' % field
 
     def top_level_reduce(self, lhs, rhs):
-        return lhs + rhs
+        return REDUCTIONS[self.REDUCTION][1](lhs, rhs)
+
+    def can_aggregate_in_database(self, real_instance, fields):
+        if not isinstance(real_instance, QuerySet) or real_instance._result_cache is not None:
+            return False
+        if six.get_unbound_function(type(self).top_level_reduce) is not _top_level_reduce:
+            return False
+
+        opts = real_instance.model._meta
+        for field in fields:
+            try:
+                model_field = opts.get_field(field)
+            except FieldDoesNotExist:
+                return False
+            if not model_field.concrete or model_field.is_relation:
+                return False
+        return True
+
+    def reduce_totals(self, real_instance, totals):
+        """
+        :param totals: [(field, total name, initial value)]
+        :return: {total name: total}
+        """
+        if self.can_aggregate_in_database(real_instance, [field for field, _, _ in totals]):
+            aggregate, _, combine = REDUCTIONS[self.REDUCTION]
+            aggregated = real_instance.aggregate(**{name: aggregate(field) for field, name, _ in totals})
+            return {
+                name: initial if aggregated[name] is None else combine(initial, aggregated[name])
+                for field, name, initial in totals
+            }
+
+        values = {name: initial for field, name, initial in totals}
+        reduce = self.top_level_reduce
+        for obj in real_instance:
+            for field, name, _ in totals:
+                values[name] = reduce(values[name], get_attribute(obj, [field]))
+        return values
 
     def to_representation(self, instance):
 
@@ -50,28 +110,38 @@ class AggregateListSerializer(ReadonlySerializer):
         real_instance = self.get_real_instance(instance)
         child = self.resolve_child_type(real_instance, agg_op)
 
-        transformed_instance = {
-            'aggregates': real_instance
-        }
-
+        # The fields depend on the instance, they are bound to the serializer but not added to its fields.
+        aggregates = self.__dict__.get('_aggregates_field')
+        if aggregates is None or aggregates.child is not child:
+            aggregates = self._aggregates_field = serializers.ListField(child=child)
+            aggregates.bind('aggregates', self)
+        total_fields = OrderedDict()
+        totals = []
         for field, (field_serializer, initial) in self.get_aggregate_types_and_defaults(real_instance, agg_op).items():
-            transformed_instance[self.get_aggregate_field_name(field, real_instance, agg_op)] = initial
-            self.fields[self.get_aggregate_field_name(field, real_instance, agg_op)] = field_serializer
+            name = self.get_aggregate_field_name(field, real_instance, agg_op)
+            field_serializer.bind(name, self)
+            total_fields[name] = field_serializer
+            totals.append((field, name, initial))
 
-        for obj in real_instance:
-            for field in self.get_aggregate_types_and_defaults(real_instance, agg_op):
-                value = get_attribute(obj, [field])
-                transformed_instance[
-                    self.get_aggregate_field_name(field, real_instance, agg_op)
-                ] = self.top_level_reduce(
-                    transformed_instance[
-                        self.get_aggregate_field_name(field, real_instance, agg_op)
-                    ],
-                    value,
-                )
-
-        self.fields['aggregates'] = serializers.ListField(
-            child=child,
-        )
-
-        return super(AggregateListSerializer, self).to_representation(transformed_instance)
+        transformed_instance = self.reduce_totals(real_instance, totals)
+        transformed_instance['aggregates'] = real_instance
+
+        fields = [
+            aggregates if f.field_name == 'aggregates' else total_fields.pop(f.field_name, f)
+            for f in self._readable_fields
+        ]
+        fields.extend(total_fields.values())
+        ret = OrderedDict()
+        for field in fields:
+            try:
+                attribute = field.get_attribute(transformed_instance)
+            except SkipField:
+                continue
+
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+
+        return ret
+
+
+_top_level_reduce = six.get_unbound_function(AggregateListSerializer.top_level_reduce)
@@ -2,6 +2,8 @@
 from __future__ import unicode_literals
 from rest_framework import serializers
 
+from .fields.decimal import FIXED_POINT_FIELD_MAPPING
+
 
 class ReadonlySerializer(serializers.Serializer):
     def update(self, instance, validated_data):
@@ -13,3 +15,11 @@ class ReadonlySerializer(serializers.Serializer):
 
 class ApiSerializer(ReadonlySerializer):
     pass
+
+
+class ModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer mapping the fixed point model fields of base.db.common_fields to their serializer fields.
+    """
+    serializer_field_mapping = dict(serializers.ModelSerializer.serializer_field_mapping)
+    serializer_field_mapping.update(FIXED_POINT_FIELD_MAPPING)
@@ -0,0 +1,31 @@
+# coding=utf-8
+from __future__ import unicode_literals
+from django.conf import settings
+from rest_framework import serializers
+from .api import ApiSerializer
+
+
+class BatchItemApiSerializer(serializers.Serializer):
+    METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+    path = serializers.CharField()
+    method = serializers.CharField(default='get')
+    data = serializers.JSONField(default=dict)
+    context = serializers.JSONField(default=None, allow_null=True)
+
+    def validate_method(self, value):
+        value = value.lower()
+        if value not in self.METHODS:
+            raise serializers.ValidationError('Method %s is not supported.' % value)
+        return value
+
+
+class BatchApiSerializer(ApiSerializer):
+    requests = BatchItemApiSerializer(many=True)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        max_items = getattr(settings, 'WL_BATCH_MAX_ITEMS', 20)
+        if len(value) > max_items:
+            raise serializers.ValidationError('At most %d requests are allowed in a batch.' % max_items)
+        return value
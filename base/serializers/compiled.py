@@ -0,0 +1,183 @@
+# coding=utf-8
+"""
+Compiled representation
+
+CompiledSerializerMixin replaces the generic to_representation of a read only serializer by a function
+compiled from its fields, which reads the attributes directly and builds ordered dicts. What the compiler
+knows is done without going through the field: plain attributes, primary keys, integers, strings,
+timestamps, alias choices and nested serializers. Anything else is delegated to the field, so the output is
+the one of the generic path.
+
+The analysis of the fields is kept per class, keyed by the names of the fields left, and bound to the fields
+of each serializer instance once.
+"""
+from __future__ import unicode_literals
+
+from collections import Mapping, OrderedDict
+
+import six
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import Field, SkipField, is_simple_callable
+from rest_framework.relations import PKOnlyObject
+
+from base.util.timestamp import datetime_to_timestamp
+from .utils import DynamicFieldsMixin, _defines
+from .fields.timestamp import TimestampField
+from .fields.choice import AliasChoiceField
+
+
+# Field classes whose to_representation is a pure function of the value.
+CONVERTERS = {
+    serializers.IntegerField: lambda field: int,
+    serializers.CharField: lambda field: six.text_type,
+    TimestampField: lambda field: datetime_to_timestamp,
+    AliasChoiceField: lambda field: field.read_field_choice.get_alias,
+}
+
+_ATTRIBUTE, _PK, _GENERIC = 0, 1, 2
+
+
+def _generic_representation(cls):
+    return _defines(cls, 'to_representation', (
+        Field, serializers.BaseSerializer, serializers.Serializer, DynamicFieldsMixin, CompiledSerializerMixin
+    ))
+
+
+def is_compilable(serializer):
+    if isinstance(serializer, serializers.ListSerializer):
+        return (
+            _defines(type(serializer), 'to_representation', (
+                Field, serializers.BaseSerializer, serializers.ListSerializer
+            ))
+            and is_compilable(serializer.child)
+        )
+    return isinstance(serializer, serializers.Serializer) and _generic_representation(type(serializer))
+
+
+def _field_spec(field):
+    """
+    :return: (name, way to get the attribute, pure converter or None).
+    """
+    getter = _GENERIC
+    if len(field.source_attrs) == 1:
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.use_pk_only_optimization() and field.pk_field is None and _defines(
+                type(field), 'get_attribute', (Field, serializers.RelatedField)
+            ):
+                getter = _PK
+        elif _defines(type(field), 'get_attribute', (Field, )):
+            getter = _ATTRIBUTE
+
+    converter = CONVERTERS.get(type(field))
+    return field.field_name, field.source_attrs[-1] if field.source_attrs else None, getter, (
+        converter(field) if converter is not None else None
+    )
+
+
+def _get_specs(serializer, fields):
+    cls = type(serializer)
+    specs = cls.__dict__.get('_compiled_specs')
+    if specs is None:
+        specs = cls._compiled_specs = {}
+    key = tuple(field.field_name for field in fields)
+    spec = specs.get(key)
+    if spec is None:
+        spec = specs[key] = [_field_spec(field) for field in fields]
+    return spec
+
+
+def _compile_nested(field):
+    """
+    :return: the function representing a non None attribute with field.
+    """
+    if isinstance(field, serializers.BaseSerializer) and is_compilable(field):
+        if isinstance(field, serializers.ListSerializer):
+            represent_item = compile_serializer(field.child)
+
+            def represent_list(data):
+                iterable = data.all() if isinstance(data, models.Manager) else data
+                return [represent_item(item) for item in iterable]
+
+            return represent_list
+        return compile_serializer(field)
+
+    return field.to_representation
+
+
+def compile_serializer(serializer):
+    """
+    :param serializer: a bound serializer instance, with its fields filtered.
+    :return: function(instance) -> dict representing instance as serializer does.
+    """
+    if not is_compilable(serializer):
+        return serializer.to_representation
+    if isinstance(serializer, DynamicFieldsMixin):
+        serializer.filter_field_context()
+
+    fields = [field for field in serializer.fields.values() if not field.write_only]
+    steps = []
+    for field, (name, attr, getter, converter) in zip(fields, _get_specs(serializer, fields)):
+        if converter is None:
+            converter = _compile_nested(field)
+        steps.append((name, attr, getter, converter, field))
+
+    def represent(instance):
+        if isinstance(instance, Mapping):
+            getter_override = _GENERIC
+        else:
+            getter_override = None
+
+        ret = OrderedDict()
+        for name, attr, getter, converter, field in steps:
+            if getter_override is not None:
+                getter = getter_override
+            try:
+                if getter is _ATTRIBUTE:
+                    try:
+                        value = getattr(instance, attr)
+                    except (AttributeError, KeyError, ObjectDoesNotExist):
+                        value = field.get_attribute(instance)
+                    else:
+                        if callable(value) and is_simple_callable(value):
+                            value = field.get_attribute(instance)
+                elif getter is _PK:
+                    try:
+                        value = instance.serializable_value(attr)
+                    except AttributeError:
+                        value = field.get_attribute(instance)
+                    else:
+                        if not (callable(value) and is_simple_callable(value)):
+                            ret[name] = value
+                            continue
+                        value = field.get_attribute(instance)
+                else:
+                    value = field.get_attribute(instance)
+            except SkipField:
+                continue
+
+            if value is None or (isinstance(value, PKOnlyObject) and value.pk is None):
+                ret[name] = None
+            else:
+                ret[name] = converter(value)
+        return ret
+
+    return represent
+
+
+class CompiledSerializerMixin(serializers.BaseSerializer):
+    """
+    Represent with a compiled function, for read only serializers. Put it first in the bases.
+    The representation is an OrderedDict in the order of the fields, like the generic one.
+    """
+
+    def to_representation(self, instance):
+        represent = self.__dict__.get('_compiled_representation')
+        if represent is None:
+            if _generic_representation(type(self)):
+                represent = compile_serializer(self)
+            else:
+                represent = super(CompiledSerializerMixin, self).to_representation
+            self._compiled_representation = represent
+        return represent(instance)
@@ -1,4 +1,19 @@
+from __future__ import absolute_import
+
+import decimal
+
+import six
+from django.utils.formats import localize_input
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from base.db import common_fields
+from base.util.fixed_point import to_units, from_units, format_units
+
+__all__ = [
+    'CurrencyField', 'QuantityField', 'LatField', 'LngField',
+    'FixedPointField', 'FixedCurrencyField', 'FixedQuantityField', 'FixedLatField', 'FixedLngField',
+]
 
 
 class CurrencyField(serializers.DecimalField):
@@ -49,3 +64,95 @@ class LngField(serializers.DecimalField):
             max_value=max_value,
             **kwargs
         )
+
+
+class FixedPointField(serializers.DecimalField):
+    """
+    Decimal of the API for the fixed point model fields of base.db.common_fields, whose values are the integer
+    counts of units of 10 ** -decimal_places.
+    min_value and max_value are decimals.
+    """
+    MAX_DIGITS = None
+    DECIMAL_PLACES = 0
+    # Round the decimal places in excess of the input instead of rejecting it.
+    ROUND_EXCESS_PLACES = False
+
+    def __init__(self, *args, **kwargs):
+        max_digits = kwargs.pop('max_digits', self.MAX_DIGITS)
+        decimal_places = kwargs.pop('decimal_places', self.DECIMAL_PLACES)
+        # Checked on the decimal, the validators see the units.
+        min_value = kwargs.pop('min_value', None)
+        max_value = kwargs.pop('max_value', None)
+        if self.ROUND_EXCESS_PLACES:
+            kwargs.setdefault('rounding', decimal.ROUND_HALF_UP)
+        super(FixedPointField, self).__init__(
+            *args, max_digits=max_digits, decimal_places=decimal_places, **kwargs
+        )
+        self.min_decimal = min_value
+        self.max_decimal = max_value
+
+    def validate_precision(self, value):
+        if self.ROUND_EXCESS_PLACES:
+            value = self.quantize(value)
+        return super(FixedPointField, self).validate_precision(value)
+
+    def to_internal_value(self, data):
+        value = super(FixedPointField, self).to_internal_value(data)
+        if self.min_decimal is not None and value < self.min_decimal:
+            self.fail('min_value', min_value=self.min_decimal)
+        if self.max_decimal is not None and value > self.max_decimal:
+            self.fail('max_value', max_value=self.max_decimal)
+        return to_units(value, self.decimal_places)
+
+    def to_representation(self, value):
+        if not isinstance(value, six.integer_types):
+            # An aggregate of the column for instance.
+            value = to_units(value, self.decimal_places, self.rounding or decimal.ROUND_HALF_EVEN)
+
+        if not getattr(self, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING):
+            return from_units(value, self.decimal_places)
+        if self.localize:
+            return localize_input(from_units(value, self.decimal_places))
+        return format_units(value, self.decimal_places)
+
+
+class FixedCurrencyField(FixedPointField):
+    MAX_DIGITS = 12
+    DECIMAL_PLACES = 3
+
+
+class FixedQuantityField(FixedPointField):
+    MAX_DIGITS = 15
+    DECIMAL_PLACES = 6
+
+
+class FixedLatField(FixedPointField):
+    MAX_DIGITS = 10
+    DECIMAL_PLACES = 7
+    ROUND_EXCESS_PLACES = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('min_value', -90)
+        kwargs.setdefault('max_value', 90)
+        super(FixedLatField, self).__init__(*args, **kwargs)
+
+
+class FixedLngField(FixedPointField):
+    MAX_DIGITS = 10
+    DECIMAL_PLACES = 7
+    ROUND_EXCESS_PLACES = True
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('min_value', 0)
+        kwargs.setdefault('max_value', 360)
+        super(FixedLngField, self).__init__(*args, **kwargs)
+
+
+# Serializer fields of the fixed point model fields, mapped by base.serializers.ModelSerializer.
+FIXED_POINT_FIELD_MAPPING = {
+    common_fields.FixedPointField: FixedPointField,
+    common_fields.FixedCurrencyField: FixedCurrencyField,
+    common_fields.FixedQuantityField: FixedQuantityField,
+    common_fields.FixedLatField: FixedLatField,
+    common_fields.FixedLngField: FixedLngField,
+}
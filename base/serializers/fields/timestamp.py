@@ -1,22 +1,23 @@
-import datetime
 from rest_framework import serializers
-from pytz import timezone
+from rest_framework.settings import api_settings
+
+from base.util.timestamp import datetime_to_timestamp, timestamp_to_utc_datetime
+
+__all__ = ['TimestampField', 'LocalDateTimeField']
 
 
 class TimestampField(serializers.Field):
     def to_representation(self, value):
-        epoch = datetime.datetime(1970, 1, 1, tzinfo=timezone('UTC'))
-        return int((value - epoch).total_seconds())
+        return datetime_to_timestamp(value)
 
     def to_internal_value(self, data):
-        # type: (int) -> datetime
-        return datetime.datetime.utcfromtimestamp(float(data)).replace(tzinfo=timezone('UTC'))
+        return timestamp_to_utc_datetime(data)
 
 
 class LocalDateTimeField(serializers.DateTimeField):
 
     def to_representation(self, value):
-        from rest_framework.settings import api_settings
-        output_format = getattr(self, 'format', api_settings.DATETIME_FORMAT)
-        value = self.enforce_timezone(value)
-        return value.strftime(output_format)
+        output_format = self.__dict__.get('_output_format')
+        if output_format is None:
+            output_format = self._output_format = getattr(self, 'format', api_settings.DATETIME_FORMAT)
+        return self.enforce_timezone(value).strftime(output_format)
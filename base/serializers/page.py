@@ -8,3 +8,13 @@ class PageApiSerializer(serializers.Serializer):
 
 class PagedListSerializerMixin(serializers.Serializer):
     n_pages = serializers.IntegerField()
+
+
+class CursorPageApiSerializer(serializers.Serializer):
+    cursor = serializers.CharField(default=None, allow_null=True, allow_blank=True)
+    count_per_page = serializers.IntegerField(default=10, min_value=1, max_value=100)
+
+
+class CursorPagedListSerializerMixin(serializers.Serializer):
+    next_cursor = serializers.CharField(allow_null=True)
+    prev_cursor = serializers.CharField(allow_null=True)
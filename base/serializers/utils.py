@@ -1,7 +1,17 @@
 # coding=utf-8
 
 import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import ValuesIterable
+from django.db.models.query_utils import DeferredAttribute
+import six
 from rest_framework import serializers
+from rest_framework.utils.serializer_helpers import BindingDict
 
 
 def set_deep_dict(root, key_tuple, value, dict_type=dict):
@@ -15,77 +25,171 @@ def set_deep_dict(root, key_tuple, value, dict_type=dict):
     p[key_tuple[-1]] = value
 
 
+def _nested_fields(field):
+    """
+    :return: (fields of a nested serializer, fields of the serializer of the list items), None if unknown.
+    """
+    if isinstance(field, (serializers.ListSerializer, serializers.ListField)):
+        child = field.child
+        return None, child.fields if isinstance(child, serializers.Serializer) else None
+    if isinstance(field, serializers.Serializer):
+        return field.fields, None
+    return None, None
+
+
+# Fields represented by a scalar, when they are of exactly these classes.
+SCALAR_FIELDS = frozenset([
+    serializers.BooleanField, serializers.NullBooleanField, serializers.CharField, serializers.EmailField,
+    serializers.SlugField, serializers.URLField, serializers.UUIDField, serializers.IntegerField,
+    serializers.FloatField, serializers.DecimalField, serializers.DateTimeField, serializers.DateField,
+    serializers.TimeField, serializers.PrimaryKeyRelatedField,
+])
+
+
+class FlatPlan(object):
+    """
+    Keys of the flattened representation of a serializer, derived from its fields.
+    flatten: {key: (flat key, whether the value is a scalar, prefix of the nested keys, plan of a nested dict,
+              plan of the list items)}
+    unflatten: {flat key: (key path, plan of the list items)}
+    """
+
+    def __init__(self, fields, splitter, prefix='', unflatten=None):
+        self.flatten = {}
+        self.unflatten = {} if unflatten is None else unflatten
+        for name, field in fields.items():
+            flat_key = prefix + name
+            nested_fields, item_fields = _nested_fields(field)
+            nested_plan = item_plan = None
+            if nested_fields is not None:
+                nested_plan = FlatPlan(nested_fields, splitter, flat_key + splitter, self.unflatten)
+            if item_fields is not None:
+                item_plan = FlatPlan(item_fields, splitter)
+            scalar = type(field) in SCALAR_FIELDS
+            self.flatten[name] = (flat_key, scalar, flat_key + splitter, nested_plan, item_plan)
+            self.unflatten[flat_key] = (tuple(flat_key.split(splitter)), item_plan)
+
+
 class FlatSerializeMixin(serializers.BaseSerializer):
     splitter = '__'
 
+    @classmethod
+    def get_flat_plan(cls, serializer):
+        """
+        Plan built once per class from the unfiltered fields of serializer, an instance of the class.
+        Keys missing from the plan, e.g. those of a JSONField, take the generic path.
+        """
+        plan = cls.__dict__.get('_flat_plan')
+        if plan is None:
+            plan = FlatPlan(serializer.get_fields(), cls.splitter)
+            cls._flat_plan = plan
+        return plan
+
     def to_internal_value(self, data):
         if self.context.get('flatten_api', True):
-            data = self.reverse_flat_dict(data)
+            data = self.reverse_flat_dict(data, self.get_flat_plan(self))
 
         return super(FlatSerializeMixin, self).to_internal_value(data)
 
-    def reverse_flat_dict(self, data):
-        # type: (dict) -> dict
+    def reverse_flat_dict(self, data, plan=None):
+        # type: (dict, FlatPlan) -> dict
         data_result = {}
+        unflatten = plan.unflatten if plan is not None else {}
         for k, v in data.items():
+            entry = unflatten.get(k)
+            if entry is None:
+                path, item_plan = k.split(self.splitter), None
+            else:
+                path, item_plan = entry
             if isinstance(v, list):
-                v = self.reverse_flat_list(v)
-            set_deep_dict(data_result, k.split(self.splitter), v, dict)
-
-        return data_result
-
-    def reverse_flat_list(self, data):
-        # type: (list) -> list
-        data_result = []
-        for v in data:
-            if isinstance(v, dict):
-                v_dict = self.reverse_flat_dict(v)
-                data_result.append(v_dict)
-            elif isinstance(v, list):
-                data_result.append(v)
+                v = self.reverse_flat_list(v, item_plan)
+            if len(path) == 1:
+                data_result[path[0]] = v
             else:
-                data_result.append(v)
+                set_deep_dict(data_result, path, v, dict)
 
         return data_result
 
+    def reverse_flat_list(self, data, plan=None):
+        # type: (list, FlatPlan) -> list
+        return [self.reverse_flat_dict(v, plan) if isinstance(v, dict) else v for v in data]
+
     def to_representation(self, instance):
         rep = super(FlatSerializeMixin, self).to_representation(instance)
         if self.context.get('flatten', True):
-            return self.flat_dict(rep)
+            return self.flat_dict(rep, self.get_flat_plan(self))
         else:
             return rep
 
-    def flat_dict(self, rep):
-        # type: (dict) -> dict
+    def flat_dict(self, rep, plan=None):
+        # type: (dict, FlatPlan) -> dict
         rep_result = {}
+        self._flat_dict_into(rep, plan, rep_result, '')
+        return rep_result
+
+    def _flat_dict_into(self, rep, plan, rep_result, prefix):
+        flatten = plan.flatten if plan is not None else {}
         for k, v in rep.items():
-            if isinstance(v, dict):
-                v_dict = self.flat_dict(v)
-                for ks, vs in v_dict.items():
-                    rep_result[
-                        '{}{}{}'.format(k, self.splitter, ks)
-                    ] = vs
-            elif isinstance(v, list):
-                v_list = self.flat_list(v)
-                rep_result[k] = v_list
+            entry = flatten.get(k)
+            if entry is None:
+                flat_key = prefix + k
+                nested_prefix, nested_plan, item_plan = flat_key + self.splitter, None, None
             else:
-                rep_result[k] = v
-
-        return rep_result
+                flat_key, scalar, nested_prefix, nested_plan, item_plan = entry
+                if scalar:
+                    rep_result[flat_key] = v
+                    continue
 
-    def flat_list(self, rep):
-        # type: (list) -> list
-        rep_result = []
-        for v in rep:
             if isinstance(v, dict):
-                v_dict = self.flat_dict(v)
-                rep_result.append(v_dict)
+                self._flat_dict_into(v, nested_plan, rep_result, nested_prefix)
             elif isinstance(v, list):
-                rep_result.append(v)
+                rep_result[flat_key] = self.flat_list(v, item_plan)
             else:
-                rep_result.append(v)
+                rep_result[flat_key] = v
 
-        return rep_result
+    def flat_list(self, rep, plan=None):
+        # type: (list, FlatPlan) -> list
+        return [self.flat_dict(v, plan) if isinstance(v, dict) else v for v in rep]
+
+
+def _clone_field(field):
+    clone = copy.deepcopy(field)
+    # Field.__deepcopy__ shares the validators, some of them keep the state of the field they validate.
+    if '_validators' in clone.__dict__:
+        clone._validators = [copy.copy(v) for v in clone._validators]
+    return clone
+
+
+def _frozen_names(names):
+    return None if names is None else frozenset(names)
+
+
+class PrototypeBindingDict(BindingDict):
+    """
+    Fields of a serializer which copies and binds the shared prototype of a field when it is first looked up,
+    so that the fields it drops are never copied.
+    """
+
+    def __init__(self, serializer, prototypes):
+        super(PrototypeBindingDict, self).__init__(serializer)
+        self.fields.update(prototypes)
+        self.pending = set(prototypes)
+
+    def __setitem__(self, key, field):
+        self.pending.discard(key)
+        super(PrototypeBindingDict, self).__setitem__(key, field)
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            self[key] = _clone_field(self.fields[key])
+        return self.fields[key]
+
+    def __delitem__(self, key):
+        self.pending.discard(key)
+        super(PrototypeBindingDict, self).__delitem__(key)
+
+
+_prototypes_lock = threading.Lock()
 
 
 class DynamicFieldsMixin(serializers.BaseSerializer):
@@ -95,16 +199,22 @@ class DynamicFieldsMixin(serializers.BaseSerializer):
     DYNAMIC_FIELD_CONTEXT_KEY = 'fields'
     DYNAMIC_EXCLUDE_CONTEXT_KEY = 'exclude'
     CONTEXT_KEY_SPLITTER = '.'
+    # The fields filtered by the fields / exclude args are kept per class as prototypes, which an instance
+    # copies when it first looks a field up instead of building and filtering them again. Turn it off when
+    # get_fields of the serializer depends on the instance, not only on its class.
+    CACHE_FIELDS = True
+    # The least recently used prototypes are dropped past this number of fields / exclude args per class.
+    FIELDS_CACHE_SIZE = 64
 
     def filter_fields(self, fields):
         for field in self.fields.keys():
             if field not in fields:
-                self.fields.pop(field)
+                del self.fields[field]
 
     def exclude_fields(self, fields):
         for field in fields:
             if field in self.fields:
-                self.fields.pop(field)
+                del self.fields[field]
 
     def context_key(self, postfix):
         sources = [postfix]
@@ -116,26 +226,92 @@ class DynamicFieldsMixin(serializers.BaseSerializer):
         return self.CONTEXT_KEY_SPLITTER.join(sources)
 
     def __init__(self, *args, **kwargs):
-        fields = kwargs.pop(self.DYNAMIC_FIELD_ARG_KEY, None)
-        exclude = kwargs.pop(self.DYNAMIC_EXCLUDE_ARG_KEY, None)
+        self._dynamic_fields = kwargs.pop(self.DYNAMIC_FIELD_ARG_KEY, None)
+        self._dynamic_exclude = kwargs.pop(self.DYNAMIC_EXCLUDE_ARG_KEY, None)
+        self._filtered_context = None
 
         super(DynamicFieldsMixin, self).__init__(*args, **kwargs)
-        if fields is not None:
-            self.filter_fields(fields)
 
-        if exclude is not None:
-            self.exclude_fields(exclude)
+    def _filtered_fields(self):
+        fields = super(DynamicFieldsMixin, self).get_fields()
+        if self._dynamic_fields is not None:
+            for name in list(fields):
+                if name not in self._dynamic_fields:
+                    fields.pop(name)
+        if self._dynamic_exclude is not None:
+            for name in self._dynamic_exclude:
+                fields.pop(name, None)
+        return fields
+
+    def get_field_prototypes(self):
+        """
+        :return: the prototypes of the fields of this serializer, shared by the instances of its class with the
+            same fields / exclude args, None if they are not cached. They must not be modified.
+        """
+        if not self.CACHE_FIELDS or not self.FIELDS_CACHE_SIZE:
+            return None
+
+        try:
+            key = (
+                _frozen_names(self._dynamic_fields), _frozen_names(self._dynamic_exclude), bool(self.partial)
+            )
+            hash(key)
+        except TypeError:
+            return None
+
+        cls = type(self)
+        with _prototypes_lock:
+            prototypes = cls.__dict__.get('_field_prototypes')
+            if prototypes is None:
+                prototypes = cls._field_prototypes = OrderedDict()
+            fields = prototypes.pop(key, None)
+            if fields is not None:
+                prototypes[key] = fields
+                return fields
+
+        fields = self._filtered_fields()
+        with _prototypes_lock:
+            fields = prototypes.pop(key, fields)
+            prototypes[key] = fields
+            while len(prototypes) > self.FIELDS_CACHE_SIZE:
+                prototypes.popitem(last=False)
+        return fields
+
+    def get_fields(self):
+        prototypes = self.get_field_prototypes()
+        if prototypes is None:
+            return self._filtered_fields()
+        return OrderedDict((name, _clone_field(field)) for name, field in prototypes.items())
+
+    @property
+    def fields(self):
+        if not hasattr(self, '_fields'):
+            # A get_fields of the serializer itself may change the fields, they are built by it then.
+            prototypes = None
+            if six.get_unbound_function(type(self).get_fields) is _get_fields:
+                prototypes = self.get_field_prototypes()
+            if prototypes is None:
+                return super(DynamicFieldsMixin, self).fields
+            self._fields = PrototypeBindingDict(self, prototypes)
+        return self._fields
 
     def filter_field_context(self):
-        if self.DYNAMIC_FIELD_CONTEXT_KEY:
-            context_key = self.context_key(self.DYNAMIC_FIELD_CONTEXT_KEY)
-            if context_key in self.context:
-                self.filter_fields(self.context[context_key])
+        fields_key = self.DYNAMIC_FIELD_CONTEXT_KEY and self.context_key(self.DYNAMIC_FIELD_CONTEXT_KEY)
+        exclude_key = self.DYNAMIC_EXCLUDE_CONTEXT_KEY and self.context_key(self.DYNAMIC_EXCLUDE_CONTEXT_KEY)
+        fields = self.context.get(fields_key) if fields_key else None
+        exclude = self.context.get(exclude_key) if exclude_key else None
+        # Filtering again by the same context changes nothing, skip it for the items of a list.
+        if (fields, exclude) == self._filtered_context:
+            return
+        self._filtered_context = (copy.copy(fields), copy.copy(exclude))
 
-        if self.DYNAMIC_EXCLUDE_CONTEXT_KEY:
-            context_key = self.context_key(self.DYNAMIC_EXCLUDE_CONTEXT_KEY)
-            if context_key in self.context:
-                self.exclude_fields(self.context[context_key])
+        if fields is not None:
+            self.filter_fields(fields)
+        if exclude is not None:
+            self.exclude_fields(exclude)
+        # Serializer caches its readable and writable fields.
+        self.__dict__.pop('_readable_fields', None)
+        self.__dict__.pop('_writable_fields', None)
 
     def to_representation(self, instance):
         self.filter_field_context()
@@ -146,6 +322,9 @@ class DynamicFieldsMixin(serializers.BaseSerializer):
         return super(DynamicFieldsMixin, self).to_internal_value(data)
 
 
+_get_fields = six.get_unbound_function(DynamicFieldsMixin.get_fields)
+
+
 class FakeRootMixin(object):
     @property
     def root(self):
@@ -168,81 +347,498 @@ class PartialSerializerWrapper(object):
     fac_kwargs_context_update = True
 
     @classmethod
-    def update_args(cls, args, kwargs):
+    def merge_args(cls, args, kwargs):
+        """
+        :return: (args, kwargs) of the factory merged with args and kwargs, the class is left untouched.
+        """
         kwargs = copy.copy(kwargs)
+        fac_kwargs = dict(cls.fac_kwargs)
         if cls.fac_args_sequence_partial_first:
-            cls.fac_args = cls.fac_args + args
+            fac_args = cls.fac_args + args
         else:
-            cls.fac_args = args + cls.fac_args
+            fac_args = args + cls.fac_args
 
         if cls.fac_kwargs_context_update:
-            if 'context' in kwargs and 'context' in cls.fac_kwargs:
-                cls.fac_kwargs['context'] = dict(cls.fac_kwargs['context'], **kwargs.pop(str('context')))
+            if 'context' in kwargs and 'context' in fac_kwargs:
+                fac_kwargs['context'] = dict(fac_kwargs['context'], **kwargs.pop(str('context')))
 
         if cls.fac_kwargs_partial_primary:
-            kwargs.update(cls.fac_kwargs)
-            cls.fac_kwargs = kwargs
-        else:
-            cls.fac_kwargs = dict(cls.fac_kwargs, **kwargs)
-
-    def update_args_init(self, args, kwargs):
-        kwargs = copy.copy(kwargs)
-        if self.fac_args_sequence_partial_first:
-            self.fac_args = self.fac_args + args
+            kwargs.update(fac_kwargs)
+            fac_kwargs = kwargs
         else:
-            self.fac_args = args + self.fac_args
+            fac_kwargs.update(kwargs)
 
-        if self.fac_kwargs_context_update:
-            if 'context' in kwargs and 'context' in self.fac_kwargs:
-                self.fac_kwargs['context'] = dict(self.fac_kwargs['context'], **kwargs.pop(str('context')))
+        return fac_args, fac_kwargs
 
-        if self.fac_kwargs_partial_primary:
-            kwargs.update(self.fac_kwargs)
-            self.fac_kwargs = kwargs
-        else:
-            self.fac_kwargs = dict(self.fac_kwargs, **kwargs)
+    def update_args_init(self, args, kwargs):
+        self.fac_args, self.fac_kwargs = self.merge_args(args, kwargs)
+        # The serializer keeps the context dict, each instance gets its own.
+        if isinstance(self.fac_kwargs.get('context'), dict):
+            self.fac_kwargs['context'] = dict(self.fac_kwargs['context'])
 
     def __init__(self, *args, **kwargs):
         self.update_args_init(args, kwargs)
         super(PartialSerializerWrapper, self).__init__(*self.fac_args, **self.fac_kwargs)
 
 
+class SerializerClassCache(object):
+    """
+    Bounded LRU registry of the classes generated by the serializer factories, keyed by the factory and its
+    arguments, so that the same arguments give the same class and the classes do not pile up.
+    The cached classes are shared and must not be modified.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._classes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.uncached = 0
+
+    def get(self, key, build):
+        if key is None or not self.maxsize:
+            with self._lock:
+                self.uncached += 1
+            return build()
+
+        with self._lock:
+            cls = self._classes.pop(key, None)
+            if cls is not None:
+                self._classes[key] = cls
+                self.hits += 1
+                return cls
+
+        cls = build()
+        with self._lock:
+            # Another thread may have built it meanwhile, keep a single class.
+            cls = self._classes.pop(key, cls)
+            self._classes[key] = cls
+            self.misses += 1
+            while len(self._classes) > self.maxsize:
+                self._classes.popitem(last=False)
+                self.evictions += 1
+        return cls
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._classes),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'uncached': self.uncached,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+            self.hits = self.misses = self.evictions = self.uncached = 0
+
+
+serializer_class_cache = SerializerClassCache(getattr(settings, 'WL_SERIALIZER_CLASS_CACHE_SIZE', 1024))
+
+
+def _freeze(value):
+    """
+    :return: a hashable equivalent of value, None if there is none.
+        Values are frozen along with their type, so that equal values of distinct types, 1 and True, differ.
+    """
+    if isinstance(value, dict):
+        items = tuple((_freeze(k), _freeze(v)) for k, v in sorted(value.items()))
+        return None if any(k is None or v is None for k, v in items) else (dict, items)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = tuple(_freeze(v) for v in value)
+        if any(v is None for v in items):
+            return None
+        return (type(value), frozenset(items) if isinstance(value, (set, frozenset)) else items)
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return type(value), value
+
+
+def _class_key(factory, serializer, args=(), kwargs=None):
+    frozen = _freeze((args, kwargs or {}))
+    return None if frozen is None else (factory, serializer, frozen)
+
+
 def partial_serializer(serializer, *args, **kwargs):
     # return functools.partial(serializer, *args, **kwargs)
-    attrs = {
-        'fac_args': args,
-        'fac_kwargs': kwargs,
-    }
-    if issubclass(serializer, PartialSerializerWrapper):
-        attrs_father = {
-            'fac_args': copy.copy(serializer.fac_args),
-            'fac_kwargs': copy.copy(serializer.fac_kwargs),
-        }
-        t = type('PartialWrapped' + serializer.__name__, (serializer, ), attrs_father)
-        t.update_args(args, kwargs)
-        return t
-    else:
-        return type('PartialWrapped' + serializer.__name__, (PartialSerializerWrapper, serializer), attrs)
+    def build():
+        if issubclass(serializer, PartialSerializerWrapper):
+            fac_args, fac_kwargs = serializer.merge_args(args, kwargs)
+            return type(
+                'PartialWrapped' + serializer.__name__, (serializer, ),
+                {'fac_args': fac_args, 'fac_kwargs': fac_kwargs}
+            )
+        else:
+            return type(
+                'PartialWrapped' + serializer.__name__, (PartialSerializerWrapper, serializer),
+                {'fac_args': args, 'fac_kwargs': kwargs}
+            )
+
+    return serializer_class_cache.get(_class_key(partial_serializer, serializer, args, kwargs), build)
 
 
 def transform_to_flat(serializer):
-    return type('Flatten' + serializer.__name__, (FlatSerializeMixin, serializer), {})
+    return serializer_class_cache.get(
+        _class_key(transform_to_flat, serializer),
+        lambda: type('Flatten' + serializer.__name__, (FlatSerializeMixin, serializer), {})
+    )
 
 
 def transform_to_dynamic_field(serializer):
     # In some case the serializer class override its init method to remove some fields.
     # And it might be ambiguous with the behaviour of DynamicFieldsMixin.
     # So we here let the init function run after the serializer's __init__ with the following trick.
-    return type(
-        'Dynamic' + serializer.__name__,
-        (serializer, type('DynamicFieldsMixinTemp', (DynamicFieldsMixin, ) + serializer.__bases__, {})),
-        {}
+    return serializer_class_cache.get(
+        _class_key(transform_to_dynamic_field, serializer),
+        lambda: type(
+            'Dynamic' + serializer.__name__,
+            (serializer, type('DynamicFieldsMixinTemp', (DynamicFieldsMixin, ) + serializer.__bases__, {})),
+            {}
+        )
     )
 
 
 def make_fake_root(serializer):
-    return type(
-        'FakeRoot' + serializer.__name__,
-        (serializer, FakeRootMixin),
-        {}
+    return serializer_class_cache.get(
+        _class_key(make_fake_root, serializer),
+        lambda: type('FakeRoot' + serializer.__name__, (serializer, FakeRootMixin), {})
     )
+
+
+def _nested_serializer(field):
+    if isinstance(field, (serializers.ListSerializer, serializers.ListField)):
+        field = field.child
+    return field if isinstance(field, serializers.BaseSerializer) else None
+
+
+def related_lookups(serializer, model):
+    """
+    Find the relations a serializer walks through when representing instances of the model.
+
+    :param serializer: a serializer instance.
+    :param model: the model class of the instances.
+    :return: (select_related lookups, prefetch_related lookups)
+    """
+    select_related = set()
+    prefetch_related = set()
+
+    def walk(s, opts, prefix, many):
+        for field in s.fields.values():
+            if field.write_only:
+                continue
+
+            nested = _nested_serializer(field)
+            if field.source == '*':
+                if nested is not None:
+                    walk(nested, opts, prefix, many)
+                continue
+
+            path = prefix
+            path_many = many
+            related_opts = opts
+            for i, attr in enumerate(field.source_attrs):
+                try:
+                    model_field = related_opts.get_field(attr)
+                except FieldDoesNotExist:
+                    # property or method, where it leads is unknown.
+                    model_field = None
+                if model_field is None or not model_field.is_relation or model_field.related_model is None:
+                    related_opts = None
+                    break
+
+                path = path + [attr]
+                path_many = path_many or model_field.many_to_many or model_field.one_to_many
+                related_opts = model_field.related_model._meta
+
+                pk_only = (
+                    i == len(field.source_attrs) - 1 and not path_many
+                    and isinstance(field, serializers.RelatedField) and field.use_pk_only_optimization()
+                )
+                if not pk_only:
+                    (prefetch_related if path_many else select_related).add(LOOKUP_SEP.join(path))
+
+            if nested is not None and related_opts is not None:
+                walk(nested, related_opts, path, path_many)
+
+    walk(serializer, model._meta, [], False)
+    return sorted(select_related), sorted(prefetch_related)
+
+
+def apply_field_context(serializer):
+    """
+    Filter now the fields of the DynamicFieldsMixin serializers of the tree by the fields / exclude context
+    keys, rather than when they are representing.
+    """
+    if isinstance(serializer, DynamicFieldsMixin):
+        serializer.filter_field_context()
+    for field in serializer.fields.values():
+        nested = _nested_serializer(field)
+        if nested is not None:
+            apply_field_context(nested)
+
+
+def projected_fields(serializer, model):
+    """
+    Find the model fields a serializer reads when representing instances of the model, as only() lookups.
+    Fields of the relations it walks through are prefixed by the relation, they must be select_related.
+
+    :param serializer: a serializer instance, its fields filtered already.
+    :param model: the model class of the instances.
+    :return: list of lookups, or None if the serializer reads attributes which are not model fields.
+    """
+
+    def walk(s, opts, prefix):
+        names = set()
+        for field in s.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                return None
+
+            nested = _nested_serializer(field)
+            if field.source == '*':
+                nested_names = walk(nested, opts, prefix) if nested is not None else None
+                if nested_names is None:
+                    return None
+                names |= nested_names
+                continue
+
+            path = prefix
+            related_opts = opts
+            for i, attr in enumerate(field.source_attrs):
+                try:
+                    model_field = related_opts.get_field(attr)
+                except FieldDoesNotExist:
+                    model_field = None
+                if model_field is None:
+                    # Property or method, the fields it reads are unknown.
+                    if i == 0:
+                        return None
+                    # All the fields of the related instance are loaded.
+                    related_opts = None
+                    break
+
+                if model_field.many_to_many or model_field.one_to_many:
+                    # Prefetched, the fields of the instance are not involved.
+                    related_opts = None
+                    break
+                if model_field.is_relation and not model_field.concrete:
+                    # Reverse one to one or generic foreign key.
+                    return None
+
+                names.add(LOOKUP_SEP.join(path + [attr]))
+                if not model_field.is_relation:
+                    related_opts = None
+                    break
+
+                pk_only = (
+                    i == len(field.source_attrs) - 1
+                    and isinstance(field, serializers.RelatedField) and field.use_pk_only_optimization()
+                )
+                if pk_only:
+                    related_opts = None
+                    break
+                path = path + [attr]
+                related_opts = model_field.related_model._meta
+            else:
+                if nested is None:
+                    # A related instance represented by its string or url, all its fields are loaded.
+                    related_opts = None
+
+            if nested is not None and related_opts is not None:
+                nested_names = walk(nested, related_opts, path)
+                if nested_names is not None:
+                    names |= nested_names
+
+        return names
+
+    names = walk(serializer, model._meta, [])
+    return None if names is None else sorted(names)
+
+
+def project_queryset(queryset, serializer, only=True):
+    """
+    Join and prefetch the relations serializer represents of the instances of queryset.
+    :param only: also load only the model fields it represents.
+    """
+    apply_field_context(serializer)
+    select_related, prefetch_related = related_lookups(serializer, queryset.model)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+
+    if only:
+        lookups = projected_fields(serializer, queryset.model)
+        if lookups is not None:
+            queryset = queryset.only(*(lookups or [queryset.model._meta.pk.name]))
+    return queryset
+
+
+def _defines(cls, name, allowed):
+    """
+    :return: whether all the classes of the mro of cls defining name are in allowed.
+    """
+    return all(klass in allowed for klass in cls.__mro__ if name in klass.__dict__)
+
+
+def _generic_values_representation(cls):
+    """
+    :return: whether serializers of class cls represent a dict of the values of an instance as the instance.
+    """
+    # compiled imports this module.
+    from .compiled import CompiledSerializerMixin
+    return _defines(cls, 'to_representation', (
+        serializers.Field, serializers.BaseSerializer, serializers.Serializer, DynamicFieldsMixin,
+        FlatSerializeMixin, CompiledSerializerMixin,
+    ))
+
+
+def values_lookups(serializer, model):
+    """
+    Translate the fields of a serializer to QuerySet.values() lookups, for rows to be represented as dicts
+    shaped like the instances of the model.
+
+    :param serializer: a serializer instance, its fields filtered already.
+    :param model: the model class of the instances.
+    :return: [(lookup, key path in the element, whether the value is a primary key only)], or None if a field
+        needs the model instance: method fields, attributes which are not model fields, to many or nullable
+        relations it walks through, fields with a descriptor of their own, serializers overriding
+        to_representation or get_attribute.
+    """
+
+    def walk(s, opts, lookup_prefix, path_prefix):
+        if not _generic_values_representation(type(s)):
+            return None
+
+        entries = []
+        for field in s.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, (
+                serializers.SerializerMethodField, serializers.ListSerializer, serializers.ManyRelatedField,
+                serializers.ListField,
+            )):
+                return None
+
+            nested = field if isinstance(field, serializers.BaseSerializer) else None
+            if nested is not None and not _defines_get_attribute(nested):
+                return None
+            if field.source == '*':
+                nested_entries = walk(nested, opts, lookup_prefix, path_prefix) if nested is not None else None
+                if nested_entries is None:
+                    return None
+                entries.extend(nested_entries)
+                continue
+
+            lookup = lookup_prefix
+            path = path_prefix
+            related_opts = opts
+            last = len(field.source_attrs) - 1
+            for i, attr in enumerate(field.source_attrs):
+                try:
+                    model_field = related_opts.get_field(attr)
+                except FieldDoesNotExist:
+                    return None
+                if not model_field.concrete or model_field.many_to_many or model_field.one_to_many:
+                    return None
+
+                lookup = lookup + [attr]
+                path = path + (attr, )
+                if not model_field.is_relation:
+                    descriptor = getattr(related_opts.model, model_field.attname, None)
+                    if i != last or nested is not None or not isinstance(descriptor, DeferredAttribute):
+                        return None
+                    if not _defines_get_attribute(field):
+                        # ModelField for instance, which reads the instance itself.
+                        return None
+                    entries.append((LOOKUP_SEP.join(lookup), path, False))
+                elif i == last and nested is None:
+                    if not (
+                        isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None
+                        and field.use_pk_only_optimization()
+                    ):
+                        return None
+                    entries.append((LOOKUP_SEP.join(lookup), path, True))
+                elif model_field.null:
+                    # The instance has None where the row has a dict of None.
+                    return None
+                else:
+                    related_opts = model_field.related_model._meta
+
+            if nested is not None and related_opts is not opts:
+                nested_entries = walk(nested, related_opts, lookup, path)
+                if nested_entries is None:
+                    return None
+                entries.extend(nested_entries)
+            elif nested is not None:
+                return None
+
+        return entries
+
+    return walk(serializer, model._meta, [], ())
+
+
+def _defines_get_attribute(field):
+    return _defines(type(field), 'get_attribute', (serializers.Field, ))
+
+
+class ValuesElement(dict):
+    """
+    Element fetched by values_queryset. The primary keys of its relations are given by serializable_value,
+    as a model instance does.
+    """
+    __slots__ = ('pks', )
+
+    def __init__(self, *args, **kwargs):
+        super(ValuesElement, self).__init__(*args, **kwargs)
+        self.pks = {}
+
+    def serializable_value(self, field_name):
+        try:
+            return self.pks[field_name]
+        except KeyError:
+            raise AttributeError(field_name)
+
+
+def values_queryset(queryset, serializer):
+    """
+    :return: queryset fetching dicts with QuerySet.values() which serializer represents as it does the instances,
+        no model instance is created. None if the fields of serializer need the instances.
+    """
+    apply_field_context(serializer)
+    entries = values_lookups(serializer, queryset.model)
+    if entries is None:
+        return None
+
+    def shape(row):
+        element = ValuesElement()
+        for lookup, path, pk_only in entries:
+            parent = element
+            for key in path[:-1]:
+                child = parent.get(key)
+                if child is None:
+                    child = parent[key] = ValuesElement()
+                parent = child
+            if pk_only:
+                parent.pks[path[-1]] = row[lookup]
+            else:
+                parent[path[-1]] = row[lookup]
+        return element
+
+    class ElementsIterable(ValuesIterable):
+        def __iter__(self):
+            for row in super(ElementsIterable, self).__iter__():
+                yield shape(row)
+
+    lookups = []
+    for lookup, path, pk_only in entries:
+        if lookup not in lookups:
+            lookups.append(lookup)
+    queryset = queryset.values(*lookups)
+    queryset._iterable_class = ElementsIterable
+    return queryset
@@ -0,0 +1,56 @@
+"""
+Benchmark of the compiled representation of a UserBaseSerializer list.
+
+Not collected by the test runner, run it with:
+    python manage.py test base.tests.bench_compiled_serializer
+"""
+import time
+import datetime
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from usersys.choices import user_role_choice
+from usersys.models import UserBase
+from usersys.serializers.user import UserBaseSerializer
+from .. import serializers
+from ..serializers.compiled import CompiledSerializerMixin
+
+
+class UserSerializer(UserBaseSerializer):
+    alias_role = serializers.AliasChoiceField(user_role_choice, source='role')
+
+    class Meta(UserBaseSerializer.Meta):
+        fields = UserBaseSerializer.Meta.fields + ('alias_role', )
+
+
+class CompiledUserSerializer(CompiledSerializerMixin, UserSerializer):
+    pass
+
+
+class CompiledSerializerBenchmark(SimpleTestCase):
+    N_USERS = 5000
+    ROUNDS = 3
+
+    def timeit(self, func):
+        best = None
+        for _ in range(self.ROUNDS):
+            start = time.time()
+            result = func()
+            duration = time.time() - start
+            best = duration if best is None else min(best, duration)
+        return best, result
+
+    def test_list(self):
+        now = timezone.now()
+        users = [
+            UserBase(
+                id=i, internal_name='user_%d' % i, pn='1300000%04d' % i, role=i % 4, is_staff=bool(i % 2),
+                registered_date=now - datetime.timedelta(seconds=i), last_login=now if i % 3 else None,
+            )
+            for i in range(self.N_USERS)
+        ]
+        generic, expected = self.timeit(lambda: UserSerializer(users, many=True).data)
+        compiled, result = self.timeit(lambda: CompiledUserSerializer(users, many=True).data)
+        self.assertEqual(result, expected)
+        print('\n%d users: %.1fms generic, %.1fms compiled' % (self.N_USERS, generic * 1000, compiled * 1000))
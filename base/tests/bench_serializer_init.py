@@ -0,0 +1,73 @@
+"""
+Benchmark of the instantiation of DynamicFieldsMixin serializers, nested and in lists, with and without
+the prototypes of their fields.
+
+Not collected by the test runner, run it with:
+    python manage.py test base.tests.bench_serializer_init
+"""
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from usersys.models import UserBase
+from usersys.serializers.user import (
+    UserBaseSerializer, UserChangingPasswordSerializer, UserPartialUpdateSerializer,
+)
+from .. import serializers
+
+
+class UserListSerializer(serializers.Serializer):
+    users = UserBaseSerializer(many=True, fields=['id', 'internal_name', 'pn', 'role'])
+
+
+# UserBaseSerializer hashes the password it validates.
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SerializerInitBenchmark(SimpleTestCase):
+    N_CALLS = 500
+    N_USERS = 100
+    ROUNDS = 3
+
+    def timeit(self, func):
+        best = None
+        for _ in range(self.ROUNDS):
+            start = time.time()
+            for _ in range(self.N_CALLS):
+                result = func()
+            duration = time.time() - start
+            best = duration if best is None else min(best, duration)
+        return best, result
+
+    def compare(self, label, func):
+        classes = (UserBaseSerializer, UserChangingPasswordSerializer)
+        try:
+            for cls in classes:
+                cls.CACHE_FIELDS = False
+            uncached, expected = self.timeit(func)
+        finally:
+            for cls in classes:
+                del cls.CACHE_FIELDS
+        cached, result = self.timeit(func)
+
+        self.assertEqual(result, expected)
+        print('\n%d x %s: %.1fms uncached, %.1fms cached' % (self.N_CALLS, label, uncached * 1000, cached * 1000))
+
+    def test_nested(self):
+        data = {'update': {'pn': '13000000000', 'password': 'secret', 'old_password': 'old secret'}}
+
+        def validate():
+            serializer = UserPartialUpdateSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            return sorted(serializer.validated_data['update'])
+
+        self.compare('nested validation', validate)
+
+    def test_list(self):
+        users = {'users': [
+            UserBase(id=i, internal_name='user_%d' % i, pn='1300000%04d' % i, role=1) for i in range(self.N_USERS)
+        ]}
+
+        def represent():
+            serializer = UserListSerializer(users, context={'users.exclude': ['pn']})
+            return serializer.data
+
+        self.compare('list of %d representation' % self.N_USERS, represent)
@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+from django.db import connection, models
+from django.test import TestCase
+
+from .. import serializers
+
+
+class LineItem(models.Model):
+    label = models.CharField(max_length=32)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    quantity = models.IntegerField(null=True)
+
+    class Meta:
+        app_label = 'base'
+        # Created by the test.
+        managed = False
+
+
+class LineItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LineItem
+        fields = ('label', 'amount', 'quantity')
+
+
+class LineItemAggregateSerializer(serializers.AggregateListSerializer):
+    def get_aggregate_types_and_defaults(self, real_instance, agg_op):
+        return {
+            'amount': (serializers.DecimalField(max_digits=14, decimal_places=2), Decimal('0.50')),
+            'quantity': (serializers.IntegerField(), 0),
+        }
+
+
+class LineItemMaxSerializer(LineItemAggregateSerializer):
+    REDUCTION = 'max'
+
+
+class PythonAggregateSerializer(LineItemAggregateSerializer):
+    def top_level_reduce(self, lhs, rhs):
+        return lhs + (rhs or 0)
+
+
+class AggregateListSerializerTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            editor.create_model(LineItem)
+        super(AggregateListSerializerTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(AggregateListSerializerTest, cls).tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(LineItem)
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(50):
+            LineItem.objects.create(label='item %d' % i, amount=Decimal('%d.%02d' % (i * 7, i * 13 % 100)), quantity=i)
+
+    def represent(self, serializer_class, queryset):
+        return serializer_class(LineItemSerializer(), {'instance': queryset, 'agg_op': None}).data
+
+    def test_sum_in_database(self):
+        queryset = LineItem.objects.order_by('id')
+        # aggregate, then the list.
+        with self.assertNumQueries(2):
+            data = self.represent(LineItemAggregateSerializer, queryset)
+
+        items = list(queryset)
+        self.assertEqual(data['total_amount'], str(Decimal('0.50') + sum(item.amount for item in items)))
+        self.assertEqual(data['total_quantity'], sum(item.quantity for item in items))
+        self.assertEqual(len(data['aggregates']), 50)
+        self.assertEqual(data, self.represent(PythonAggregateSerializer, queryset))
+        # Evaluated already, reduced in python.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.represent(LineItemAggregateSerializer, queryset), data)
+
+    def test_max_and_empty(self):
+        queryset = LineItem.objects.order_by('id')
+        data = self.represent(LineItemMaxSerializer, queryset.filter(id__lte=3))
+        self.assertEqual(data['total_amount'], '14.26')
+        self.assertEqual(data['total_quantity'], 2)
+        self.assertEqual(data, self.represent(LineItemMaxSerializer, list(queryset.filter(id__lte=3))))
+
+        empty = self.represent(LineItemAggregateSerializer, queryset.none())
+        self.assertEqual(empty, {'aggregates': [], 'total_amount': '0.50', 'total_quantity': 0})
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase
+
+from usersys.choices import user_role_choice
+from usersys.serializers.user import UserBaseSerializer
+from .. import serializers
+from ..serializers.compiled import CompiledSerializerMixin, compile_serializer, is_compilable
+
+
+class GroupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ('id', 'name')
+
+
+class PermissionSerializer(serializers.ReadonlySerializer):
+    id = serializers.IntegerField()
+    codename = serializers.CharField()
+    content_type = serializers.PrimaryKeyRelatedField(read_only=True)
+    model = serializers.CharField(source='content_type.model')
+
+
+class RoleSerializer(serializers.ReadonlySerializer):
+    role = serializers.AliasChoiceField(user_role_choice)
+    staff = serializers.BooleanField(source='is_staff')
+
+
+class UserSerializer(UserBaseSerializer):
+    alias_role = serializers.AliasChoiceField(user_role_choice, source='role')
+    groups = GroupSerializer(many=True)
+    user_permissions = PermissionSerializer(many=True)
+    summary = RoleSerializer(source='*')
+    full_name = serializers.CharField(source='get_full_name')
+    n_groups = serializers.SerializerMethodField()
+    missing = serializers.CharField(required=False)
+
+    class Meta(UserBaseSerializer.Meta):
+        fields = UserBaseSerializer.Meta.fields + (
+            'alias_role', 'groups', 'user_permissions', 'summary', 'full_name', 'n_groups', 'missing',
+        )
+
+    def get_n_groups(self, obj):
+        return len(obj.groups.all()) + self.context.get('offset', 0)
+
+
+class CompiledUserSerializer(CompiledSerializerMixin, UserSerializer):
+    pass
+
+
+class CompiledSerializerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        groups = [Group.objects.create(name='group_%d' % i) for i in range(2)]
+        permissions = list(Permission.objects.order_by('id')[:3])
+        for i in range(4):
+            user = get_user_model().objects.create_user('user_%d' % i, role=i % 2, pn=str(i) if i else None)
+            user.groups.set(groups[:i % 3])
+            user.user_permissions.set(permissions[:i])
+
+    def users(self):
+        return get_user_model().objects.order_by('id').prefetch_related('groups', 'user_permissions__content_type')
+
+    def test_parity(self):
+        users = self.users()
+        context = {'offset': 1}
+        expected = UserSerializer(users, many=True, context=context).data
+        serializer = CompiledUserSerializer(users, many=True, context=context)
+        data = serializer.data
+        self.assertEqual(data, expected)
+        self.assertEqual(list(data[0].keys()), list(expected[0].keys()))
+        self.assertEqual(serializer.child._compiled_representation.__name__, 'represent')
+        self.assertIsNone(data[0]['pn'])
+        self.assertIsNone(data[0]['last_login'])
+        self.assertEqual(data[1]['summary'], {'role': 'recycling_staff', 'staff': False})
+        self.assertEqual(data[3]['user_permissions'][0]['model'], users[3].user_permissions.all()[0].content_type.model)
+
+    def test_dynamic_fields(self):
+        users = self.users()
+        for kwargs in ({'fields': ['id', 'groups']}, {'context': {'exclude': ['groups', 'full_name']}}):
+            self.assertEqual(
+                CompiledUserSerializer(users, many=True, **kwargs).data,
+                UserSerializer(users, many=True, **kwargs).data,
+            )
+        self.assertNotIn('groups', CompiledUserSerializer(users[0], context={'exclude': ['groups']}).data)
+
+    def test_mapping(self):
+        user = {'role': 1, 'is_staff': True}
+        self.assertEqual(compile_serializer(RoleSerializer())(user), RoleSerializer(user).data)
+
+    def test_fallback(self):
+        class CustomRoleSerializer(RoleSerializer):
+            def to_representation(self, instance):
+                return {'custom': True}
+
+        class OuterSerializer(CompiledSerializerMixin, serializers.ReadonlySerializer):
+            role = CustomRoleSerializer(source='*')
+
+        self.assertFalse(is_compilable(CustomRoleSerializer()))
+        user = get_user_model().objects.first()
+        self.assertEqual(OuterSerializer(user).data, {'role': {'custom': True}})
@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import connection, models
+from django.test import TestCase, SimpleTestCase
+from rest_framework import serializers as rest_framework_serializers
+
+from .. import serializers
+from ..db.common_fields import CurrencyField, FixedCurrencyField, decimal_to_fixed_point
+from ..util.fixed_point import to_units, from_units, format_units
+
+
+class PricedItem(models.Model):
+    price = CurrencyField(null=True)
+    fixed_price = FixedCurrencyField(null=True)
+
+    class Meta:
+        app_label = 'base'
+        # Created by the test.
+        managed = False
+
+
+class PricedItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PricedItem
+        fields = ('id', 'fixed_price')
+
+
+class FixedPointTest(SimpleTestCase):
+    def test_conversions(self):
+        self.assertEqual(to_units(Decimal('12.345'), 3), 12345)
+        self.assertEqual(to_units('-0.5', 3), -500)
+        self.assertEqual(to_units(7, 3), 7000)
+        self.assertRaises(ValueError, to_units, '0.0005', 3)
+        self.assertEqual(to_units('0.0005', 3, rounding='ROUND_HALF_UP'), 1)
+        for units in (0, 1, -1, 999, 1000, -1001, 123456789):
+            self.assertEqual(from_units(units, 3), Decimal(units) / 1000)
+            self.assertEqual(format_units(units, 3), '{0:f}'.format(from_units(units, 3)))
+        self.assertEqual(format_units(-12, 0), '-12')
+
+    def test_serializer_fields(self):
+        field = serializers.FixedCurrencyField()
+        self.assertEqual(field.to_internal_value('12.345'), 12345)
+        self.assertEqual(field.to_representation(12345), '12.345')
+        self.assertEqual(field.to_representation(Decimal('1.5')), '1.500')
+        self.assertRaises(serializers.ValidationError, field.to_internal_value, '12.3456')
+
+        lat = serializers.FixedLatField()
+        self.assertEqual(lat.to_internal_value('31.123456789'), 311234568)
+        self.assertEqual(lat.to_representation(311234568), '31.1234568')
+        self.assertRaises(serializers.ValidationError, lat.to_internal_value, '-90.5')
+        self.assertEqual(lat.to_internal_value('-90'), -900000000)
+
+    def test_model_serializer(self):
+        self.assertIsInstance(PricedItemSerializer().fields['fixed_price'], serializers.FixedCurrencyField)
+        self.assertEqual(PricedItemSerializer(PricedItem(id=1, fixed_price=-1005)).data['fixed_price'], '-1.005')
+        # The ModelSerializer of rest_framework is left as is.
+        self.assertNotIn(FixedCurrencyField, rest_framework_serializers.ModelSerializer.serializer_field_mapping)
+
+
+class DecimalToFixedPointTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as editor:
+            editor.create_model(PricedItem)
+        super(DecimalToFixedPointTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(DecimalToFixedPointTest, cls).tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(PricedItem)
+
+    def test_migration(self):
+        prices = [Decimal('%d.%03d' % (i * 31, i * 7 % 1000)) for i in range(30)] + [None]
+        for price in prices:
+            PricedItem.objects.create(price=price)
+
+        operation = decimal_to_fixed_point('base', 'PricedItem', 'price', 'fixed_price', chunk_size=7)
+        operation.code(apps, connection.schema_editor())
+        self.assertEqual(
+            list(PricedItem.objects.order_by('id').values_list('fixed_price', flat=True)),
+            [None if price is None else to_units(price, 3) for price in prices]
+        )
+        total = PricedItem.objects.aggregate(total=models.Sum('fixed_price'))['total']
+        self.assertEqual(from_units(total, 3), sum(price for price in prices if price is not None))
+
+        PricedItem.objects.update(price=None)
+        operation.reverse_code(apps, connection.schema_editor())
+        self.assertEqual(list(PricedItem.objects.order_by('id').values_list('price', flat=True)), prices)
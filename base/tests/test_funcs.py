@@ -0,0 +1,551 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import connection, models
+from django.db.models import Q
+from django.db.models.signals import post_init
+from django.test import TestCase, SimpleTestCase
+from rest_framework.test import APIRequestFactory
+
+from .. import serializers
+from ..exceptions import WLException
+from ..db.utils.field_history import ChangedFieldRecorder
+from ..views import WLAPIGenericView
+from ..funcs import (
+    PagedAbstractFuncClass, CursorPagedAbstractFuncClass, AbstractFuncClass, AbstractPermission, ConditionalPermission,
+    RequireUserLoginPermission,
+)
+from ..util.thread import request_scope
+from ..util.timing import permission_profiler
+from ..serializers.utils import related_lookups, projected_fields, project_queryset, values_lookups
+from ..util.testing import QueryCountTestMixin
+
+
+class GroupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ('id', 'name')
+
+
+class UserElementSerializer(serializers.ModelSerializer):
+    groups = GroupSerializer(many=True)
+    group_ids = serializers.PrimaryKeyRelatedField(source='groups', many=True, read_only=True)
+    n_permissions = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'internal_name', 'groups', 'group_ids', 'n_permissions')
+
+
+class UserListFunc(PagedAbstractFuncClass):
+    ELEMENT_SERIALIZER = UserElementSerializer
+
+    def get_paged_qs(self, **kwargs):
+        return get_user_model().objects.order_by('id'), 'users', None
+
+    def transform_elements(self, objs, **kwargs):
+        counts = {
+            u.id: u.user_permissions.count() for u in get_user_model().objects.filter(
+                id__in=[o.id for o in objs]
+            ).prefetch_related('user_permissions')
+        }
+        for obj in objs:
+            obj.n_permissions = counts[obj.id]
+        return objs
+
+
+class PagedFuncRelatedTest(QueryCountTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        groups = [Group.objects.create(name='group_%d' % i) for i in range(3)]
+        for i in range(12):
+            user = get_user_model().objects.create_user('user_%02d' % i, role=0)
+            user.groups.set(groups[:i % 3 + 1])
+
+    def test_related_lookups(self):
+        self.assertEqual(related_lookups(UserElementSerializer(), get_user_model()), ([], ['groups']))
+
+    def test_related_lookups_foreign_key(self):
+        class ContentTypeSerializer(serializers.Serializer):
+            app_label = serializers.CharField()
+
+        class PermissionSerializer(serializers.Serializer):
+            content_type = ContentTypeSerializer()
+            content_type_id = serializers.PrimaryKeyRelatedField(source='content_type', read_only=True)
+            model = serializers.CharField(source='content_type.model')
+
+        class UserPermissionSerializer(serializers.Serializer):
+            user_permissions = PermissionSerializer(many=True)
+
+        self.assertEqual(related_lookups(PermissionSerializer(), Permission), (['content_type'], []))
+
+        class PermissionPkSerializer(serializers.Serializer):
+            content_type_id = serializers.PrimaryKeyRelatedField(source='content_type', read_only=True)
+
+        self.assertEqual(related_lookups(PermissionPkSerializer(), Permission), ([], []))
+        self.assertEqual(
+            related_lookups(UserPermissionSerializer(), get_user_model()),
+            ([], ['user_permissions', 'user_permissions__content_type'])
+        )
+
+    def test_query_count_constant(self):
+        func = UserListFunc()
+
+        def run(size):
+            result = func.run(page=0, count_per_page=size)
+            data = UserElementSerializer(result['users'], many=True).data
+            self.assertEqual(len(data), size)
+            self.assertEqual(len(data[-1]['groups']), len(data[-1]['group_ids']))
+
+        # count, page, prefetch groups, transform_elements and its prefetch
+        self.assertEqual(self.assertQueryCountConstant(run), 5)
+
+    def test_query_count_grows(self):
+        class NaiveUserListFunc(UserListFunc):
+            ELEMENT_SERIALIZER = None
+
+        def run(size):
+            result = NaiveUserListFunc().run(page=0, count_per_page=size)
+            UserElementSerializer(result['users'], many=True).data
+
+        self.assertRaises(AssertionError, self.assertQueryCountConstant, run)
+
+    def test_element_serializer_from_result(self):
+        def run(size):
+            response = DerivedUserListView.as_view()(APIRequestFactory().get('/', {'count_per_page': size}))
+            users = response.data['response']['users']
+            self.assertEqual(len(users), size)
+            self.assertEqual(len(users[-1]['groups']), len(users[-1]['group_ids']))
+
+        self.assertEqual(self.assertQueryCountConstant(run), 5)
+
+
+class UserListResultSerializer(serializers.PagedListSerializerMixin, serializers.ReadonlySerializer):
+    users = UserElementSerializer(many=True)
+
+
+class DerivedUserListFunc(UserListFunc):
+    ELEMENT_SERIALIZER = None
+
+
+class DerivedUserListView(WLAPIGenericView):
+    http_method_names = ['get', 'options']
+    API_SERIALIZER = serializers.PageApiSerializer
+    RESULT_SERIALIZER = UserListResultSerializer
+    FUNC_CLASS = DerivedUserListFunc
+
+
+class DynamicUserSerializer(serializers.DynamicFieldsMixin, serializers.ModelSerializer):
+    groups = GroupSerializer(many=True)
+
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'internal_name', 'pn', 'role', 'groups')
+
+
+class ProjectedUserListFunc(UserListFunc):
+    ELEMENT_SERIALIZER = DynamicUserSerializer
+    PROJECT_FIELDS = True
+
+    def get_element_serializer_kwargs(self, **kwargs):
+        return {'context': {'fields': ['id', 'pn']}}
+
+    def transform_elements(self, objs, **kwargs):
+        return objs
+
+
+class RecordedNote(models.Model):
+    title = models.CharField(max_length=32)
+    body = models.TextField()
+    changed_fields = ChangedFieldRecorder()
+
+    class Meta:
+        app_label = 'base'
+        # Created by the test.
+        managed = False
+
+
+class RecordedNoteSerializer(serializers.Serializer):
+    title = serializers.CharField()
+
+
+class ProjectionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        group = Group.objects.create(name='group')
+        for i in range(3):
+            get_user_model().objects.create_user('user_%d' % i, role=0, pn=str(i)).groups.add(group)
+
+    def test_projected_fields(self):
+        self.assertEqual(projected_fields(DynamicUserSerializer(fields=['pn', 'groups']), get_user_model()), ['pn'])
+        self.assertIsNone(projected_fields(UserElementSerializer(), get_user_model()))
+
+        class PermissionSerializer(serializers.Serializer):
+            codename = serializers.CharField()
+            model = serializers.CharField(source='content_type.model')
+
+        self.assertEqual(
+            projected_fields(PermissionSerializer(), Permission),
+            ['codename', 'content_type', 'content_type__model']
+        )
+        qs = project_queryset(Permission.objects.order_by('id'), PermissionSerializer())
+        with self.assertNumQueries(1):
+            data = PermissionSerializer(qs[:3], many=True).data
+        self.assertEqual(data[0]['model'], Permission.objects.order_by('id')[0].content_type.model)
+
+    def test_recorded_model_projected(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(RecordedNote)
+        try:
+            for i in range(3):
+                RecordedNote.objects.create(title='note %d' % i, body='body')
+            qs = project_queryset(RecordedNote.objects.order_by('id'), RecordedNoteSerializer())
+            # The recorder does not load the deferred body of each instance.
+            with self.assertNumQueries(1):
+                data = RecordedNoteSerializer(qs, many=True).data
+            self.assertEqual([d['title'] for d in data], ['note 0', 'note 1', 'note 2'])
+
+            note = qs[0]
+            note.title = 'changed'
+            note.save()
+            self.assertEqual(note.changed_fields, {'title': ('note 0', 'changed')})
+
+            # A deferred field read, then saved unchanged or changed.
+            note = qs[1]
+            self.assertEqual(note.body, 'body')
+            note.title = 'changed'
+            note.save()
+            self.assertEqual(note.changed_fields, {'title': ('note 1', 'changed')})
+            note.body = 'changed body'
+            note.save()
+            self.assertEqual(note.changed_fields, {'body': ('body', 'changed body')})
+        finally:
+            with connection.schema_editor() as editor:
+                editor.delete_model(RecordedNote)
+
+    def test_context_fields_projected(self):
+        func = ProjectedUserListFunc()
+        with self.assertNumQueries(2):
+            users = func.run(page=0, count_per_page=10)['users']
+        # Neither the other columns nor the excluded groups are loaded.
+        self.assertEqual(users[0].get_deferred_fields(), {
+            f.attname for f in get_user_model()._meta.concrete_fields if f.attname not in ('id', 'pn')
+        })
+        with self.assertNumQueries(0):
+            data = DynamicUserSerializer(users, many=True, **func.get_element_serializer_kwargs()).data
+        self.assertEqual(data, [{'id': u.id, 'pn': u.pn} for u in get_user_model().objects.order_by('id')])
+
+
+class ContentTypeSerializer(serializers.Serializer):
+    app_label = serializers.CharField()
+    model = serializers.CharField()
+
+
+class PermissionElementSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    content_type = ContentTypeSerializer()
+    content_type_id = serializers.PrimaryKeyRelatedField(source='content_type', read_only=True)
+    model = serializers.CharField(source='content_type.model')
+    codename = serializers.CharField()
+
+
+class PermissionValuesListFunc(PagedAbstractFuncClass):
+    ELEMENT_SERIALIZER = PermissionElementSerializer
+    VALUES_LIST = True
+
+    def get_paged_qs(self, **kwargs):
+        return Permission.objects.order_by('id'), 'permissions', None
+
+
+class PermissionNameSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
+class PermissionListResultSerializer(serializers.PagedListSerializerMixin, serializers.ReadonlySerializer):
+    permissions = PermissionElementSerializer(many=True)
+
+
+class PermissionValuesListView(WLAPIGenericView):
+    http_method_names = ['get', 'options']
+    API_SERIALIZER = serializers.PageApiSerializer
+    RESULT_SERIALIZER = PermissionListResultSerializer
+
+    class FUNC_CLASS(PermissionValuesListFunc):
+        # Narrower than the serializer of the result.
+        ELEMENT_SERIALIZER = PermissionNameSerializer
+
+
+class ValuesListTest(TestCase):
+    def setUp(self):
+        self.n_instances = 0
+
+    def count_instance(self, **kwargs):
+        self.n_instances += 1
+
+    def run_func(self, func):
+        post_init.connect(self.count_instance, sender=Permission)
+        try:
+            with self.assertNumQueries(2):
+                elements = func.run(page=0, count_per_page=5)['permissions']
+        finally:
+            post_init.disconnect(self.count_instance, sender=Permission)
+        return elements
+
+    def test_values(self):
+        elements = self.run_func(PermissionValuesListFunc())
+        self.assertEqual(self.n_instances, 0)
+        self.assertIsInstance(elements[0], dict)
+        self.assertEqual(
+            PermissionElementSerializer(elements, many=True).data,
+            PermissionElementSerializer(Permission.objects.order_by('id')[:5], many=True).data,
+        )
+
+    def test_fallback(self):
+        class PermissionMethodSerializer(PermissionElementSerializer):
+            label = serializers.SerializerMethodField()
+
+            def get_label(self, obj):
+                return str(obj)
+
+        class PermissionFallbackFunc(PermissionValuesListFunc):
+            ELEMENT_SERIALIZER = PermissionMethodSerializer
+
+        elements = self.run_func(PermissionFallbackFunc())
+        self.assertEqual(self.n_instances, 5)
+        self.assertIsInstance(elements[0], Permission)
+
+    def test_custom_serializers(self):
+        class CustomSerializer(PermissionElementSerializer):
+            def to_representation(self, instance):
+                return {'name': instance.name.upper()}
+
+        class CustomContentTypeSerializer(ContentTypeSerializer):
+            def to_representation(self, instance):
+                return instance.natural_key()
+
+        class CustomAttributeSerializer(ContentTypeSerializer):
+            def get_attribute(self, instance):
+                return instance.content_type
+
+        class CustomNestedSerializer(PermissionElementSerializer):
+            content_type = CustomContentTypeSerializer()
+
+        class CustomNestedAttributeSerializer(PermissionElementSerializer):
+            content_type = CustomAttributeSerializer(source='*')
+
+        self.assertIsNotNone(values_lookups(PermissionElementSerializer(), Permission))
+        for serializer_class in (CustomSerializer, CustomNestedSerializer, CustomNestedAttributeSerializer):
+            self.assertIsNone(values_lookups(serializer_class(), Permission))
+
+    def test_result_child(self):
+        response = PermissionValuesListView.as_view()(APIRequestFactory().get('/', {'count_per_page': 5}))
+        self.assertEqual(
+            response.data['response']['permissions'],
+            PermissionElementSerializer(Permission.objects.order_by('id')[:5], many=True).data,
+        )
+
+
+class FlagPermission(AbstractPermission):
+    def __init__(self, granted, code=403):
+        self.granted = granted
+        self.FAIL = {'code': code, 'message': 'flag'}
+        self.n_calls = 0
+
+    def check_permission(self, func, request, user, serializer, **kwargs):
+        self.n_calls += 1
+        return self.granted
+
+
+class RaisingPermission(AbstractPermission):
+    """
+    Permission overriding check, as written before evaluate existed.
+    """
+
+    def check(self, **kwargs):
+        raise WLException(418, 'raised')
+
+
+class CachedPermission(FlagPermission):
+    CACHE_RESULT = True
+
+
+class PermissionAlgebraTest(SimpleTestCase):
+    def check(self, permission, user=None):
+        try:
+            permission.check(func=None, request=None, user=user, serializer=None)
+        except WLException as e:
+            return e.code
+        return None
+
+    def test_algebra(self):
+        granted, denied, other = FlagPermission(True), FlagPermission(False, 403), FlagPermission(False, 404)
+
+        self.assertIsNone(self.check(granted & granted))
+        self.assertEqual(self.check(granted & denied & other), 403)
+        self.assertIsNone(self.check(denied | granted))
+        self.assertEqual(self.check(denied | other), 404)
+        self.assertIsNone(self.check(~denied))
+        self.assertEqual(self.check(~granted), 401)
+        self.assertEqual(self.check(ConditionalPermission(lambda **kwargs: True, denied)), 403)
+        self.assertIsNone(self.check(ConditionalPermission(lambda **kwargs: False, denied)))
+
+    def test_short_circuit(self):
+        first, second = FlagPermission(True), FlagPermission(False)
+        self.assertIsNone(self.check(first | second))
+        self.assertEqual(self.check(second & first), 403)
+        self.assertEqual((first.n_calls, second.n_calls), (1, 1))
+
+    def test_legacy_check(self):
+        self.assertEqual(self.check(RaisingPermission() | FlagPermission(False)), 403)
+        self.assertEqual(self.check(FlagPermission(False) | RaisingPermission()), 418)
+        self.assertIsNone(self.check(~RaisingPermission()))
+
+    def test_cache(self):
+        permission = CachedPermission(False)
+        with request_scope():
+            for user in ('a', 'a', 'b'):
+                self.assertEqual(self.check(permission, user), 403)
+        self.assertEqual(permission.n_calls, 2)
+
+        # Not cached outside of a request.
+        self.check(permission, 'a')
+        self.assertEqual(permission.n_calls, 3)
+
+    def test_profiler(self):
+        class ProfiledFunc(AbstractFuncClass):
+            PERMISSIONS = [FlagPermission(False) | FlagPermission(True)]
+
+            def run(self, **kwargs):
+                return {}
+
+        permission_profiler.reset()
+        permission_profiler.enable()
+        try:
+            ProfiledFunc()(None, None, {}, None)
+        finally:
+            permission_profiler.disable()
+
+        stats = permission_profiler.as_dict()['ProfiledFunc']
+        self.assertEqual(sorted(stats), ['(FlagPermission | FlagPermission)', 'FlagPermission'])
+        self.assertEqual(stats['FlagPermission']['calls'], 2)
+
+
+class StaffPermission(AbstractPermission):
+    def check_permission(self, func, request, user, **kwargs):
+        return user.is_staff
+
+
+class SameRolePermission(AbstractPermission):
+    def check_permission(self, func, request, user, **kwargs):
+        return True
+
+    def get_queryset_filter(self, user, **kwargs):
+        return Q(role=user.role)
+
+
+class RoleUserListFunc(PagedAbstractFuncClass):
+    PERMISSIONS = [RequireUserLoginPermission(), StaffPermission() | SameRolePermission()]
+
+    def get_paged_qs(self, **kwargs):
+        return get_user_model().objects.order_by('id'), 'users', None
+
+    def transform_element(self, obj, **kwargs):
+        return obj.internal_name
+
+
+class RoleUserCursorListFunc(CursorPagedAbstractFuncClass):
+    PERMISSIONS = RoleUserListFunc.PERMISSIONS
+
+    def get_paged_qs(self, **kwargs):
+        return get_user_model().objects.order_by('id'), 'users', None
+
+    def transform_element(self, obj, **kwargs):
+        return obj.internal_name
+
+
+class QuerysetPermissionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(9):
+            get_user_model().objects.create_user('user_%d' % i, role=i % 3)
+        cls.staff = get_user_model().objects.create_user('staff', role=2, is_staff=True)
+
+    def call(self, func_class, user, **kwargs):
+        return func_class()(None, user, dict({'count_per_page': 2, 'page': 0}, **kwargs), None)
+
+    def test_filtered_before_pagination(self):
+        user = get_user_model().objects.get(internal_name='user_1')
+        result = self.call(RoleUserListFunc, user)
+        self.assertEqual(result['users'], ['user_1', 'user_4'])
+        # user_1, user_4 and user_7: the count covers the visible rows only.
+        self.assertEqual(result['n_pages'], 2)
+        self.assertEqual(self.call(RoleUserListFunc, user, page=1)['users'], ['user_7'])
+
+        result = RoleUserCursorListFunc()(None, user, {'count_per_page': 3}, None)
+        self.assertEqual(result['users'], ['user_1', 'user_4', 'user_7'])
+        self.assertIsNone(result['next_cursor'])
+
+    def test_evaluated_once(self):
+        flag = FlagPermission(False)
+
+        class FlagUserListFunc(RoleUserListFunc):
+            PERMISSIONS = [RequireUserLoginPermission(), flag | SameRolePermission()]
+
+        user = get_user_model().objects.get(internal_name='user_1')
+        self.assertEqual(self.call(FlagUserListFunc, user)['users'], ['user_1', 'user_4'])
+        self.assertEqual(flag.n_calls, 1)
+
+    def test_evaluated_per_arguments(self):
+        class TargetPermission(AbstractPermission):
+            def check_permission(self, func, request, user, target=None, **kwargs):
+                return target != 'forbidden'
+
+        permission = TargetPermission()
+
+        class TargetFunc(AbstractFuncClass):
+            PERMISSIONS = [permission]
+
+            def run(self, **kwargs):
+                permission.check(func=self, request=None, user=None, serializer=None, target='allowed')
+                permission.check(func=self, request=None, user=None, serializer=None, target='forbidden')
+
+        with self.assertRaises(WLException) as raised:
+            TargetFunc()(None, None, {'target': 'allowed'}, None)
+        self.assertEqual(raised.exception.code, 401)
+
+    def test_not_filter(self):
+        class NotRoleTwoPermission(AbstractPermission):
+            def check_permission(self, func, request, user, **kwargs):
+                return user.role == 2
+
+            def get_queryset_filter(self, **kwargs):
+                return Q(role=2)
+
+        class NotRoleTwoUserListFunc(RoleUserListFunc):
+            PERMISSIONS = [~NotRoleTwoPermission()]
+
+        user = get_user_model().objects.get(internal_name='user_1')
+        result = self.call(NotRoleTwoUserListFunc, user, count_per_page=10)
+        self.assertEqual(result['users'], ['user_%d' % i for i in range(9) if i % 3 != 2])
+        self.assertIsNone((~StaffPermission()).get_queryset_filter(user=user))
+
+    def test_unfiltered_or_branch(self):
+        self.assertEqual(self.call(RoleUserListFunc, self.staff)['n_pages'], 5)
+
+    def test_combined_filters(self):
+        class RoleTwoPermission(SameRolePermission):
+            def get_queryset_filter(self, **kwargs):
+                return Q(role=2)
+
+        user = get_user_model().objects.get(internal_name='user_1')
+        self.assertEqual(
+            str(RoleUserListFunc().get_queryset_filter(None, user, None, {}, get_user_model())),
+            str(Q(role=1))
+        )
+        q = (SameRolePermission() & RoleTwoPermission()).get_queryset_filter(user=user)
+        self.assertFalse(get_user_model().objects.filter(q).exists())
+        q = (StaffPermission() | RoleTwoPermission()).get_queryset_filter(
+            func=None, request=None, user=user, serializer=None
+        )
+        self.assertEqual(get_user_model().objects.filter(q).count(), 4)
@@ -0,0 +1,104 @@
+from django.contrib.auth.models import Group
+from django.db import transaction, OperationalError, IntegrityError
+from django.test import TransactionTestCase
+from rest_framework.test import APIRequestFactory
+
+from ..db.retry import RetryPolicy, func_retried, retry_stats, reset_retry_stats, is_transient_error
+from ..funcs import AbstractFuncClass
+from ..util.thread import request_scope, request_memoize
+
+
+class LockedGroupFunc(AbstractFuncClass):
+    """
+    Creates a group, then fails on a locked database for its first n_failures attempts.
+    """
+    DB_TRANSACTION = True
+    RETRY_POLICY = RetryPolicy(max_attempts=3, base_delay=0)
+
+    def __init__(self, n_failures, error=OperationalError('database is locked')):
+        super(LockedGroupFunc, self).__init__()
+        self.n_failures = n_failures
+        self.error = error
+        self.n_calls = 0
+
+    def run(self, **kwargs):
+        self.n_calls += 1
+        Group.objects.create(name='group_%d' % self.n_calls)
+        if self.n_calls <= self.n_failures:
+            raise self.error
+        return self.n_calls
+
+
+class RetryPolicyTest(TransactionTestCase):
+    def setUp(self):
+        reset_retry_stats()
+        self.retried = []
+        func_retried.connect(self.on_retried)
+
+    def tearDown(self):
+        func_retried.disconnect(self.on_retried)
+
+    def on_retried(self, sender, attempt, **kwargs):
+        self.retried.append(attempt)
+
+    def call(self, func):
+        return func(APIRequestFactory().post('/'), None, {}, None)
+
+    def stats(self):
+        return retry_stats().get('%s.LockedGroupFunc' % __name__)
+
+    def test_retried_in_fresh_transaction(self):
+        func = LockedGroupFunc(2)
+        self.assertEqual(self.call(func), 3)
+        self.assertEqual(self.retried, [1, 2])
+        self.assertEqual(self.stats(), {'retries': 2, 'exhausted': 0})
+        # The writes of the failed attempts are rolled back.
+        self.assertEqual(list(Group.objects.values_list('name', flat=True)), ['group_3'])
+
+    def test_retried_in_nested_scope(self):
+        calls = []
+
+        @request_memoize
+        def lookup(key):
+            calls.append(key)
+            return key
+
+        class ContextGroupFunc(LockedGroupFunc):
+            def run(self, **kwargs):
+                lookup(self.n_calls)
+                self.set_context('attempts', self.get_context_dict().get('attempts', 0) + 1)
+                return super(ContextGroupFunc, self).run(**kwargs)
+
+        func = ContextGroupFunc(1)
+        with request_scope() as scope:
+            lookup('caller')
+            self.call(func)
+            # The failed attempt has left nothing behind, the scope of the caller is kept.
+            self.assertEqual(func.get_context('attempts'), 1)
+            self.assertIn((lookup, ('caller', ), None), scope.memo)
+        self.assertEqual(calls, ['caller', 0, 1])
+
+    def test_exhausted(self):
+        func = LockedGroupFunc(3)
+        self.assertRaises(OperationalError, self.call, func)
+        self.assertEqual(func.n_calls, 3)
+        self.assertEqual(self.stats(), {'retries': 2, 'exhausted': 1})
+        self.assertFalse(Group.objects.exists())
+
+    def test_not_transient(self):
+        func = LockedGroupFunc(1, error=IntegrityError('UNIQUE constraint failed'))
+        self.assertRaises(IntegrityError, self.call, func)
+        self.assertEqual(func.n_calls, 1)
+        self.assertIsNone(self.stats())
+
+    def test_not_retried_in_enclosing_transaction(self):
+        func = LockedGroupFunc(1)
+        with transaction.atomic():
+            self.assertRaises(OperationalError, self.call, func)
+        self.assertEqual(func.n_calls, 1)
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient_error(OperationalError(1213, 'Deadlock found when trying to get lock')))
+        self.assertTrue(is_transient_error(OperationalError(1205, 'Lock wait timeout exceeded')))
+        self.assertFalse(is_transient_error(OperationalError(2006, 'MySQL server has gone away')))
+        self.assertFalse(is_transient_error(ValueError('database is locked')))
@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.db import connections
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from ..db.router import ReplicaRouter, routing_scope, current_scope
+from ..funcs import AbstractFuncClass, MethodRoutedFuncClass
+from ..util import thread
+
+
+REPLICA = 'test_replica'
+
+
+class GroupFunc(MethodRoutedFuncClass):
+    def get(self, **kwargs):
+        return sorted(Group.objects.values_list('name', flat=True))
+
+    def post(self, name, **kwargs):
+        Group.objects.create(name=name)
+        return sorted(Group.objects.values_list('name', flat=True))
+
+
+class TransactionGroupFunc(AbstractFuncClass):
+    READ_ONLY = True
+    DB_TRANSACTION = True
+
+    def run(self, **kwargs):
+        return sorted(Group.objects.values_list('name', flat=True))
+
+
+@override_settings(
+    DATABASE_ROUTERS=['base.db.router.ReplicaRouter'],
+    WL_DB_REPLICAS=[REPLICA],
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'router_tests'},
+        'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'router_tests'},
+    },
+)
+class ReplicaRouterTest(TestCase):
+    """
+    The replica is a second SQLite database holding different rows than the primary,
+    so that the database serving a read can be told from its result.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        connections.databases[REPLICA] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        with connections[REPLICA].schema_editor() as editor:
+            editor.create_model(Group)
+        Group.objects.using(REPLICA).create(name='replica')
+        super(ReplicaRouterTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaRouterTest, cls).tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.databases[REPLICA]
+
+    def setUp(self):
+        caches['sessions'].clear()
+        Group.objects.create(name='primary')
+        self.user = get_user_model().objects.create_user('router_user', role=0)
+
+    def call(self, func_class, method='get', user=None, **kwargs):
+        request = getattr(APIRequestFactory(), method)('/')
+        return func_class()(request, user or self.user, kwargs, None)
+
+    def test_read_from_replica(self):
+        self.assertEqual(self.call(GroupFunc), ['replica'])
+
+    def test_read_your_writes(self):
+        self.assertEqual(self.call(GroupFunc, 'post', name='written'), ['primary', 'written'])
+        self.assertEqual(self.call(GroupFunc), ['primary', 'written'])
+
+        other = get_user_model().objects.create_user('other_user', role=0)
+        self.assertEqual(self.call(GroupFunc, user=other), ['replica'])
+
+        # The sticky window is over.
+        caches['sessions'].clear()
+        self.assertEqual(self.call(GroupFunc), ['replica'])
+
+    def test_transaction_reads_primary(self):
+        self.assertEqual(self.call(TransactionGroupFunc), ['primary'])
+
+    def test_pinned_to_primary(self):
+        router = ReplicaRouter()
+        with self.settings(WL_DB_PRIMARY='primary'):
+            with routing_scope(False):
+                self.assertEqual(router.db_for_read(Group), 'primary')
+            self.assertEqual(router.db_for_read(Group), 'primary')
+
+    def test_scope_per_greenlet(self):
+        class Greenlet(object):
+            pass
+
+        greenlets = [Greenlet(), Greenlet()]
+        current = [greenlets[0]]
+        saved = thread._current_greenlet
+        thread._current_greenlet = lambda: current[0]
+        try:
+            with routing_scope(True) as scope:
+                self.assertIs(current_scope(), scope)
+                # Another greenlet of the thread is not routed by the scope.
+                current[0] = greenlets[1]
+                self.assertIsNone(current_scope())
+                current[0] = greenlets[0]
+        finally:
+            thread._current_greenlet = saved
+
+    def test_no_replicas(self):
+        with self.settings(WL_DB_REPLICAS=[]):
+            self.assertEqual(self.call(GroupFunc), ['primary'])
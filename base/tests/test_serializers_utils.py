@@ -3,6 +3,7 @@ from django.test import TestCase
 # Create your tests here.
 
 
+from usersys.serializers.user import UserBaseSerializer, UserChangingPasswordSerializer
 from .. import serializers
 
 
@@ -110,6 +111,28 @@ class FlatSerializeMixinTest(TestCase):
         test_deserializer.is_valid(raise_exception=True)
         self.assertEqual(test_deserializer.validated_data, instance)
 
+    def test_flat_plan(self):
+        class InnerSerializer(serializers.Serializer):
+            value = serializers.IntegerField()
+            extra = serializers.DictField()
+
+        class OuterSerializer(serializers.FlatSerializeMixin, serializers.Serializer):
+            inner = InnerSerializer()
+            items = InnerSerializer(many=True)
+
+        plan = OuterSerializer.get_flat_plan(OuterSerializer())
+        self.assertIs(OuterSerializer.get_flat_plan(OuterSerializer()), plan)
+        self.assertEqual(plan.unflatten['inner__value'][0], ('inner', 'value'))
+
+        instance = {'inner': {'value': 1, 'extra': {'a': {'b': 2}}}, 'items': [{'value': 2, 'extra': {}}]}
+        data = OuterSerializer(instance).data
+        # Keys of the dict field are not in the plan, they are flattened the generic way.
+        self.assertEqual(data, {'inner__value': 1, 'inner__extra__a__b': 2, 'items': [{'value': 2}]})
+        self.assertEqual(
+            OuterSerializer().reverse_flat_dict(data, plan),
+            {'inner': {'value': 1, 'extra': {'a': {'b': 2}}}, 'items': [{'value': 2}]}
+        )
+
 
 class DynamicFieldsMixinTest(TestCase):
     @classmethod
@@ -173,6 +196,44 @@ class DynamicFieldsMixinTest(TestCase):
         self.assertNotIn('f1', s2.data['inner2'])
         self.assertIn('f2', s2.data['inner2'])
 
+    def test_field_prototypes(self):
+        s1 = UserBaseSerializer(fields=['id', 'internal_name'])
+        s2 = UserBaseSerializer(fields=['internal_name', 'id'])
+        self.assertEqual(list(s1.fields), ['id', 'internal_name'])
+        self.assertEqual(list(s2.fields), ['id', 'internal_name'])
+        prototypes = UserBaseSerializer._field_prototypes[(frozenset(['id', 'internal_name']), None, False)]
+        # Fields are copied when they are first looked up, not the dropped ones.
+        self.assertIs(s1.fields.fields['internal_name'], prototypes['internal_name'])
+        del s2.fields['id']
+        self.assertIs(prototypes['id'].parent, None)
+        # Each instance binds its own copies, the unique validator included.
+        self.assertIsNot(s1.fields['internal_name'], s2.fields['internal_name'])
+        self.assertIsNot(s1.fields['internal_name'].validators[-1], prototypes['internal_name'].validators[-1])
+        self.assertIsNone(prototypes['internal_name'].parent)
+
+        s1.fields.pop('id')
+        self.assertEqual(list(UserBaseSerializer(fields=['id', 'internal_name']).fields), ['id', 'internal_name'])
+        # Subclasses keep their own prototypes.
+        self.assertIn('old_password', UserChangingPasswordSerializer(exclude=['id']).fields)
+        self.assertNotIn((None, frozenset(['id']), False), UserBaseSerializer._field_prototypes)
+
+    def test_field_prototypes_evicted(self):
+        class LimitedSerializer(UserBaseSerializer):
+            FIELDS_CACHE_SIZE = 2
+
+        for fields in (['id'], ['pn'], ['id'], ['role']):
+            self.assertEqual(list(LimitedSerializer(fields=fields).fields), fields)
+        # The least recently used prototypes are dropped.
+        self.assertEqual(list(LimitedSerializer._field_prototypes), [
+            (frozenset(['id']), None, False), (frozenset(['role']), None, False),
+        ])
+
+    def test_context_changed(self):
+        serializer = self.test_kwarg_serializer(context={'fields': ['f1', 'f2']})
+        self.assertEqual(serializer.to_representation(self.test_instance), {'f1': 1, 'f2': '2'})
+        serializer._context['fields'] = ['f1']
+        self.assertEqual(serializer.to_representation(self.test_instance), {'f1': 1})
+
     def test_context(self):
         s1 = self.test_context_serializer(self.test_instance)
         self.assertIn('f1', s1.data)
@@ -208,3 +269,51 @@ class DynamicFieldsMixinTest(TestCase):
         self.assertNotIn('f2', s2.data['inner2'])
         self.assertIn('f3', s2.data['inner2'])
         self.assertIn('f4', s2.data['inner2'])
+
+
+class SerializerClassCacheTest(TestCase):
+    class ContextSerializer(serializers.Serializer):
+        f1 = serializers.IntegerField()
+
+    def test_same_arguments_same_class(self):
+        utils = serializers.utils
+        cache = utils.serializer_class_cache
+        cache.clear()
+        s = self.ContextSerializer
+
+        partial = utils.partial_serializer(s, context={'fields': ['f1']})
+        self.assertIs(utils.partial_serializer(s, context={'fields': ['f1']}), partial)
+        self.assertIsNot(utils.partial_serializer(s, context={'fields': ['f2']}), partial)
+        self.assertIs(utils.transform_to_flat(s), utils.transform_to_flat(s))
+        self.assertIs(utils.transform_to_dynamic_field(partial), utils.transform_to_dynamic_field(partial))
+        self.assertIs(utils.make_fake_root(s), utils.make_fake_root(s))
+        self.assertIsNot(utils.partial_serializer(s, context={'a': {1}}), utils.partial_serializer(s, context={}))
+        self.assertIsNot(
+            utils.partial_serializer(s, context={'fields': [1]}), utils.partial_serializer(s, context={'fields': [True]})
+        )
+        # Unhashable arguments are not cached.
+        utils.partial_serializer(s, context={'a': bytearray()})
+        self.assertEqual(
+            cache.stats(),
+            {'size': 9, 'maxsize': cache.maxsize, 'hits': 4, 'misses': 9, 'evictions': 0, 'uncached': 1}
+        )
+
+    def test_classes_not_mutated(self):
+        utils = serializers.utils
+        partial = utils.partial_serializer(self.ContextSerializer, context={'a': 1})
+        nested = utils.partial_serializer(partial, context={'b': 2})
+        self.assertEqual(partial.fac_kwargs, {'context': {'a': 1}})
+        self.assertEqual(nested.fac_kwargs, {'context': {'a': 1, 'b': 2}})
+
+        s1 = nested(context={'c': 3})
+        s1.context['d'] = 4
+        self.assertEqual(s1.context, {'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        self.assertEqual(nested().context, {'a': 1, 'b': 2})
+        self.assertEqual(nested.fac_kwargs, {'context': {'a': 1, 'b': 2}})
+
+    def test_bounded(self):
+        cache = serializers.utils.SerializerClassCache(2)
+        for key in (1, 2, 1, 3):
+            cache.get(key, lambda: type('S', (object, ), {}))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(list(cache._classes), [1, 3])
@@ -0,0 +1,442 @@
+import json
+import logging
+
+from django.conf.urls import url
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from rest_framework.test import APIRequestFactory
+
+from .. import serializers
+from ..views import WLAPIGenericView, WLBatchAPIView, ChoiceBundleView
+from ..util import field_choice, model_version
+from ..funcs import AbstractFuncClass, MethodRoutedFuncClass, PagedAbstractFuncClass, RequireUserLoginPermission
+
+
+class CountUserFunc(AbstractFuncClass):
+    def run(self, request, user, serializer, **kwargs):
+        return {'n_users': get_user_model().objects.count()}
+
+
+class CountUserResultSerializer(serializers.ReadonlySerializer):
+    n_users = serializers.IntegerField()
+
+
+class CountUserView(WLAPIGenericView):
+    http_method_names = ['get', 'options']
+    RESULT_SERIALIZER = CountUserResultSerializer
+    FUNC_CLASS = CountUserFunc
+
+
+class WhoAmIFunc(AbstractFuncClass):
+    PERMISSIONS = [RequireUserLoginPermission()]
+
+    def run(self, request, user, serializer, **kwargs):
+        return {'user_id': user.id, 'echo': kwargs.get('echo')}
+
+
+class WhoAmIApiSerializer(serializers.ApiSerializer):
+    echo = serializers.CharField(required=False)
+
+
+class WhoAmIView(WLAPIGenericView):
+    http_method_names = ['get', 'post', 'options']
+    API_SERIALIZER = WhoAmIApiSerializer
+    FUNC_CLASS = WhoAmIFunc
+
+
+class SessionFunc(AbstractFuncClass):
+    def run(self, request, user, serializer, **kwargs):
+        echo = kwargs.get('echo')
+        if echo == 'drop':
+            del request.session['stale']
+        else:
+            request.session['echo_%s' % echo] = echo
+        return {'echo': echo, 'keys': sorted(request.session.keys())}
+
+
+class SessionView(WhoAmIView):
+    FUNC_CLASS = SessionFunc
+
+
+class UserListFunc(PagedAbstractFuncClass):
+    def get_paged_qs(self, **kwargs):
+        return get_user_model().objects.order_by('id'), 'users', {'total': 'all'}
+
+    def transform_element(self, obj, **kwargs):
+        return {'id': obj.id, 'name': obj.internal_name}
+
+
+class StreamedUserListFunc(UserListFunc):
+    STREAMING = True
+    STREAM_CHUNK_SIZE = 3
+
+
+class ContextUserListFunc(StreamedUserListFunc):
+    def get_paged_qs(self, **kwargs):
+        self.set_context('prefix', 'streamed_')
+        return super(ContextUserListFunc, self).get_paged_qs(**kwargs)
+
+    def transform_element(self, obj, **kwargs):
+        return {'id': obj.id, 'name': self.get_context('prefix') + obj.internal_name}
+
+
+class UserListElementSerializer(serializers.ReadonlySerializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+
+
+class UserListResultSerializer(serializers.PagedListSerializerMixin, serializers.ReadonlySerializer):
+    users = UserListElementSerializer(many=True)
+    total = serializers.CharField()
+
+
+class UserListView(WLAPIGenericView):
+    http_method_names = ['get', 'options']
+    API_SERIALIZER = serializers.PageApiSerializer
+    RESULT_SERIALIZER = UserListResultSerializer
+    FUNC_CLASS = UserListFunc
+
+
+class StreamedUserListView(UserListView):
+    FUNC_CLASS = StreamedUserListFunc
+
+
+urlpatterns = [
+    url(r'^count/$', CountUserView.as_view()),
+    url(r'^whoami/$', WhoAmIView.as_view()),
+    url(r'^batch/$', WLBatchAPIView.as_view()),
+    url(r'^session/$', SessionView.as_view()),
+]
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class RequestTimingTest(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def get(self, view):
+        response = view.as_view()(self.factory.get('/'))
+        response.render()
+        return response
+
+    def test_timing_disabled(self):
+        response = self.get(CountUserView)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(response.data['response']['n_users'], 0)
+
+    def test_server_timing(self):
+        class TimedView(CountUserView):
+            REQUEST_TIMING = True
+
+        response = self.get(TimedView)
+        metrics = [m.split(';')[0] for m in response['Server-Timing'].split(', ')]
+        self.assertEqual(
+            metrics,
+            ['request_obj', 'user', 'args', 'func', 'func-db', 'data', 'response', 'render', 'total']
+        )
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(WL_SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request_log(self):
+        handler = RecordingHandler()
+        slow_logger = logging.getLogger('base.views.slow')
+        slow_logger.addHandler(handler)
+        try:
+            response = self.get(CountUserView)
+        finally:
+            slow_logger.removeHandler(handler)
+
+        self.assertIn('Server-Timing', response)
+        timing = handler.records[0].timing
+        self.assertEqual(timing['view'], 'CountUserView')
+        self.assertEqual(timing['phases']['func']['queries'], 1)
+        self.assertIn('render', timing['phases'])
+
+
+class DispatchPlanTest(TestCase):
+    def test_plan_shared_by_requests(self):
+        class PlannedView(CountUserView):
+            http_method_names = ['get', 'post', 'options']
+            API_SERIALIZER = {'post': serializers.PageApiSerializer}
+
+        v1, v2 = PlannedView(), PlannedView()
+        self.assertIs(v1._plan, v2._plan)
+        self.assertIs(v1._func['get'], v2._func['get'])
+        self.assertIs(v1._func['get'], v1._func['post'])
+        # Shared funcs keep the state of a call in its context.
+        self.assertRaises(AttributeError, setattr, v1._func['get'], 'n_calls', 1)
+
+        plan = PlannedView.get_dispatch_plan()
+        self.assertIsNot(plan, CountUserView.get_dispatch_plan())
+        self.assertEqual(plan.http_methods, {'get', 'post'})
+        self.assertEqual(plan.func_classes, {'get': CountUserFunc, 'post': CountUserFunc})
+        self.assertEqual(plan.api_serializers, {'get': None, 'post': serializers.PageApiSerializer})
+        self.assertEqual(plan.result_serializers['post'], CountUserResultSerializer)
+        self.assertEqual(plan.permissions, {'get': [], 'post': []})
+
+    def test_routed_permissions(self):
+        login = RequireUserLoginPermission()
+
+        class RoutedFunc(MethodRoutedFuncClass):
+            PERMISSIONS = [('post', login)]
+
+        class RoutedView(CountUserView):
+            http_method_names = ['get', 'post', 'options']
+            FUNC_CLASS = RoutedFunc
+
+        plan = RoutedView.get_dispatch_plan()
+        self.assertEqual(plan.permissions, {'get': [], 'post': [login]})
+        # The funcs of the requests use the lists of the plan.
+        request = APIRequestFactory().post('/')
+        self.assertIs(RoutedView()._func['post'].get_permissions(request, None, None, {}), plan.permissions['post'])
+
+    def test_serializer_overrides(self):
+        class DeterminedView(CountUserView):
+            def determine_serializer(self, request, s):
+                return serializers.PageApiSerializer
+
+        request = APIRequestFactory().get('/')
+        view = CountUserView()
+        self.assertIs(view.get_result_serializer(request), CountUserResultSerializer)
+        view.RESULT_SERIALIZER = {'get': UserListResultSerializer}
+        self.assertIs(view.get_result_serializer(request), UserListResultSerializer)
+        self.assertIs(DeterminedView().get_result_serializer(request), serializers.PageApiSerializer)
+
+    def test_invalid_func_class(self):
+        class BadView(CountUserView):
+            FUNC_CLASS = {'get': CountUserFunc, 'post': object}
+            http_method_names = ['get', 'post', 'options']
+
+        self.assertRaises(TypeError, BadView.as_view)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class BatchViewTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('batch_user', role=0)
+
+    def batch(self, items, parallel=False, user=None, session=None):
+        request = APIRequestFactory().post(
+            '/batch/', {'data': {'requests': items, 'parallel': parallel}}, format='json'
+        )
+        if user is not None:
+            request.user = user
+        if session is not None:
+            request.session = session
+        response = WLBatchAPIView.as_view()(request)
+        self.assertEqual(response.data['response']['result'], 200)
+        return [r['response'] for r in response.data['response']['responses']]
+
+    def test_batch(self):
+        responses = self.batch([
+            {'path': '/count/'},
+            {'path': '/whoami/', 'method': 'GET', 'data': {'echo': 'get'}, 'context': {'a': 1}},
+            {'path': '/whoami/', 'method': 'post', 'data': {'echo': 'post'}},
+            {'path': '/not_exist/'},
+            {'path': '/batch/', 'method': 'post'},
+        ], user=self.user)
+
+        self.assertEqual(responses[0], {'result': 200, 'n_users': 1})
+        self.assertEqual(responses[1], {'result': 200, 'user_id': self.user.id, 'echo': 'get'})
+        self.assertEqual(responses[2], {'result': 200, 'user_id': self.user.id, 'echo': 'post'})
+        self.assertEqual(responses[3]['result'], 404)
+        self.assertEqual(responses[4]['result'], 400)
+
+    def test_error_isolation(self):
+        responses = self.batch([
+            {'path': '/whoami/'},
+            {'path': '/count/'},
+        ])
+        self.assertEqual(responses[0]['result'], 404)
+        self.assertEqual(responses[1]['result'], 200)
+
+    def test_parallel(self):
+        responses = self.batch([
+            {'path': '/whoami/', 'data': {'echo': str(i)}} for i in range(6)
+        ], parallel=True, user=self.user)
+        self.assertEqual([r['echo'] for r in responses], [str(i) for i in range(6)])
+
+    def test_parallel_session(self):
+        session = SessionStore()
+        session['stale'] = 'stale'
+        session.modified = False
+        echoes = [str(i) for i in range(6)] + ['drop']
+        responses = self.batch([
+            {'path': '/session/', 'data': {'echo': echo}} for echo in echoes
+        ], parallel=True, session=session)
+        self.assertEqual([r['echo'] for r in responses], echoes)
+        # Each item changed its own copy, all the changes are merged.
+        self.assertEqual([r['keys'] for r in responses], [['echo_%s' % e, 'stale'] for e in echoes[:-1]] + [[]])
+        self.assertEqual(dict(session.items()), {'echo_%s' % i: str(i) for i in range(6)})
+        self.assertTrue(session.modified)
+
+    @override_settings(WL_BATCH_MAX_ITEMS=1)
+    def test_max_items(self):
+        request = APIRequestFactory().post(
+            '/batch/', {'data': {'requests': [{'path': '/count/'}] * 2}}, format='json'
+        )
+        response = WLBatchAPIView.as_view()(request)
+        self.assertEqual(response.data['response']['result'], 400)
+
+
+class StreamingResponseTest(TestCase):
+    def setUp(self):
+        for i in range(10):
+            get_user_model().objects.create_user('user_%d' % i, role=0)
+
+    def get(self, view, **params):
+        response = view.as_view()(APIRequestFactory().get('/', params))
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        else:
+            return json.loads(response.render().content)
+
+    def test_same_envelope(self):
+        for params, n_users in (
+            ({'count_per_page': 8}, 8),
+            ({'count_per_page': 8, 'page': 1}, 2),
+            ({'count_per_page': 100}, 10),
+        ):
+            expected = self.get(UserListView, **params)
+            self.assertEqual(self.get(StreamedUserListView, **params), expected)
+            self.assertEqual(len(expected['response']['users']), n_users)
+
+    def test_fetch_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.get(StreamedUserListView, count_per_page=8)
+        # COUNT, then chunks of 3, 3 and 2 objects.
+        self.assertEqual(len(queries), 4)
+        self.assertEqual([u['name'] for u in result['response']['users']], ['user_%d' % i for i in range(8)])
+
+    @override_settings(WL_SLOW_REQUEST_THRESHOLD=0)
+    def test_scope_and_timing(self):
+        class ContextUserListView(UserListView):
+            FUNC_CLASS = ContextUserListFunc
+
+        handler = RecordingHandler()
+        slow_logger = logging.getLogger('base.views.slow')
+        slow_logger.addHandler(handler)
+        try:
+            response = ContextUserListView.as_view()(APIRequestFactory().get('/', {'count_per_page': 4}))
+            self.assertIn('Server-Timing', response)
+            self.assertEqual(handler.records, [])
+            result = json.loads(b''.join(response.streaming_content))
+        finally:
+            slow_logger.removeHandler(handler)
+
+        self.assertEqual([u['name'] for u in result['response']['users']], ['streamed_user_%d' % i for i in range(4)])
+        phases = handler.records[0].timing['phases']
+        self.assertEqual(phases['stream']['queries'], 2)
+
+    def test_no_transaction(self):
+        class TransactionUserListFunc(StreamedUserListFunc):
+            DB_TRANSACTION = True
+
+        self.assertRaises(
+            AssertionError,
+            TransactionUserListFunc(), APIRequestFactory().get('/'), None, {'page': 0, 'count_per_page': 10}, None
+        )
+
+
+class CachedWhoAmIView(WhoAmIView):
+    RESULT_CACHE = 'default'
+    n_generated = 0
+
+    def get_result_version(self, request, user, args, result):
+        # Table level, the same for all the users.
+        return model_version.model_version(get_user_model())
+
+    def generate_data(self, request, result):
+        CachedWhoAmIView.n_generated += 1
+        return super(CachedWhoAmIView, self).generate_data(request, result)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResultCacheTest(TestCase):
+    def get(self, user, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get('/', **headers)
+        request.user = user
+        return CachedWhoAmIView.as_view()(request)
+
+    def test_user_in_key(self):
+        user_a = get_user_model().objects.create_user('cached_a', role=0)
+        user_b = get_user_model().objects.create_user('cached_b', role=0)
+
+        response_a = self.get(user_a)
+        self.assertEqual(response_a.data['response']['user_id'], user_a.id)
+        response_b = self.get(user_b, etag=response_a['ETag'])
+        self.assertEqual(response_b.status_code, 200)
+        self.assertEqual(response_b.data['response']['user_id'], user_b.id)
+        self.assertEqual(self.get(user_a, etag=response_a['ETag']).status_code, 304)
+
+    def test_rendered_once(self):
+        user = get_user_model().objects.create_user('cached', role=0)
+        CachedWhoAmIView.n_generated = 0
+        response = self.get(user)
+        # Served from the cache, as it was rendered.
+        cached = self.get(user)
+        self.assertEqual(CachedWhoAmIView.n_generated, 1)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+
+class ChoiceBundleTest(TestCase):
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return ChoiceBundleView.as_view()(APIRequestFactory().get('/', params, **headers))
+
+    @staticmethod
+    def unregister(name):
+        field_choice._registry.pop(name)
+        field_choice._registry_version[0] += 1
+
+    def test_bundle(self):
+        from usersys.choices import user_role_choice
+        user_role_choice.alias_choice
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        bundle = json.loads(response.content)['response']['choices']
+        self.assertIn('sms_choice', bundle)
+        self.assertNotIn('user_role_choice_alias_choice', bundle)
+        self.assertEqual(bundle['user_role_choice']['choices'][0], {
+            'name': 'CLIENT', 'value': 0, 'alias': 'client', 'verbose_name': user_role_choice.get_verbose_name(0),
+        })
+
+    def test_etag(self):
+        etag = self.get()['ETag']
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        class BundleTestChoice(field_choice.FieldChoice2):
+            REGISTRY_NAME = 'bundle_test_choice'
+            A = field_choice.FieldChoiceSelection(0, 'a')
+            B = field_choice.FieldChoiceSelection(1, 'b')
+            AB = field_choice.Fieldset(['A', 'B'], alias='all')
+
+        field_choice.register_choice(BundleTestChoice)
+        self.addCleanup(self.unregister, 'bundle_test_choice')
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['response']['choices']['bundle_test_choice']['fieldsets'], [
+            {'name': 'AB', 'alias': 'all', 'verbose_name': 'AB', 'values': [0, 1]},
+        ])
+
+    def test_unsupported_language(self):
+        response = self.get(lang='xx')
+        self.assertEqual(response.data['response']['result'], 400)
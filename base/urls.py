@@ -0,0 +1,7 @@
+from django.conf.urls import url
+from base.views import WLBatchAPIView, ChoiceBundleView
+
+urlpatterns = [
+    url(r'^batch/$', WLBatchAPIView.as_view()),  # Run several api calls in one request.
+    url(r'^choices/$', ChoiceBundleView.as_view()),  # All the choices, to be fetched once per release.
+]
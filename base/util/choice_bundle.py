@@ -0,0 +1,84 @@
+"""
+Choice bundle
+
+Values, aliases, verbose names and fieldsets of all the registered FieldChoice2 classes, encoded once
+per language as the response of the choice bundle endpoint. The bundle is rebuilt when a choice class
+is declared after it has been built.
+"""
+import json
+import hashlib
+
+import six
+from django.conf import settings
+from django.utils import translation
+
+from base.util.field_choice import Fieldset, registered_choices, registry_version
+
+
+# (language, api version) -> (registry version, content, etag)
+_bundles = {}
+
+
+def get_bundle_languages():
+    return getattr(settings, 'WL_CHOICE_BUNDLE_LANGUAGES', None) or [settings.LANGUAGE_CODE]
+
+
+def _sorted_values(values):
+    return sorted(values, key=lambda v: (not isinstance(v, six.integer_types), v))
+
+
+def describe_choice(choice_class):
+    choices = [
+        {
+            'name': name,
+            'value': value,
+            'alias': choice_class._fields[name].alias,
+            'verbose_name': six.text_type(verbose_name),
+        }
+        for value, verbose_name, name in choice_class.CHOICE_DISPLAY
+    ]
+    fieldsets = [
+        {
+            'name': name,
+            'alias': field.alias,
+            'verbose_name': six.text_type(field.verbose_name),
+            'values': _sorted_values(field.real_data),
+        }
+        for name, field in sorted(choice_class._fields.items())
+        if isinstance(field, Fieldset)
+    ]
+    return {
+        'choices': sorted(choices, key=lambda c: c['name']),
+        'fieldsets': fieldsets,
+    }
+
+
+def build_choice_bundle(language):
+    with translation.override(language):
+        return {name: describe_choice(choice_class) for name, choice_class in registered_choices().items()}
+
+
+def encode_choice_bundle(bundle, language, api_version):
+    """
+    :return: the response envelope of the bundle as bytes.
+    """
+    return json.dumps({
+        'response': {'result': 200, 'language': language, 'choices': bundle},
+        'version': api_version,
+        'context': None,
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def get_choice_bundle(language, api_version):
+    """
+    :return: (content, etag) of the encoded bundle of language.
+    """
+    version = registry_version()
+    cached = _bundles.get((language, api_version))
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    content = encode_choice_bundle(build_choice_bundle(language), language, api_version)
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()
+    _bundles[(language, api_version)] = (version, content, etag)
+    return content, etag
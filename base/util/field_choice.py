@@ -5,8 +5,83 @@ Created by Hangyu Fan, May 5, 2018
 
 Last modified: Mar 25, 2019
 """
+import re
 import six
 import copy
+from django.apps import apps
+from django.db.models import F, Q, Value, IntegerField, ExpressionWrapper
+
+
+# Bits of a mask stored as a signed 64-bit integer.
+MAX_MASK_BITS = 63
+
+
+def _is_bit(data):
+    return isinstance(data, six.integer_types) and not isinstance(data, bool) and 0 <= data < MAX_MASK_BITS
+
+
+def _mask_of(values):
+    mask = 0
+    for v in values:
+        mask |= 1 << v
+    return mask
+
+
+# Name -> FieldChoice2 subclass, see registered_choices.
+_registry = {}
+_registry_version = [0]
+
+
+def _registry_name(class_name):
+    # _UserRoleChoice -> user_role_choice, _SMSChoice -> sms_choice
+    name = re.sub(r'(.)([A-Z][a-z]+)', r'\1_\2', class_name.lstrip('_'))
+    return re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name).lower()
+
+
+def _in_app_code(module):
+    parts = module.split('.')
+    if any(part == 'tests' or part.startswith(('test_', 'bench_')) for part in parts):
+        return False
+    if apps.apps_ready:
+        return apps.get_containing_app_config(module) is not None
+    # Declared while the apps are loaded, by the code of an installed app.
+    return True
+
+
+def register_choice(choice_class, name=None):
+    """
+    Register choice_class under name, REGISTRY_NAME or the class name in snake case by default.
+    Choice classes of installed apps are registered when they are declared, except abstract ones.
+    :raise ValueError, if another class is registered under the name.
+    """
+    name = name or choice_class.REGISTRY_NAME or _registry_name(choice_class.__name__)
+    registered = _registry.get(name)
+    # The same class declared again, by a reloaded module for instance, replaces the former one.
+    if registered is not None and (registered.__module__, registered.__name__) != (
+        choice_class.__module__, choice_class.__name__
+    ):
+        raise ValueError("%s.%s and %s.%s are both registered as %s, set REGISTRY_NAME." % (
+            registered.__module__, registered.__name__, choice_class.__module__, choice_class.__name__, name
+        ))
+    _registry[name] = choice_class
+    _registry_version[0] += 1
+
+
+def registered_choices():
+    """
+    :return: {name: class} of the registered FieldChoice2 subclasses, see register_choice. Derived choices
+        (alias, set and sub choices) are never registered.
+    """
+    return dict(_registry)
+
+
+def registry_version():
+    return _registry_version[0]
+
+
+def _data_key(data):
+    # Set data are compared as sets, whatever their iteration order.
+    return frozenset(data) if isinstance(data, (set, frozenset)) else data
 
 
 class FieldChoice(object):
@@ -21,28 +96,49 @@ class FieldChoice(object):
     MAX_LENGTH = None
 
     def __init__(self):
-        self.choice = self._build_django_choice()
-        param_map = self._build_parameter_name()
-        self._verbose_name_map = self._build_verbose_map()
+        self.choice, self._verbose_name_map, param_map, self._choice_values, self._choice_set = self._compile()
         self._set_parameters(param_map)
 
-        self._choice_values = [v[0] for v in self.CHOICE_DISPLAY]
+    @classmethod
+    def _compile(cls):
+        """
+        Lookup tables built once per class and shared by its instances.
+        """
+        compiled = cls.__dict__.get('_compiled')
+        if compiled is None:
+            choice_values = tuple(v[0] for v in cls.CHOICE_DISPLAY)
+            compiled = (
+                cls._build_django_choice(),
+                cls._build_verbose_map(),
+                cls._build_parameter_name(),
+                choice_values,
+                frozenset(_data_key(v) for v in choice_values),
+            )
+            cls._compiled = compiled
+        return compiled
 
-    def _build_django_choice(self):
-        return tuple(map(lambda x: (x[0], x[1]), self.CHOICE_DISPLAY))
+    @classmethod
+    def _build_django_choice(cls):
+        return tuple(map(lambda x: (x[0], x[1]), cls.CHOICE_DISPLAY))
 
-    def _build_verbose_map(self):
-        return dict(map(lambda x: (x[0], x[1]), self.CHOICE_DISPLAY))
+    @classmethod
+    def _build_verbose_map(cls):
+        return dict(map(lambda x: (x[0], x[1]), cls.CHOICE_DISPLAY))
 
-    def _build_parameter_name(self):
-        return dict(map(lambda x: (x[2], x[0]), self.CHOICE_DISPLAY))
+    @classmethod
+    def _build_parameter_name(cls):
+        return dict(map(lambda x: (x[2], x[0]), cls.CHOICE_DISPLAY))
 
     def _set_parameters(self, param_map):
         for k, v in param_map.items():
             self.__setattr__(k, v)
 
     def validate(self, v):
-        return v in self._choice_values
+        try:
+            return _data_key(v) in self._choice_set
+        except TypeError:
+            # Unhashable, hence not a choice.
+            return False
 
     def get_choices(self):
         return list(self._choice_values)
@@ -91,17 +187,7 @@ class FieldChoiceSelection(AbstractFieldChoiceSelection):
             raise TypeError("Invalid data types.")
 
         self.alias = self.alias or attr_name
-
-        for attr, field in fields.items():
-            if attr != attr_name and field.for_select:
-                if field.real_data == self.real_data:
-                    raise ValueError("%s and %s have duplicated choice value %s" % (
-                        attr, attr_name, str(self.real_data)
-                    ))
-                if field.resolved and field.alias == self.alias:
-                    raise ValueError("%s and %s have duplicated alias value %s" % (
-                        attr, attr_name, str(self.alias)
-                    ))
+        # Duplicated values and aliases are checked by FieldChoiceMetaclass once all the fields are resolved.
 
         return super(FieldChoiceSelection, self).resolve_field(
             name, attr_name, bases, attrs, resolved_by
@@ -125,6 +211,9 @@ class SetFieldChoiceSelection(FieldChoiceSelection):
 
 
 class FieldsetContainer(set):
+    # Bitmask of the values, set for the fieldsets of a BITMASK choice.
+    mask = None
+
     def __init__(self, fieldset, *args, **kwargs):
         self._fieldset = fieldset
         super(FieldsetContainer, self).__init__(*args, **kwargs)
@@ -143,6 +232,7 @@ class FieldsetContainer(set):
                 )
                 for field_name, field in self._fieldset._fieldset_fields.items()
             }
+            attrs['_derived'] = True
             sub_choice_instance = FieldChoiceMetaclass(
                 self._fieldset._attr_name + 'SubChoice',
                 (FieldChoice2, ),
@@ -183,16 +273,17 @@ class Fieldset(AbstractFieldChoiceSelection):
 
             self._real_data = FieldsetContainer(fieldset=self)
             self._fieldset_fields = {}
+            field_names = {id(v): k for k, v in fields.items()}
 
             for s in self._data_unresolved:
-                if s not in fields and s not in fields.values():
-                    raise ValueError("%s is not a name or value of field." % s)
-                if isinstance(s, six.string_types):
+                if isinstance(s, six.string_types) and s in fields:
                     field_to_resolve = fields[s]
                     s_attr_name = s
-                elif isinstance(s, AbstractFieldChoiceSelection):
+                elif isinstance(s, AbstractFieldChoiceSelection) and id(s) in field_names:
                     field_to_resolve = s
-                    s_attr_name = self.find_field_name(fields, s)
+                    s_attr_name = field_names[id(s)]
+                elif s not in fields:
+                    raise ValueError("%s is not a name or value of field." % s)
                 else:
                     raise AssertionError('real data of fieldset must be string or field.')
 
@@ -232,11 +323,37 @@ class Fieldset(AbstractFieldChoiceSelection):
     def sub_choice(self):
         return self._real_data.sub_choice
 
+    @property
+    def mask(self):
+        return self.real_data.mask
+
 
 FieldSet = Fieldset
 
 
+# Attributes of a choice class which cannot be changed once it is built, besides its choices.
+_FROZEN_ATTRIBUTES = frozenset([
+    'CHOICE_DISPLAY', 'BITMASK', 'REGISTRY_NAME', 'ABSTRACT', 'MAX_LENGTH',
+    '_fields', '_field_alias', '_field_data', '_fieldset_names', '_choices_mask',
+])
+# Lookup tables and derived choices, set once when they are first needed.
+_LAZY_ATTRIBUTES = frozenset(['_compiled', '_alias_choice_instance', '_set_choice_instances'])
+
+
+def _check_mutable(cls, name):
+    if name in _FROZEN_ATTRIBUTES or name in cls._fields or (name in _LAZY_ATTRIBUTES and name in cls.__dict__):
+        raise AttributeError("%s.%s cannot be changed, choice classes are immutable." % (cls.__name__, name))
+
+
 class FieldChoiceMetaclass(type):
+    def __setattr__(cls, name, value):
+        _check_mutable(cls, name)
+        super(FieldChoiceMetaclass, cls).__setattr__(name, value)
+
+    def __delattr__(cls, name):
+        _check_mutable(cls, name)
+        super(FieldChoiceMetaclass, cls).__delattr__(name)
+
     def __new__(mcs, name, bases, attrs):
         bases_reversed = reversed(bases)
         fields = reduce(
@@ -251,10 +368,25 @@ class FieldChoiceMetaclass(type):
 
         field_alias_map = {}
         field_data_map = {}
+        # Names of the selections by value and by alias, to find duplicates in linear time.
+        select_data = {}
+        select_alias = {}
         for attr_name, field in fields.items():  # type: (str, AbstractFieldChoiceSelection)
             field_resolved = field.resolve_field(name, attr_name, bases, attrs, fields)
             fields[attr_name] = field_resolved
             if field_resolved.for_select:
+                data_key = _data_key(field_resolved.real_data)
+                if data_key in select_data:
+                    raise ValueError("%s and %s have duplicated choice value %s" % (
+                        select_data[data_key], attr_name, str(field_resolved.real_data)
+                    ))
+                if field_resolved.alias in select_alias:
+                    raise ValueError("%s and %s have duplicated alias value %s" % (
+                        select_alias[field_resolved.alias], attr_name, str(field_resolved.alias)
+                    ))
+                select_data[data_key] = attr_name
+                select_alias[field_resolved.alias] = attr_name
+
                 choice_display.append((field_resolved.real_data, field_resolved.verbose_name, attr_name))
                 field_data_map[field_resolved.real_data] = field_resolved
             if hasattr(field_resolved, 'alias'):
@@ -264,13 +396,44 @@ class FieldChoiceMetaclass(type):
         attrs['_fields'] = fields
         attrs['_field_alias'] = field_alias_map
         attrs['_field_data'] = field_data_map
+        attrs['_fieldset_names'] = tuple(k for k, v in fields.items() if isinstance(v, Fieldset))
+
+        if attrs.get('BITMASK', any(getattr(base, 'BITMASK', False) for base in bases)):
+            for value in field_data_map:
+                if not _is_bit(value):
+                    raise ValueError("Choice value %s of a bitmask choice must be an integer in [0, %d)." % (
+                        str(value), MAX_MASK_BITS
+                    ))
+            for field in fields.values():
+                if isinstance(field, Fieldset):
+                    field.real_data.mask = _mask_of(field.real_data)
+            attrs['_choices_mask'] = _mask_of(field_data_map)
+
         attrs['CHOICE_DISPLAY'] = choice_display
         attrs.update(**params)
-        return super(FieldChoiceMetaclass, mcs).__new__(mcs, name, bases, attrs)
+        cls = super(FieldChoiceMetaclass, mcs).__new__(mcs, name, bases, attrs)
+
+        if (
+            not attrs.get('_derived', False) and not attrs.get('ABSTRACT', False)
+            and any(isinstance(base, FieldChoiceMetaclass) for base in bases)
+            and _in_app_code(attrs.get('__module__', ''))
+        ):
+            register_choice(cls)
+
+        return cls
 
 
 @six.add_metaclass(FieldChoiceMetaclass)
 class FieldChoice2(FieldChoice):
+    # Give the bit 1 << value to each choice, the values must be integers in [0, 63).
+    # Fieldsets then have a mask, and groups of choices can be handled as integers.
+    BITMASK = False
+    # Name in registered_choices, the class name in snake case by default.
+    REGISTRY_NAME = None
+    # Abstract choices are not registered, only set in the class body, it is not inherited.
+    ABSTRACT = False
+    _derived = False
+
     def get_verbose_name(self, choice, use_field_name=False):
         if use_field_name:
             return unicode(self._fields[choice].verbose_name)
@@ -298,8 +461,10 @@ class FieldChoice2(FieldChoice):
         Alias Choice Uses alias of each data field as the choice value.
         :return: the alias choice.
         """
-        if hasattr(self, '_alias_choice_instance'):
-            return self._alias_choice_instance
+        # Derived choices are built once per class.
+        cls = self.__class__
+        if '_alias_choice_instance' in cls.__dict__:
+            return cls._alias_choice_instance
         else:
             attrs = {
                 field_name: FieldChoiceSelection(
@@ -310,17 +475,28 @@ class FieldChoice2(FieldChoice):
                 for field_name, field in self._fields.items()
                 if isinstance(field, FieldChoiceSelection)
             }
+            attrs['_derived'] = True
             alias_choice_instance = FieldChoiceMetaclass(
-                self.__class__.__name__ + 'AliasChoice',
+                cls.__name__ + 'AliasChoice',
                 (FieldChoice2, ),
                 attrs,
             )()
-            self._alias_choice_instance = alias_choice_instance
+            cls._alias_choice_instance = alias_choice_instance
             return alias_choice_instance
 
     def get_set_choice(self, fields=None):
         if fields is None:
-            fields = [k for k, v in self._fields.items() if isinstance(v, Fieldset)]
+            fields = self._fieldset_names
+
+        cls = self.__class__
+        if '_set_choice_instances' not in cls.__dict__:
+            cls._set_choice_instances = {}
+        key = frozenset(fields)
+        if key not in cls._set_choice_instances:
+            cls._set_choice_instances[key] = self._build_set_choice(fields)
+        return cls._set_choice_instances[key]
+
+    def _build_set_choice(self, fields):
 
         attrs = {}
         for field_name in fields:
@@ -331,8 +507,64 @@ class FieldChoice2(FieldChoice):
                 alias=field.alias,
             )
 
+        attrs['_derived'] = True
         return FieldChoiceMetaclass(
             self.__class__.__name__ + 'SetChoice',
             (FieldChoice2,),
             attrs,
         )()
+
+    def _check_bitmask(self):
+        if not self.BITMASK:
+            raise TypeError("%s is not a bitmask choice." % self.__class__.__name__)
+
+    def get_mask(self, *items):
+        """
+        :param items: choice values, fieldsets or collections of values.
+        :return: bitmask of all the values of the items.
+        """
+        self._check_bitmask()
+        mask = 0
+        for item in items:
+            if isinstance(item, FieldsetContainer) and item.mask is not None:
+                mask |= item.mask
+            elif isinstance(item, (set, frozenset, list, tuple)):
+                mask |= self.get_mask(*item)
+            elif _is_bit(item):
+                mask |= 1 << item
+            else:
+                raise ValueError("%s is not a value of a bitmask choice." % str(item))
+        return mask
+
+    def mask_contains(self, mask, value):
+        return _is_bit(value) and (mask >> value) & 1 == 1
+
+    def get_mask_values(self, mask):
+        """
+        :return: sorted choice values whose bit is set in mask.
+        """
+        self._check_bitmask()
+        mask &= self._choices_mask
+        return [v for v in range(mask.bit_length()) if (mask >> v) & 1]
+
+    def mask_q(self, field_name, mask):
+        """
+        :return: Q filtering field_name on the values of mask, with a compact __in list.
+        """
+        return Q(**{field_name + '__in': self.get_mask_values(mask)})
+
+    def filter_mask(self, queryset, field_name, mask, stored_as_mask=False):
+        """
+        Filter queryset with a bitwise test in SQL.
+        :param stored_as_mask: field_name holds masks rather than single values, the rows sharing a bit
+            with mask are kept.
+        """
+        self._check_bitmask()
+        if stored_as_mask:
+            bits = F(field_name)
+        else:
+            bits = Value(1, output_field=IntegerField()).bitleftshift(F(field_name))
+        annotation = '_%s_mask' % field_name.replace('__', '_')
+        return queryset.annotate(**{
+            annotation: ExpressionWrapper(bits.bitand(mask), output_field=IntegerField())
+        }).filter(**{annotation + '__gt': 0})
@@ -0,0 +1,44 @@
+"""
+Fixed point numbers
+
+A fixed point number is the integer count of its units of 10 ** -decimal_places, e.g. milli-units of a currency.
+Sums and comparisons are those of integers, the conversions from and to decimals are exact.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+import six
+
+
+def to_units(value, decimal_places, rounding=None):
+    """
+    :param value: a Decimal, an integer or the string of a decimal number.
+    :param rounding: rounding of the decimal places in excess, they are an error when None.
+    :return: the integer count of units of value.
+    """
+    if isinstance(value, six.integer_types):
+        return value * 10 ** decimal_places
+    if not isinstance(value, Decimal):
+        value = Decimal(six.text_type(value))
+
+    units = value.scaleb(decimal_places)
+    integral = units.to_integral_value(rounding=rounding or ROUND_HALF_UP)
+    if rounding is None and integral != units:
+        raise ValueError("%s has more than %d decimal places." % (value, decimal_places))
+    return int(integral)
+
+
+def from_units(units, decimal_places):
+    """
+    :return: the Decimal of units, with decimal_places decimal places.
+    """
+    return Decimal(units).scaleb(-decimal_places)
+
+
+def format_units(units, decimal_places):
+    """
+    :return: the string of the decimal of units, as '{0:f}'.format(from_units(units, decimal_places)).
+    """
+    if not decimal_places:
+        return '%d' % units
+    whole, fraction = divmod(abs(units), 10 ** decimal_places)
+    return '%s%d.%0*d' % ('-' if units < 0 else '', whole, decimal_places, fraction)
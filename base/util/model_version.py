@@ -0,0 +1,93 @@
+"""
+Model version counters
+
+Every tracked model has a counter per instance and one for the whole table, both bumped by
+post_save and post_delete. They are kept in settings.WL_MODEL_VERSION_CACHE (default cache by
+default), so they are shared by all processes using the same cache.
+
+Updates bypassing the signals, such as QuerySet.update, are not seen.
+"""
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+
+
+def get_version_cache():
+    return caches[getattr(settings, 'WL_MODEL_VERSION_CACHE', 'default')]
+
+
+def _model_label(model):
+    return model._meta.label_lower
+
+
+def _model_key(model):
+    return 'wl_mv:%s' % _model_label(model)
+
+
+def _instance_key(model, pk):
+    return 'wl_mv:%s:%s' % (_model_label(model), pk)
+
+
+def _initial_version():
+    # When a counter is evicted it restarts from the current time rather than from zero,
+    # so that a version handed out before the eviction is not handed out again.
+    return int(time.time() * 1000)
+
+
+def _get_version(key):
+    cache = get_version_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key)
+    # None if the cache does not store anything, e.g. DummyCache.
+    return version
+
+
+def _bump(key):
+    cache = get_version_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+
+def _on_change(sender, instance, **kwargs):
+    _bump(_instance_key(sender, instance.pk))
+    _bump(_model_key(sender))
+
+
+_tracked_models = set()
+
+
+def track_model(model):
+    """
+    Start bumping the versions of the model on changes. Calling it multiple times is harmless,
+    the signals are connected by the first call only.
+    """
+    if model in _tracked_models:
+        return
+    uid = 'wl_model_version_%s' % _model_label(model)
+    post_save.connect(_on_change, sender=model, dispatch_uid=uid)
+    post_delete.connect(_on_change, sender=model, dispatch_uid=uid)
+    _tracked_models.add(model)
+
+
+def instance_version(instance):
+    """
+    :return: (model label, pk, version) of the instance, None if versions cannot be kept.
+    """
+    model = instance.__class__
+    track_model(model)
+    version = _get_version(_instance_key(model, instance.pk))
+    return None if version is None else (_model_label(model), instance.pk, version)
+
+
+def model_version(model):
+    """
+    :return: (model label, version) of the whole table, None if versions cannot be kept.
+    """
+    track_model(model)
+    version = _get_version(_model_key(model))
+    return None if version is None else (_model_label(model), version)
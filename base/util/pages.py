@@ -3,9 +3,161 @@ Pages utility
 
 Written by Hydra, May 15, 2018
 """
+import json
+import math
+import uuid
+import hashlib
+import base64
+import decimal
+import datetime
 
+import six
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from django.db.models.query import QuerySet
+from django.db.models.sql import Query
+from django.db.models.sql.where import ExtraWhere
+from base.util.model_version import model_version
 
-def get_page_info(queryset, count_per_page, page, page_start=0, index_error_excepiton=None):
+
+class ExactCount(object):
+    """
+    Count provider running COUNT(*) for each call.
+    """
+    exact = True
+
+    def count(self, queryset):
+        """
+        :return: count, upper bound of the real count.
+        """
+        count = queryset.count()
+        return count, count
+
+
+def _query_tables(node, tables):
+    """
+    Add the tables read by node, a query or a part of it, to tables: those joined and those of the
+    subqueries of its filters and annotations.
+    :return: False if it reads tables which cannot be known, through extra() or RawSQL.
+    """
+    if isinstance(node, QuerySet):
+        node = node.query
+    if isinstance(node, Query):
+        tables.update(join.table_name for join in node.alias_map.values())
+        if node.extra:
+            return False
+        return all(_query_tables(n, tables) for n in [node.where] + list(node.annotations.values()))
+    if isinstance(node, (ExtraWhere, RawSQL)):
+        return False
+    if isinstance(node, (list, tuple)):
+        return all(_query_tables(n, tables) for n in node)
+
+    children = list(getattr(node, 'children', None) or [])
+    for attr in ('lhs', 'rhs', 'queryset', 'query_object'):
+        child = getattr(node, attr, None)
+        if child is not None:
+            children.append(child)
+    if hasattr(node, 'get_source_expressions'):
+        children.extend(node.get_source_expressions())
+    return all(_query_tables(n, tables) for n in children)
+
+
+class CachedCount(ExactCount):
+    """
+    Exact count cached per normalized SQL of the queryset. The cache key embeds the versions
+    (see base.util.model_version) of every model the query reads, joined or in a subquery, so
+    post_save / post_delete of any of them invalidates it. Querysets reading tables through
+    extra() or RawSQL are counted without cache.
+    """
+
+    def __init__(self, cache_alias='default', timeout=300):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self._table_models = None
+
+    def get_table_models(self):
+        if self._table_models is None:
+            self._table_models = {m._meta.db_table: m for m in apps.get_models(include_auto_created=True)}
+        return self._table_models
+
+    def get_cache_key(self, queryset):
+        queryset = queryset.order_by()
+        query = queryset.query
+        sql, params = query.get_compiler(queryset.db).as_sql()
+        tables = set()
+        if not _query_tables(query, tables):
+            return None
+
+        table_models = self.get_table_models()
+        versions = []
+        for table in sorted(tables):
+            version = model_version(table_models[table]) if table in table_models else None
+            if version is None:
+                return None
+            versions.append(version)
+
+        key = json.dumps([queryset.db, sql, params, versions], default=six.text_type)
+        return 'wl_count:%s' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def count(self, queryset):
+        key = self.get_cache_key(queryset)
+        if key is None:
+            return super(CachedCount, self).count(queryset)
+
+        cache = caches[self.cache_alias]
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.timeout)
+        return count, count
+
+
+class EstimatedCount(ExactCount):
+    """
+    Count estimated from the statistics of the database (EXPLAIN), falls back to an exact count
+    when the database gives no estimate or the estimate is below exact_threshold.
+    The real count is assumed to be at most max_error (relative) above the estimate, pages are
+    accepted up to that bound.
+    """
+    exact = False
+
+    def __init__(self, max_error=0.2, exact_threshold=1000):
+        self.max_error = max_error
+        self.exact_threshold = exact_threshold
+
+    def estimate(self, queryset):
+        queryset = queryset.order_by()
+        connection = connections[queryset.db]
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute('EXPLAIN ' + sql, params)
+                columns = [c[0] for c in cursor.description]
+                row = dict(zip(columns, cursor.fetchone()))
+                filtered = row.get('filtered')
+                return int((row['rows'] or 0) * (float(filtered) / 100 if filtered is not None else 1))
+            elif connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, six.string_types):
+                    plan = json.loads(plan)
+                return int(plan[0]['Plan']['Plan Rows'])
+            else:
+                return None
+
+    def count(self, queryset):
+        estimate = self.estimate(queryset)
+        if estimate is None or estimate <= self.exact_threshold:
+            return super(EstimatedCount, self).count(queryset)
+        return estimate, int(math.ceil(estimate * (1 + self.max_error)))
+
+
+def get_page_info(queryset, count_per_page, page, page_start=0, index_error_excepiton=None, count_provider=None):
     """
 
     :param queryset: The queryset object
@@ -13,12 +165,19 @@ def get_page_info(queryset, count_per_page, page, page_start=0, index_error_exce
     :param page: current page
     :param page_start,
     :param index_error_excepiton
+    :param count_provider: ExactCount, CachedCount or EstimatedCount instance, exact count by default.
     :return: lower_bound, upper_bound, n_pages
     :raise IndexError, if page exceeds max page or index_error_exception.
     """
 
-    n_pages = (queryset.count() + (count_per_page - 1)) / count_per_page
-    if (page - page_start > n_pages - 1 or page - page_start < 0) and not page == page_start:
+    if count_provider is None:
+        count = upper_count = queryset.count()
+    else:
+        count, upper_count = count_provider.count(queryset)
+
+    n_pages = (count + (count_per_page - 1)) / count_per_page
+    max_pages = (upper_count + (count_per_page - 1)) / count_per_page
+    if (page - page_start > max_pages - 1 or page - page_start < 0) and not page == page_start:
         if index_error_excepiton is not None:
             raise index_error_excepiton
         else:
@@ -51,3 +210,180 @@ def get_page_info_list(o_list, count_per_page, page, page_start=0, index_error_e
     start = page * count_per_page - page_start
     end = (page + 1) * count_per_page - page_start
     return start, end, n_pages
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return six.text_type(value)
+    else:
+        return value
+
+
+def encode_cursor(values, reverse=False):
+    """
+    :param values: values of the ordering keys of the object at the page boundary.
+    :param reverse: True if the cursor points to the previous page.
+    :return: an opaque cursor string.
+    """
+    data = json.dumps([1 if reverse else 0] + [_encode_cursor_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, ordering_fields):
+    """
+    :return: values, reverse
+    :raise ValueError, if the cursor is invalid.
+    """
+    try:
+        cursor = str(cursor)
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor.")
+
+    if not isinstance(data, list) or len(data) != len(ordering_fields) + 1 or data[0] not in (0, 1):
+        raise ValueError("Invalid cursor.")
+
+    try:
+        values = [field.to_python(v) for field, v in zip(ordering_fields, data[1:])]
+    except ValidationError:
+        raise ValueError("Invalid cursor.")
+
+    return values, bool(data[0])
+
+
+def get_cursor_ordering(queryset):
+    """
+    :return: list of (lookup path, model field, descending) the queryset is ordered by,
+        ended by the primary key so that the ordering is total. NULLs of nullable fields are paged after
+        the values, in both directions.
+    :raise TypeError, if the queryset is ordered by something other than field paths.
+    """
+    if queryset.query.order_by:
+        order_by = queryset.query.order_by
+    elif queryset.query.default_ordering:
+        order_by = queryset.model._meta.ordering
+    else:
+        order_by = []
+
+    opts = queryset.model._meta
+    ordering = []
+    for item in order_by:
+        if not isinstance(item, six.string_types) or item == '?':
+            raise TypeError("Cursor pagination only supports ordering by field paths, got %s." % item)
+        descending = item.startswith('-')
+        path = item.lstrip('-+')
+
+        model_opts = opts
+        parts = path.split(LOOKUP_SEP)
+        for part in parts[:-1]:
+            model_opts = model_opts.get_field(part).related_model._meta
+        field = model_opts.pk if parts[-1] == 'pk' else model_opts.get_field(parts[-1])
+        if field.is_relation:
+            raise TypeError("Order by %s_id rather than the relation %s." % (path, path))
+
+        ordering.append((path, field, descending))
+
+    if not any(field is opts.pk for _, field, _ in ordering):
+        ordering.append((opts.pk.attname, opts.pk, False))
+
+    return ordering
+
+
+def _cursor_values(obj, ordering):
+    values = []
+    for path, field, _ in ordering:
+        o = obj
+        for part in path.split(LOOKUP_SEP)[:-1]:
+            o = getattr(o, part)
+        values.append(getattr(o, field.attname))
+    return values
+
+
+def _cursor_order_by(ordering, reverse=False):
+    # NULLs of nullable keys are ordered after the values, whatever the database, and before them in reverse.
+    order_by = []
+    for path, field, descending in ordering:
+        descending = descending != reverse
+        if field.null:
+            expression = F(path).desc if descending else F(path).asc
+            order_by.append(expression(nulls_first=reverse, nulls_last=not reverse))
+        else:
+            order_by.append(('-' if descending else '') + path)
+    return order_by
+
+
+def _after_key(path, field, descending, value, before):
+    """
+    :return: Q of the rows whose key comes after value (before it for previous pages), None if none can.
+    """
+    if value is None:
+        # NULLs are last.
+        return Q(**{'%s__isnull' % path: False}) if before else None
+
+    condition = Q(**{'%s__%s' % (path, 'gt' if descending == before else 'lt'): value})
+    if field.null and not before:
+        condition |= Q(**{'%s__isnull' % path: True})
+    return condition
+
+
+def _keyset_filter(ordering, values, before):
+    # (k1 > v1) | (k1 == v1 & k2 > v2) | ..., comparisons flipped for descending keys and previous pages.
+    q = None
+    for i, (path, field, descending) in enumerate(ordering):
+        condition = _after_key(path, field, descending, values[i], before)
+        if condition is None:
+            continue
+        for j in range(i):
+            prev_path, value = ordering[j][0], values[j]
+            condition &= Q(**{'%s__isnull' % prev_path: True} if value is None else {prev_path: value})
+        q = condition if q is None else q | condition
+
+    # The redundant bound of the first key lets the database seek an index instead of scanning.
+    path, field, descending = ordering[0]
+    if field.null:
+        return q
+    return Q(**{'%s__%s' % (path, 'gte' if descending == before else 'lte'): values[0]}) & q
+
+
+def get_cursor_page(queryset, count_per_page, cursor=None, invalid_cursor_exception=None):
+    """
+    Keyset pagination, the page is located by the ordering key values encoded in the cursor
+    instead of an offset, and the total count is never computed.
+
+    :param queryset: The queryset object, ordered by field paths.
+    :param count_per_page:
+    :param cursor: cursor returned along with the previous page, None for the first page.
+    :param invalid_cursor_exception
+    :return: objects, next cursor, previous cursor
+    :raise ValueError, if the cursor is invalid and invalid_cursor_exception is None.
+    """
+    ordering = get_cursor_ordering(queryset)
+
+    before = False
+    qs = queryset
+    if cursor:
+        try:
+            values, before = decode_cursor(cursor, [field for _, field, _ in ordering])
+        except ValueError:
+            if invalid_cursor_exception is not None:
+                raise invalid_cursor_exception
+            raise
+        qs = qs.filter(_keyset_filter(ordering, values, before))
+    qs = qs.order_by(*_cursor_order_by(ordering, reverse=before))
+
+    objs = list(qs[:count_per_page + 1])
+    has_more = len(objs) > count_per_page
+    objs = objs[:count_per_page]
+    if before:
+        objs.reverse()
+
+    if not objs:
+        return objs, None, None
+
+    has_next = has_more if not before else True
+    has_prev = bool(cursor) if not before else has_more
+    next_cursor = encode_cursor(_cursor_values(objs[-1], ordering)) if has_next else None
+    prev_cursor = encode_cursor(_cursor_values(objs[0], ordering), reverse=True) if has_prev else None
+    return objs, next_cursor, prev_cursor
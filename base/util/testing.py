@@ -0,0 +1,30 @@
+"""
+Test utilities
+"""
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryCountTestMixin(object):
+    """
+    Mixin of TestCase asserting that the number of queries of an endpoint does not grow with its page size.
+    """
+
+    def assertQueryCountConstant(self, run, sizes=(1, 10), using='default'):
+        """
+        :param run: callable taking a size, e.g. performing a list request with count_per_page=size.
+        :param sizes: sizes to compare.
+        :return: the number of queries.
+        """
+        counts = []
+        for size in sizes:
+            with CaptureQueriesContext(connections[using]) as ctx:
+                run(size)
+            counts.append((size, len(ctx), [q['sql'] for q in ctx.captured_queries]))
+
+        if len({count for _, count, _ in counts}) > 1:
+            self.fail("Number of queries grows with size:\n%s" % "\n".join(
+                "size %d: %d queries\n    %s" % (size, count, "\n    ".join(sqls)) for size, count, sqls in counts
+            ))
+
+        return counts[0][1]
@@ -0,0 +1,60 @@
+"""
+Benchmark of FieldChoice2 with large enumerations.
+
+Not collected by the test runner, run it with:
+    python manage.py test base.util.tests.bench_field_choice
+"""
+import time
+
+from django.test import SimpleTestCase
+
+from .. import field_choice
+
+
+def build_choice_class(n, n_sets=10):
+    attrs = {
+        'c%d' % i: field_choice.FieldChoiceSelection(i, 'choice %d' % i, alias='alias_%d' % i)
+        for i in range(n)
+    }
+    step = n // n_sets
+    for j in range(n_sets):
+        attrs['s%d' % j] = field_choice.Fieldset(['c%d' % i for i in range(j * step, (j + 1) * step)])
+    return type(field_choice.FieldChoice2)(str('Bench%dChoice' % n), (field_choice.FieldChoice2, ), attrs)
+
+
+class FieldChoiceBenchmark(SimpleTestCase):
+    SIZES = (1000, 10000)
+    ROUNDS = 10000
+
+    def timeit(self, func, rounds=1):
+        start = time.time()
+        for _ in range(rounds):
+            func()
+        return (time.time() - start) / rounds
+
+    def test_large_choices(self):
+        print('')
+        build_times = []
+        for n in self.SIZES:
+            build = self.timeit(lambda: build_choice_class(n)())
+            build_times.append(build)
+            choice = build_choice_class(n)()
+            last, alias = n - 1, 'alias_%d' % (n - 1)
+
+            validate = self.timeit(lambda: choice.validate(last), self.ROUNDS)
+            verbose = self.timeit(lambda: choice.get_verbose_name(last), self.ROUNDS)
+            get_alias = self.timeit(lambda: choice.get_alias(last), self.ROUNDS)
+            alias_data = self.timeit(lambda: choice.get_alias_real_data(alias), self.ROUNDS)
+            alias_choice_first = self.timeit(lambda: choice.alias_choice)
+            alias_choice = self.timeit(lambda: choice.alias_choice, self.ROUNDS)
+            set_choice_first = self.timeit(lambda: choice.get_set_choice())
+            set_choice = self.timeit(lambda: choice.get_set_choice(), self.ROUNDS)
+
+            print('%5d choices: class %.1fms, validate %.2fus, get_verbose_name %.2fus, get_alias %.2fus, '
+                  'get_alias_real_data %.2fus, alias_choice %.1fms then %.2fus, get_set_choice %.1fms then %.2fus' % (
+                      n, build * 1e3, validate * 1e6, verbose * 1e6, get_alias * 1e6, alias_data * 1e6,
+                      alias_choice_first * 1e3, alias_choice * 1e6, set_choice_first * 1e3, set_choice * 1e6,
+                  ))
+
+        # Construction grows linearly: far from x100 for x10 choices.
+        self.assertLess(build_times[1] / build_times[0], 30)
@@ -0,0 +1,59 @@
+"""
+Benchmark of offset against cursor pagination on deep pages.
+
+Not collected by the test runner, run it with:
+    python manage.py test base.util.tests.bench_pages
+"""
+import time
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from .. import pages
+
+
+class PaginationBenchmark(TestCase):
+    N_ROWS = 100000
+    COUNT_PER_PAGE = 10
+    PAGES = (0, 10, 100, 1000, 9999)
+    ROUNDS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        user_model = get_user_model()
+        user_model.objects.bulk_create(
+            [user_model(internal_name='bench_%06d' % i, role=i % 4) for i in range(cls.N_ROWS)],
+            batch_size=100,
+        )
+
+    def timeit(self, func):
+        start = time.time()
+        for _ in range(self.ROUNDS):
+            func()
+        return (time.time() - start) / self.ROUNDS * 1000
+
+    def offset_page(self, qs, page):
+        start, end, n_pages = pages.get_page_info(qs, self.COUNT_PER_PAGE, page)
+        return list(qs[start:end])
+
+    def test_deep_pages(self):
+        qs = get_user_model().objects.order_by('internal_name')
+        ordering = pages.get_cursor_ordering(qs)
+        print('')
+        print('%8s %12s %12s' % ('page', 'offset(ms)', 'cursor(ms)'))
+        for page in self.PAGES:
+            if page == 0:
+                cursor = None
+            else:
+                boundary = qs[page * self.COUNT_PER_PAGE - 1]
+                cursor = pages.encode_cursor(pages._cursor_values(boundary, ordering))
+
+            offset_objs = self.offset_page(qs, page)
+            cursor_objs = pages.get_cursor_page(qs, self.COUNT_PER_PAGE, cursor)[0]
+            self.assertEqual(offset_objs, cursor_objs)
+
+            print('%8d %12.3f %12.3f' % (
+                page + 1,
+                self.timeit(lambda: self.offset_page(qs, page)),
+                self.timeit(lambda: pages.get_cursor_page(qs, self.COUNT_PER_PAGE, cursor)),
+            ))
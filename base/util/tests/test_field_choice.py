@@ -1,4 +1,7 @@
 from unittest import TestCase
+from django.test import TestCase as DjangoTestCase
+from django.contrib.auth import get_user_model
+from usersys.choices import user_role_choice
 from .. import field_choice
 
 
@@ -94,3 +97,89 @@ class TestFieldChoice2(TestCase):
         self.assertSetEqual(set_choice.ts1, ts1_data)
         self.assertSetEqual(set(set_choice.alias_choice.get_choices()), {'ts1_alias', 'ts2'})
         self.assertSetEqual(set_choice.get_alias_real_data('ts1_alias'), ts1_data)
+
+
+    def test_immutable(self):
+        choice_class = self.create_good_field_choice().__class__
+        choice_class().get_choices()
+        choice_class.EXTRA = 1
+        for name in ('t1', 'ts1', 'CHOICE_DISPLAY', '_fields', '_compiled'):
+            self.assertRaises(AttributeError, setattr, choice_class, name, None)
+            self.assertRaises(AttributeError, delattr, choice_class, name)
+        self.assertEqual(choice_class.t1, 1)
+
+    def test_registry(self):
+        class TestChoice(field_choice.FieldChoice2):
+            A = field_choice.FieldChoiceSelection(0)
+
+        class AbstractChoice(field_choice.FieldChoice2):
+            ABSTRACT = True
+
+        # Choices of tests and abstract choices are not registered.
+        self.assertNotIn('test_choice', field_choice.registered_choices())
+        self.assertNotIn('abstract_choice', field_choice.registered_choices())
+        self.assertIs(field_choice.registered_choices()['user_role_choice'], user_role_choice.__class__)
+
+        class UserRoleChoice(field_choice.FieldChoice2):
+            A = field_choice.FieldChoiceSelection(0)
+
+        self.assertRaises(ValueError, field_choice.register_choice, UserRoleChoice)
+        self.assertRaises(ValueError, field_choice.register_choice, TestChoice, 'user_role_choice')
+        self.assertIs(field_choice.registered_choices()['user_role_choice'], user_role_choice.__class__)
+
+
+class BitmaskChoice(field_choice.FieldChoice2):
+    BITMASK = True
+
+    A = field_choice.FieldChoiceSelection(0)
+    B = field_choice.FieldChoiceSelection(1)
+    C = field_choice.FieldChoiceSelection(5)
+    AB = field_choice.Fieldset(['A', 'B'])
+    BC = field_choice.Fieldset(['B', 'C'])
+
+
+bitmask_choice = BitmaskChoice()
+
+
+class TestBitmaskFieldChoice(TestCase):
+    def test_masks(self):
+        self.assertEqual(bitmask_choice.AB.mask, 0b11)
+        self.assertEqual(BitmaskChoice.BC.mask, 0b100010)
+        self.assertEqual(bitmask_choice.get_mask(bitmask_choice.AB, bitmask_choice.C), 0b100011)
+        self.assertEqual(bitmask_choice.get_mask([0, 5]), 0b100001)
+        self.assertEqual(bitmask_choice.get_mask_values(bitmask_choice.AB.mask & bitmask_choice.BC.mask), [1])
+        # Bits of no choice are ignored.
+        self.assertEqual(bitmask_choice.get_mask_values(0b1110), [1])
+        self.assertTrue(bitmask_choice.mask_contains(bitmask_choice.BC.mask, 5))
+        self.assertFalse(bitmask_choice.mask_contains(bitmask_choice.BC.mask, 0))
+        self.assertFalse(bitmask_choice.mask_contains(bitmask_choice.BC.mask, 'B'))
+        self.assertRaises(ValueError, bitmask_choice.get_mask, 63)
+
+    def test_invalid(self):
+        def create(value):
+            class BadBitmaskChoice(field_choice.FieldChoice2):
+                BITMASK = True
+                A = field_choice.FieldChoiceSelection(value)
+
+        self.assertRaises(ValueError, create, 63)
+        self.assertRaises(ValueError, create, -1)
+        self.assertRaises(ValueError, create, 'a')
+        self.assertRaises(TypeError, user_role_choice.alias_choice.get_mask, 1)
+
+
+class TestBitmaskQueryset(DjangoTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for role in user_role_choice.get_choices():
+            get_user_model().objects.create_user('role_%d' % role, role=role)
+
+    def roles(self, queryset):
+        return sorted(queryset.values_list('role', flat=True))
+
+    def test_filters(self):
+        mask = user_role_choice.get_mask(user_role_choice.CLIENT, user_role_choice.QC_ASSISTANT)
+        users = get_user_model().objects.all()
+        self.assertEqual(self.roles(users.filter(user_role_choice.mask_q('role', mask))), [0, 3])
+        self.assertEqual(self.roles(user_role_choice.filter_mask(users, 'role', mask)), [0, 3])
+        # Read as masks, the roles 1 and 3 share a bit with 0b1001.
+        self.assertEqual(self.roles(user_role_choice.filter_mask(users, 'role', mask, stored_as_mask=True)), [1, 3])
@@ -0,0 +1,165 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
+
+from base.exceptions import WLException
+from base.funcs import PagedAbstractFuncClass
+from base.models import MiniprogramAppSecret
+from .. import pages
+
+
+class CursorPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(23):
+            get_user_model().objects.create_user('user_%02d' % i, role=i % 3)
+
+    def walk(self, qs, count_per_page):
+        pages_seen = []
+        objs, next_cursor, prev_cursor = pages.get_cursor_page(qs, count_per_page)
+        self.assertIsNone(prev_cursor)
+        pages_seen.append(objs)
+        while next_cursor is not None:
+            objs, next_cursor, prev_cursor = pages.get_cursor_page(qs, count_per_page, next_cursor)
+            self.assertIsNotNone(prev_cursor)
+            pages_seen.append(objs)
+
+        # walk back from the last page
+        back = [objs]
+        while prev_cursor is not None:
+            objs, next_cursor, prev_cursor = pages.get_cursor_page(qs, count_per_page, prev_cursor)
+            back.insert(0, objs)
+
+        self.assertEqual(back, pages_seen)
+        return pages_seen
+
+    def test_walk(self):
+        user_model = get_user_model()
+        for qs in (
+            user_model.objects.order_by('-role', 'registered_date'),
+            user_model.objects.order_by('internal_name'),
+            user_model.objects.all(),
+        ):
+            walked = self.walk(qs, 5)
+            self.assertEqual([len(p) for p in walked], [5, 5, 5, 5, 3])
+            self.assertEqual(sum(walked, []), list(pages.get_cursor_page(qs, 100)[0]))
+
+    def test_walk_nullable(self):
+        user_model = get_user_model()
+        for user in user_model.objects.filter(role=1):
+            user.pn = '13%09d' % (user.id % 4)
+            user.save()
+
+        for qs in (user_model.objects.order_by('pn'), user_model.objects.order_by('-pn', '-id')):
+            walked = self.walk(qs, 4)
+            users = sum(walked, [])
+            self.assertEqual(len(users), 23)
+            self.assertEqual(len(set(users)), 23)
+            # NULLs after the values.
+            self.assertEqual([u.pn is None for u in users], [False] * 8 + [True] * 15)
+
+    def test_ordering(self):
+        ordering = pages.get_cursor_ordering(get_user_model().objects.order_by('-role'))
+        self.assertEqual([(path, descending) for path, _, descending in ordering], [('role', True), ('id', False)])
+        self.assertRaises(TypeError, pages.get_cursor_ordering, get_user_model().objects.order_by('?'))
+
+    def test_invalid_cursor(self):
+        qs = get_user_model().objects.order_by('registered_date')
+        for cursor in ('bad', pages.encode_cursor([1]), pages.encode_cursor(['not a date', 1])):
+            self.assertRaises(ValueError, pages.get_cursor_page, qs, 5, cursor)
+        self.assertRaises(KeyError, pages.get_cursor_page, qs, 5, 'bad', KeyError())
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'test_pages',
+    }
+})
+class CountProviderTest(TestCase):
+    def setUp(self):
+        for i in range(12):
+            get_user_model().objects.create_user('user_%02d' % i, role=i % 3)
+
+    def test_cached_count(self):
+        provider = pages.CachedCount()
+        qs = get_user_model().objects.filter(role=0)
+        self.assertEqual(provider.count(qs), (4, 4))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(provider.count(qs.order_by('-id')), (4, 4))
+        self.assertEqual(len(queries), 0)
+
+        self.assertEqual(provider.count(get_user_model().objects.filter(role=1)), (4, 4))
+        get_user_model().objects.create_user('user_new', role=0)
+        self.assertEqual(provider.count(qs), (5, 5))
+        get_user_model().objects.get(internal_name='user_new').delete()
+        self.assertEqual(provider.count(qs), (4, 4))
+
+    def test_cached_count_subqueries(self):
+        provider = pages.CachedCount()
+        secrets = MiniprogramAppSecret.objects.filter(appsecret='s')
+        for qs in (
+            get_user_model().objects.filter(internal_name__in=secrets.values('appid')),
+            get_user_model().objects.annotate(
+                has_secret=Exists(secrets.filter(appid=OuterRef('internal_name')))
+            ).filter(has_secret=True),
+        ):
+            MiniprogramAppSecret.objects.all().delete()
+            self.assertEqual(provider.count(qs), (0, 0))
+            MiniprogramAppSecret.objects.create(appid='user_00', appsecret='s')
+            self.assertEqual(provider.count(qs), (1, 1))
+
+        self.assertIsNone(provider.get_cache_key(get_user_model().objects.extra(where=['role = 0'])))
+
+    def test_cached_count_disabled(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            provider = pages.CachedCount()
+            qs = get_user_model().objects.all()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(provider.count(qs), (12, 12))
+                self.assertEqual(provider.count(qs), (12, 12))
+            self.assertEqual(len(queries), 2)
+
+    def test_estimated_count(self):
+        class FakeEstimatedCount(pages.EstimatedCount):
+            def estimate(self, queryset):
+                return 10
+
+        qs = get_user_model().objects.all()
+        # sqlite gives no estimate
+        self.assertEqual(pages.EstimatedCount().count(qs), (12, 12))
+
+        provider = FakeEstimatedCount(max_error=0.5, exact_threshold=5)
+        self.assertEqual(provider.count(qs), (10, 15))
+        # n_pages follows the estimate, pages are accepted up to the error bound.
+        self.assertEqual(pages.get_page_info(qs, 5, 2, count_provider=provider), (10, 15, 2))
+        self.assertRaises(IndexError, pages.get_page_info, qs, 5, 3, count_provider=provider)
+        self.assertEqual(pages.get_page_info(qs, 5, 0, count_provider=FakeEstimatedCount(exact_threshold=10)), (0, 5, 3))
+
+    def test_paged_func_with_estimate(self):
+        class OverEstimatedCount(pages.EstimatedCount):
+            def estimate(self, queryset):
+                return 100
+
+        class UserListFunc(PagedAbstractFuncClass):
+            COUNT_PROVIDER = OverEstimatedCount(exact_threshold=0)
+
+            def get_paged_qs(self, **kwargs):
+                return get_user_model().objects.order_by('id'), 'users', None
+
+        class StreamedUserListFunc(UserListFunc):
+            STREAMING = True
+            STREAM_CHUNK_SIZE = 1
+
+        func = UserListFunc()
+        result = func.run(page=1, count_per_page=10)
+        self.assertEqual((len(result['users']), result['n_pages']), (2, 10))
+        # Within the estimate but beyond the real last page.
+        self.assertRaises(WLException, func.run, page=5, count_per_page=10)
+
+        func = StreamedUserListFunc()
+        result = func.run(page=1, count_per_page=10)
+        self.assertEqual(len(list(result.elements)), 2)
+        self.assertRaises(WLException, func.run, page=5, count_per_page=10)
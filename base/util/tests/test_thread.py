@@ -0,0 +1,135 @@
+import gc
+import threading
+
+from django.test import SimpleTestCase
+from rest_framework.test import APIRequestFactory
+
+from base import serializers
+from base.funcs import AbstractFuncClass, AbstractPermission
+from base.views import WLAPIGenericView
+from ..thread import LocalThreadContextMixin, request_scope, request_memoize, in_request_scope, current_scope
+
+
+calls = []
+
+
+@request_memoize
+def lookup(key):
+    calls.append(key)
+    return key * 2
+
+
+class LookupPermission(AbstractPermission):
+    def check_permission(self, func, request, user, serializer, **kwargs):
+        self.set_context('checked', lookup(3))
+        return True
+
+
+class LookupFunc(AbstractFuncClass):
+    PERMISSIONS = [LookupPermission()]
+
+    def run(self, request, user, serializer, **kwargs):
+        return {'func': lookup(3), 'checked': self.PERMISSIONS[0].get_context('checked')}
+
+
+class LookupResultSerializer(serializers.ReadonlySerializer):
+    func = serializers.IntegerField()
+    checked = serializers.IntegerField()
+    serializer = serializers.SerializerMethodField()
+
+    def get_serializer(self, obj):
+        return lookup(3)
+
+
+class LookupView(WLAPIGenericView):
+    http_method_names = ['get', 'options']
+    RESULT_SERIALIZER = LookupResultSerializer
+    FUNC_CLASS = LookupFunc
+
+
+class RequestScopeTest(SimpleTestCase):
+    def setUp(self):
+        del calls[:]
+
+    def test_context_persists(self):
+        mixin = LocalThreadContextMixin()
+        mixin.set_context('a', 1)
+        self.assertEqual(mixin.get_context('a'), 1)
+        # Contexts are kept per instance.
+        self.assertRaises(KeyError, LocalThreadContextMixin().get_context, 'a')
+
+        with request_scope():
+            self.assertRaises(KeyError, mixin.get_context, 'a')
+            mixin.set_context('a', 2)
+            self.assertEqual(mixin.get_context('a'), 2)
+        self.assertEqual(mixin.get_context('a'), 1)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(mixin.get_context_dict()))
+        thread.start()
+        thread.join()
+        self.assertEqual(results, [{}])
+
+    def test_context_dropped_with_instance(self):
+        contexts = current_scope().contexts
+        n_contexts = len(contexts)
+        for i in range(10):
+            LocalThreadContextMixin().set_context('a', i)
+        gc.collect()
+        self.assertEqual(len(contexts), n_contexts)
+
+    def test_nested_funcs(self):
+        class InnerFunc(AbstractFuncClass):
+            def run(self, **kwargs):
+                self.set_context('value', 'inner')
+                return {}
+
+        class OuterFunc(AbstractFuncClass):
+            def run(self, request, **kwargs):
+                self.set_context('value', 'outer')
+                InnerFunc()(request, None, {}, None)
+                return {'value': self.get_context('value')}
+
+        self.assertEqual(OuterFunc()(None, None, {}, None), {'value': 'outer'})
+
+    def test_context_reset_per_call(self):
+        class CountingFunc(AbstractFuncClass):
+            def run(self, **kwargs):
+                seen = sorted(self.get_context_dict())
+                self.set_context('value', 1)
+                return {'seen': seen}
+
+        func = CountingFunc()
+        with request_scope():
+            self.assertEqual(func(None, None, {}, None), {'seen': ['permission_evaluations']})
+            self.assertEqual(func(None, None, {}, None), {'seen': ['permission_evaluations']})
+            self.assertEqual(func.get_context('value'), 1)
+
+    def test_shared_by_func_permissions_and_serializer(self):
+        for _ in range(2):
+            response = LookupView.as_view()(APIRequestFactory().get('/'))
+            self.assertEqual(response.data['response'], {'result': 200, 'func': 6, 'checked': 6, 'serializer': 6})
+        # Computed once per request.
+        self.assertEqual(calls, [3, 3])
+        self.assertFalse(in_request_scope())
+
+    def test_func_outside_of_request(self):
+        func = LookupFunc()
+        for _ in range(2):
+            self.assertEqual(func(APIRequestFactory().get('/'), None, {}, None), {'func': 6, 'checked': 6})
+        self.assertEqual(calls, [3, 3])
+
+    def test_memoize(self):
+        self.assertEqual(lookup(1), 2)
+        self.assertEqual(lookup(1), 2)
+        self.assertEqual(calls, [1, 1])
+
+        with request_scope():
+            lookup(1)
+            lookup(key=1)
+            lookup(1)
+            self.assertEqual(lookup([1]), [1, 1])
+            self.assertEqual(lookup([1]), [1, 1])
+            with request_scope(reuse=True):
+                lookup(1)
+        self.assertEqual(calls, [1, 1, 1, 1, [1], [1]])
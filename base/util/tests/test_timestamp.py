@@ -0,0 +1,63 @@
+import datetime
+import random
+
+import pytz
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from base import serializers
+from ..timestamp import datetime_to_timestamp, timestamp_to_utc_datetime, timestamp_to_datetime, UTC
+
+
+def reference_timestamp(dt):
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=pytz.timezone('UTC'))
+    return int((dt - epoch).total_seconds())
+
+
+class TimestampCodecTest(SimpleTestCase):
+    def test_timezones(self):
+        shanghai = pytz.timezone('Asia/Shanghai')
+        dt = shanghai.localize(datetime.datetime(2019, 1, 1, 8))
+        self.assertEqual(datetime_to_timestamp(dt), 1546300800)
+        # Both sides of a daylight saving time change.
+        new_york = pytz.timezone('America/New_York')
+        before = new_york.localize(datetime.datetime(2019, 3, 10, 1, 59, 59))
+        after = new_york.localize(datetime.datetime(2019, 3, 10, 3, 0, 0))
+        self.assertEqual(datetime_to_timestamp(after) - datetime_to_timestamp(before), 1)
+        self.assertRaises(TypeError, datetime_to_timestamp, datetime.datetime(2019, 1, 1))
+
+    def test_reference(self):
+        rand = random.Random(0)
+        zones = [UTC, pytz.timezone('Asia/Shanghai'), pytz.timezone('America/New_York')]
+        values = [
+            UTC.localize(datetime.datetime(1970, 1, 1)) + datetime.timedelta(microseconds=500000 * i)
+            for i in range(-3, 4)
+        ]
+        for _ in range(1000):
+            tz = rand.choice(zones)
+            naive = datetime.datetime(1900, 1, 1) + datetime.timedelta(
+                seconds=rand.randint(0, 200 * 365 * 86400), microseconds=rand.randint(0, 999999)
+            )
+            values.append(tz.localize(naive))
+
+        expected = [reference_timestamp(dt) for dt in values]
+        self.assertEqual([datetime_to_timestamp(dt) for dt in values], expected)
+
+    def test_from_timestamp(self):
+        self.assertEqual(timestamp_to_utc_datetime('1546300800'), UTC.localize(datetime.datetime(2019, 1, 1)))
+
+        shanghai = timestamp_to_datetime(1546300800, pytz.timezone('Asia/Shanghai'))
+        self.assertEqual((shanghai.hour, shanghai.utcoffset()), (8, datetime.timedelta(hours=8)))
+        self.assertEqual(timestamp_to_datetime(1546300800), datetime.datetime.fromtimestamp(1546300800))
+
+    def test_fields(self):
+        field = serializers.TimestampField()
+        dt = pytz.timezone('Asia/Shanghai').localize(datetime.datetime(2019, 6, 1, 12, 30, 15, 999999))
+        self.assertEqual(field.to_representation(dt), reference_timestamp(dt))
+        self.assertEqual(field.to_internal_value(field.to_representation(dt)), dt.replace(microsecond=0))
+
+        local = serializers.LocalDateTimeField(format='%Y-%m-%d %H:%M:%S')
+        with override_settings(USE_TZ=True, TIME_ZONE='Asia/Shanghai'):
+            self.assertEqual(local.to_representation(dt.astimezone(UTC)), '2019-06-01 12:30:15')
+            with timezone.override(pytz.timezone('America/New_York')):
+                self.assertEqual(local.to_representation(dt), '2019-06-01 00:30:15')
@@ -1,11 +1,162 @@
+"""
+Request scoped context
+
+Values set by LocalThreadContextMixin and results memoized by request_memoize live in the current
+request scope. The views open a fresh scope for each request, which lasts until the response data is
+generated, so that the func, its permissions and the serializers share it. A func called outside of
+any scope opens its own.
+
+Scopes are kept per thread, or per greenlet when greenlet is installed. Contexts are kept per instance
+and weakly, the contexts set outside of any request scope are dropped along with their instances.
+"""
+import weakref
 import threading
+from functools import wraps
+from contextlib import contextmanager
+
+try:
+    from greenlet import getcurrent as _current_greenlet
+except ImportError:
+    _current_greenlet = None
+
+
+class RequestScope(object):
+    def __init__(self):
+        # {LocalThreadContextMixin instance: context}
+        self.contexts = weakref.WeakKeyDictionary()
+        self.memo = {}
+
+    def update(self, scope):
+        self.contexts.update(scope.contexts)
+        self.memo.update(scope.memo)
+
+
+class ExecutionLocal(object):
+    """
+    Value kept per thread, or per greenlet when greenlet is installed, built by factory on first use.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+        self._greenlet_values = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self):
+        if _current_greenlet is not None:
+            current = _current_greenlet()
+            value = self._greenlet_values.get(current)
+            if value is None:
+                with self._lock:
+                    value = self._greenlet_values.setdefault(current, self._factory())
+            return value
+
+        value = getattr(self._local, 'value', None)
+        if value is None:
+            value = self._local.value = self._factory()
+        return value
+
+
+# Stack of the scopes of each thread (or greenlet). The bottom scope is never popped, it holds the
+# context used outside of any request scope.
+_stacks = ExecutionLocal(lambda: [RequestScope()])
+
+
+def current_scope():
+    return _stacks.get()[-1]
+
+
+def in_request_scope():
+    return len(_stacks.get()) > 1
+
+
+@contextmanager
+def request_scope(reuse=False):
+    """
+    Run the block in a fresh request scope, discarded at exit.
+    :param reuse: stay in the current request scope if there is one.
+    """
+    stack = _stacks.get()
+    if reuse and len(stack) > 1:
+        yield stack[-1]
+        return
+
+    scope = RequestScope()
+    stack.append(scope)
+    try:
+        yield scope
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def nested_scope():
+    """
+    Run the block in a fresh scope, merged into the current one if the block succeeds and discarded if it
+    raises, e.g. an attempt which may be retried.
+    """
+    stack = _stacks.get()
+    scope = RequestScope()
+    stack.append(scope)
+    try:
+        yield scope
+    finally:
+        stack.pop()
+    stack[-1].update(scope)
+
+
+def iter_in_scope(iterable, scope):
+    """
+    Iterate iterable in scope, which is entered again for each item. For the elements of a streamed
+    response, consumed after the block of their request scope has exited.
+    """
+    iterator = iter(iterable)
+    stack = _stacks.get()
+    while True:
+        stack.append(scope)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            stack.pop()
+        yield item
+
+
+def request_memoize(func):
+    """
+    Cache the result of func in the current request scope, keyed by its arguments.
+    Outside of a request scope, or with unhashable arguments, func is simply called.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = _stacks.get()
+        if len(stack) < 2:
+            return func(*args, **kwargs)
+
+        memo = stack[-1].memo
+        key = (wrapper, args, frozenset(kwargs.items()) if kwargs else None)
+        try:
+            return memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return func(*args, **kwargs)
+
+        result = memo[key] = func(*args, **kwargs)
+        return result
+
+    return wrapper
 
 
 class LocalThreadContextMixin(object):
-    CTX_NAME = 'wl_local_context'
+    """
+    Context of the instance in the current request scope.
+    """
 
     def get_context_dict(self):
-        context = getattr(threading.local(), self.CTX_NAME, None)
+        context = current_scope().contexts.get(self)
         if context is None:
             context = self.clean_context()
 
@@ -21,5 +172,5 @@ class LocalThreadContextMixin(object):
 
     def clean_context(self):
         ctx = dict()
-        setattr(threading.local(), self.CTX_NAME, ctx)
+        current_scope().contexts[self] = ctx
         return ctx
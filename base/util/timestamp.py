@@ -1,13 +1,43 @@
+"""
+Timestamp codec
+
+Conversions between aware datetimes and integer unix timestamps, done with integer arithmetic against a
+single UTC epoch.
+"""
 import datetime
-from pytz import timezone
 
+import pytz
+
+
+UTC = pytz.utc
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=UTC)
+SECONDS_PER_DAY = 24 * 60 * 60
 
-# TODO: Test and consider about time zone issue.
 
 def datetime_to_timestamp(dt):
-    epoch = datetime.datetime(1970, 1, 1, tzinfo=timezone('UTC'))
-    return int((dt - epoch).total_seconds())
+    """
+    :param dt: an aware datetime.
+    :return: the seconds from the epoch to dt, the fraction truncated toward zero.
+    """
+    delta = dt - EPOCH
+    seconds = delta.days * SECONDS_PER_DAY + delta.seconds
+    if seconds < 0 and delta.microseconds:
+        seconds += 1
+    return seconds
+
+
+def timestamp_to_utc_datetime(ts):
+    """
+    :param ts: seconds from the epoch, an integer, a float or their string.
+    :return: the aware datetime of ts in UTC.
+    """
+    return datetime.datetime.utcfromtimestamp(float(ts)).replace(tzinfo=UTC)
 
 
-def timestamp_to_datetime(ts):
-    return datetime.datetime.fromtimestamp(ts)
+def timestamp_to_datetime(ts, tz=None):
+    """
+    :param tz: timezone of the datetime. When None, the datetime is naive in the local time of the system.
+    """
+    if tz is None:
+        return datetime.datetime.fromtimestamp(ts)
+    return timestamp_to_utc_datetime(ts).astimezone(tz)
@@ -0,0 +1,180 @@
+"""
+Request phase timing
+
+Measures wall time and database queries of each phase of a request, and
+renders them as a Server-Timing header.
+"""
+import time
+import threading
+from itertools import islice
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+class PhaseTimer(object):
+    """
+    Times named phases. When track_queries is set, query logging of every database connection
+    is forced on between start() and stop(), so that the number and time of the queries issued
+    in each phase can be counted.
+    """
+
+    enabled = True
+
+    def __init__(self, track_queries=True):
+        self.track_queries = track_queries
+        self.phases = OrderedDict()
+        self._forced = []
+        self._start = None
+        self._end = None
+
+    def start(self):
+        self._start = time.time()
+        if self.track_queries:
+            for conn in connections.all():
+                if not conn.force_debug_cursor:
+                    conn.force_debug_cursor = True
+                    self._forced.append(conn)
+        return self
+
+    def stop(self):
+        if self._end is None:
+            self._end = time.time()
+        for conn in self._forced:
+            conn.force_debug_cursor = False
+        self._forced = []
+
+    def _query_snapshot(self):
+        if not self.track_queries:
+            return None
+        return [(conn, len(conn.queries_log)) for conn in connections.all()]
+
+    @staticmethod
+    def _query_diff(snapshot):
+        count = 0
+        duration = 0.0
+        for conn, start in snapshot:
+            # The log is a bounded deque, the count is only exact while it is not saturated.
+            new_queries = list(islice(conn.queries_log, start, None))
+            count += len(new_queries)
+            duration += sum(float(q.get('time') or 0) for q in new_queries)
+        return count, duration
+
+    @contextmanager
+    def phase(self, name):
+        snapshot = self._query_snapshot()
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            record = {'duration': duration}
+            if snapshot is not None:
+                record['queries'], record['query_duration'] = self._query_diff(snapshot)
+            self.phases[name] = record
+
+    @property
+    def total(self):
+        end = self._end if self._end is not None else time.time()
+        return end - self._start if self._start is not None else 0.0
+
+    def as_dict(self):
+        return {
+            'total': round(self.total * 1000, 3),
+            'phases': OrderedDict(
+                (name, dict(
+                    {'duration': round(record['duration'] * 1000, 3)},
+                    **({
+                        'queries': record['queries'],
+                        'query_duration': round(record['query_duration'] * 1000, 3),
+                    } if 'queries' in record else {})
+                ))
+                for name, record in self.phases.items()
+            ),
+        }
+
+    def server_timing(self):
+        """
+        :return: value of the Server-Timing header, durations are in milliseconds.
+        """
+        metrics = []
+        for name, record in self.phases.items():
+            metrics.append('%s;dur=%.3f' % (name, record['duration'] * 1000))
+            if record.get('queries'):
+                metrics.append('%s-db;dur=%.3f;desc="%d queries"' % (
+                    name, record['query_duration'] * 1000, record['queries']
+                ))
+        metrics.append('total;dur=%.3f' % (self.total * 1000))
+        return ', '.join(metrics)
+
+
+class NullPhaseTimer(object):
+    """
+    Timer used when timing is disabled, all operations are no-op.
+    """
+
+    enabled = False
+    phases = {}
+    total = 0.0
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+
+class PermissionProfiler(object):
+    """
+    Aggregates the time spent evaluating each permission of each func in this process.
+    The time of a composed permission includes the time of its operands.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(lambda: {'calls': 0, 'duration': 0.0}))
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @contextmanager
+    def profile(self, func, permission):
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            func_label = func.__class__.__name__ if func is not None else None
+            with self._lock:
+                record = self._stats[func_label][permission.label]
+                record['calls'] += 1
+                record['duration'] += duration
+
+    def as_dict(self):
+        """
+        :return: {func: {permission: {'calls': n, 'duration': total milliseconds}}}
+        """
+        with self._lock:
+            return {
+                func_label: {
+                    label: {'calls': record['calls'], 'duration': round(record['duration'] * 1000, 3)}
+                    for label, record in perms.items()
+                }
+                for func_label, perms in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+permission_profiler = PermissionProfiler()
@@ -1,21 +1,42 @@
 import urllib
+import urlparse
 import json
+import hashlib
 import logging
+import threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+import six
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.parsers import JSONParser
 from rest_framework.exceptions import MethodNotAllowed
 from rest_framework.views import APIView
 from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.base import SessionBase
+from django.http.request import HttpRequest, QueryDict
 from django.http.response import HttpResponseNotAllowed
 from django.conf import settings
-from django.http.response import HttpResponse, FileResponse
+from django.core.cache import caches
+from django.db import connections
+from django.urls import resolve, Resolver404
+from django.utils import translation
+from django.utils.http import parse_etags, quote_etag
+from django.http.response import HttpResponse, FileResponse, StreamingHttpResponse
+from django.template.response import SimpleTemplateResponse
 from base.exceptions import WLException
 from base.util.serializer_helper import errors_summery
-from base.funcs import AbstractFuncClass
+from base.util.timing import PhaseTimer, NullPhaseTimer
+from base.util.thread import request_scope, current_scope, iter_in_scope
+from base.funcs import AbstractFuncClass, MethodRoutedFuncClass, StreamedResult
 from base.authentication import SessionAuthenticationWoCsrf
+from base.serializers.batch import BatchApiSerializer
+from base.util.choice_bundle import get_bundle_languages, get_choice_bundle
 
 
 logger = logging.getLogger(__name__)
+slow_request_logger = logging.getLogger(__name__ + '.slow')
 
 
 class WLAPIView(object):
@@ -53,7 +74,8 @@ class WLAPIView(object):
         elif method in {"GET", "DELETE"}:
             objs = request.GET
             if "context" in objs:
-                context = objs.pop("context")
+                objs = objs.copy()
+                context = objs.pop("context")[-1]
                 try:
                     context = json.loads(urllib.unquote(context))
                 except ValueError:
@@ -137,6 +159,15 @@ class WLAPIGenericView(WLAPIView, APIView):
     EXTRA_ARGS = None
     USE_VALIDATE_DATA = True
     USER_SESSION_KEY = 'user_sid'
+    # None to follow settings.WL_REQUEST_TIMING
+    REQUEST_TIMING = None
+    # Seconds, None to follow settings.WL_SLOW_REQUEST_THRESHOLD
+    SLOW_REQUEST_THRESHOLD = None
+    # Methods answered with ETag / 304 when get_result_version gives a version.
+    CONDITIONAL_METHODS = ('get', )
+    # Alias of the cache keeping the rendered responses by ETag, None not to keep them.
+    RESULT_CACHE = None
+    RESULT_CACHE_TIMEOUT = 300
 
     authentication_classes = [
         SessionAuthenticationWoCsrf
@@ -144,37 +175,58 @@ class WLAPIGenericView(WLAPIView, APIView):
 
     def __init__(self, **kwargs):
         super(WLAPIGenericView, self).__init__(**kwargs)
-        self._func = self.init_func_class()
+        self._plan = self.get_dispatch_plan()
+        self._func = self._plan.funcs
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Build the plan when the url conf is loaded, so that a misconfigured view fails early.
+        cls.get_dispatch_plan()
+        return super(WLAPIGenericView, cls).as_view(**initkwargs)
+
+    @classmethod
+    def get_dispatch_plan(cls):
+        plan = cls.__dict__.get('_dispatch_plan')
+        if plan is None:
+            plan = DispatchPlan(cls)
+            cls._dispatch_plan = plan
+        return plan
 
     @staticmethod
     def _check_func_class(clz):
         if not issubclass(clz, AbstractFuncClass):
             raise TypeError("FUNC_CLASS must be subclass of AbstractFuncClass")
 
-    def init_func_class(self):
-
-        def check_and_return(c):
-            self._check_func_class(c)
-            return c
-
-        set_http_methods = set(self.http_method_names)
-        if isinstance(self.FUNC_CLASS, dict):
-            class_dict = {
-                k: v() for k, v in self.FUNC_CLASS.items() if k in set_http_methods and check_and_return(v) is not None
-            }
+    @classmethod
+    def get_func_classes(cls):
+        """
+        Validate FUNC_CLASS.
+        :return: a dictionary of {http method: func class}
+        """
+        set_http_methods = set(cls.http_method_names)
+        if isinstance(cls.FUNC_CLASS, dict):
+            class_dict = {}
+            for k, v in cls.FUNC_CLASS.items():
+                if k in set_http_methods:
+                    cls._check_func_class(v)
+                    class_dict[k] = v
 
             for method in set_http_methods:
-                if method != "options" and method not in self.FUNC_CLASS:
+                if method != "options" and method not in cls.FUNC_CLASS:
                     raise KeyError("FUNC_CLASS dict must contain a key of %s" % method)
 
             return class_dict
-        elif isinstance(self.FUNC_CLASS, type):
-            self._check_func_class(self.FUNC_CLASS)
-            fc = self.FUNC_CLASS()
+        elif isinstance(cls.FUNC_CLASS, type):
+            cls._check_func_class(cls.FUNC_CLASS)
             return {
-                k: fc
+                k: cls.FUNC_CLASS
                 for k in set_http_methods if k != "options"
             }
+        else:
+            return {}
+
+    def init_func_class(self):
+        return self.get_dispatch_plan().funcs
 
     def __getattr__(self, item):
         if item == 'options':
@@ -234,37 +286,513 @@ class WLAPIGenericView(WLAPIView, APIView):
             context=context
         )
 
-    def proceed(self, request):
-        data, context = self.get_request_obj(request)
+    def get_result_version(self, request, user, args, result):
+        """
+        Override to enable conditional responses.
+        :return: a json serializable version of the result, e.g. model_version.instance_version(obj),
+            or None if the result shall not be validated.
+        """
+        return None
+
+    def get_result_etag(self, request, user, args, context, result):
+        method = request.method.lower()
+        if method not in self.CONDITIONAL_METHODS:
+            return None
+
+        version = self.get_result_version(request, user, args, result)
+        if version is None:
+            return None
+
+        # The result may depend on the user, so does the ETag and the key of the cached result.
+        key = json.dumps([
+            self.__class__.__module__, self.__class__.__name__, method, self.API_VERSION, version, args, context,
+            getattr(user, 'pk', None),
+        ], sort_keys=True, default=str)
+        return quote_etag(hashlib.md5(key.encode('utf-8')).hexdigest())
 
-        user = self.get_user(request)
+    @staticmethod
+    def etag_matches(request, etag):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if not if_none_match:
+            return False
+        # Weak comparison, proxies compressing the response turn the ETag into a weak one.
+        etags = {e[2:] if e.startswith('W/') else e for e in parse_etags(if_none_match)}
+        return '*' in etags or etag in etags
+
+    def not_modified_response(self, request, etag):
+        response = Response(status=304)
+        response['ETag'] = etag
+        return response
+
+    def get_result_cache_key(self, request, etag):
+        if etag is None or self.RESULT_CACHE is None:
+            return None
+        # The content depends on the renderer negotiated besides the ETag.
+        return 'wl_result:%s:%s' % (etag.strip('"'), getattr(request, 'accepted_media_type', None))
+
+    def cached_response(self, cache_key):
+        cached = caches[self.RESULT_CACHE].get(cache_key)
+        if cached is None:
+            return None
+        content_type, content = cached
+        return HttpResponse(content, content_type=content_type)
+
+    def cache_response(self, response, cache_key):
+        if response.status_code != 200 or response.streaming:
+            return
+        if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+            response.render()
+        caches[self.RESULT_CACHE].set(
+            cache_key, (response['Content-Type'], response.content), self.RESULT_CACHE_TIMEOUT
+        )
+
+    def get_slow_request_threshold(self):
+        if self.SLOW_REQUEST_THRESHOLD is not None:
+            return self.SLOW_REQUEST_THRESHOLD
+        return getattr(settings, 'WL_SLOW_REQUEST_THRESHOLD', None)
+
+    def get_timer(self, request):
+        timing = self.REQUEST_TIMING
+        if timing is None:
+            timing = getattr(settings, 'WL_REQUEST_TIMING', False)
+
+        if timing or self.get_slow_request_threshold() is not None:
+            return PhaseTimer(track_queries=getattr(settings, 'WL_REQUEST_TIMING_QUERIES', True))
+        else:
+            return NullPhaseTimer()
+
+    def report_timing(self, request, response, timer):
+        if not timer.enabled:
+            return response
+
+        response['Server-Timing'] = timer.server_timing()
+        self.log_slow_request(request, timer)
+        return response
+
+    def log_slow_request(self, request, timer):
+        threshold = self.get_slow_request_threshold()
+        if threshold is not None and timer.total >= threshold:
+            timing = dict(timer.as_dict(), view=self.__class__.__name__, method=request.method)
+            slow_request_logger.warning(
+                "Slow request: %s" % json.dumps(timing),
+                extra={"request": request, "timing": timing}
+            )
 
-        args, serializer = self.get_args(request, data)
+    def timed_stream(self, request, content, timer):
+        try:
+            with timer.phase('stream'):
+                for chunk in content:
+                    yield chunk
+        finally:
+            timer.stop()
+            self.log_slow_request(request, timer)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(WLAPIGenericView, self).finalize_response(request, response, *args, **kwargs)
+        timer = self.__dict__.pop('_timer', None)
+        cache_key = self.__dict__.pop('_result_cache_key', None)
+        if timer is None or not timer.enabled:
+            if cache_key is not None:
+                self.cache_response(response, cache_key)
+            return response
+
+        if response.streaming:
+            # The body is produced while it is sent, after the headers. It is timed by the stream phase,
+            # which only the slow request log reports.
+            response['Server-Timing'] = timer.server_timing()
+            response.streaming_content = self.timed_stream(request, response.streaming_content, timer)
+            return response
+
+        try:
+            if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+                # Rendered here rather than by the handler, so that the renderer is timed.
+                with timer.phase('render'):
+                    response.render()
+        finally:
+            timer.stop()
+
+        if cache_key is not None:
+            self.cache_response(response, cache_key)
+        return self.report_timing(request, response, timer)
 
-        result = self.run_func(request, user, args, serializer)
+    def proceed(self, request):
+        # The func, its permissions and the result serializer share a request scope.
+        with request_scope():
+            # Stopped and reported by finalize_response, once the response is rendered.
+            timer = self._timer = self.get_timer(request).start()
+            with timer.phase('request_obj'):
+                data, context = self.get_request_obj(request)
+
+            with timer.phase('user'):
+                user = self.get_user(request)
+
+            with timer.phase('args'):
+                args, serializer = self.get_args(request, data)
+
+            with timer.phase('func'):
+                result = self.run_func(request, user, args, serializer)
+
+            if isinstance(result, StreamedResult):
+                with timer.phase('response'):
+                    return self.streaming_response(request, result, context)
+
+            etag = self.get_result_etag(request, user, args, context, result)
+            if etag is not None and self.etag_matches(request, etag):
+                return self.not_modified_response(request, etag)
+
+            cache_key = self.get_result_cache_key(request, etag)
+            response = self.cached_response(cache_key) if cache_key is not None else None
+            if response is None:
+                with timer.phase('data'):
+                    data = self.generate_data(request, result)
+
+                with timer.phase('response'):
+                    response = self.http_response(request, result, data, context)
+                # Kept by finalize_response, once the response is rendered.
+                self._result_cache_key = cache_key
+            if etag is not None:
+                response['ETag'] = etag
+            return response
+
+    def streaming_response(self, request, result, context):
+        """
+        Write the standard envelope incrementally, serializing one element of the result at a time.
+        The other fields are serialized by the result serializer, the element serializer is
+        the child of its field named result.field_name.
+        """
+        result_serializer = self.get_result_serializer(request)
+        child = None
+        if result_serializer is not None:
+            serializer = result_serializer(dict(result.extra, **{result.field_name: []}))
+            head = dict(serializer.data)
+            head.pop(result.field_name, None)
+            child = getattr(serializer.fields.get(result.field_name), 'child', None)
+        else:
+            head = dict(result.extra)
+
+        dumps_kwargs = {
+            'cls': JSONEncoder,
+            'ensure_ascii': not api_settings.UNICODE_JSON,
+            'separators': (',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+        }
+
+        def encode(o):
+            ret = json.dumps(o, **dumps_kwargs)
+            return ret.encode('utf-8') if isinstance(ret, unicode) else ret
+
+        # The elements are fetched and represented in the request scope of the func, with its contexts.
+        scope = current_scope()
+        representations = (
+            child.to_representation(element) if child is not None else element for element in result.elements
+        )
 
-        data = self.generate_data(request, result)
+        def generate():
+            response_head = encode(dict(head, result=200))
+            yield b'{"response": %s, %s: [' % (response_head[:-1], encode(result.field_name))
+            try:
+                for i, rep in enumerate(iter_in_scope(representations, scope)):
+                    yield (b',' if i else b'') + encode(rep)
+            except Exception:
+                # Headers are gone, the client will see a truncated body.
+                logger.exception("Exception while streaming", extra={"request": self.request})
+                raise
+            yield b']}, "version": %s, "context": %s}' % (encode(self.API_VERSION), encode(context))
 
-        return self.http_response(request, result, data, context)
+        return StreamingHttpResponse(generate(), content_type='application/json')
 
     def get_api_serializer(self, request):
-        return self.determine_serializer(request, self.API_SERIALIZER)
+        return self.get_planned_serializer(request, 'API_SERIALIZER')
 
     def get_result_serializer(self, request):
-        return self.determine_serializer(request, self.RESULT_SERIALIZER)
+        return self.get_planned_serializer(request, 'RESULT_SERIALIZER')
+
+    def get_planned_serializer(self, request, attr):
+        """
+        Serializer of attr for the method of request, resolved by the dispatch plan unless attr has been
+        replaced on the instance or determine_serializer overridden.
+        """
+        s = getattr(self, attr)
+        planned, serializers = self._plan.serializers[attr]
+        if s is not planned or self._plan.custom_determine_serializer:
+            return self.determine_serializer(request, s)
+        return serializers.get(request.method.lower())
 
     def get_extra_args(self, request):
         return self.EXTRA_ARGS
 
     @staticmethod
     def _request_method_to_serializer(request, serializer_dict):
-        serializer = serializer_dict.get(request.method.lower())
-        return serializer if callable(serializer) else None
+        return method_to_serializer(request.method.lower(), serializer_dict)
 
     def determine_serializer(self, request, s):
-        if callable(s):
-            return s
-        elif isinstance(s, dict):
-            return self._request_method_to_serializer(request, s)
+        return method_to_serializer(request.method.lower(), s)
+
+
+_determine_serializer = six.get_unbound_function(WLAPIGenericView.determine_serializer)
+
+
+def method_to_serializer(method, s):
+    if callable(s):
+        return s
+    elif isinstance(s, dict):
+        serializer = s.get(method)
+        return serializer if callable(serializer) else None
+    else:
+        return None
+
+
+class DispatchPlan(object):
+    """
+    What WLAPIGenericView resolves from its class attributes for each http method, computed once per
+    view class and shared by all of its requests: the validated func classes and their instances, the
+    api and result serializer classes and the flattened permission lists. A class serving several methods
+    is instantiated once, the funcs are shared and cannot keep state on themselves.
+    """
+
+    def __init__(self, view_class):
+        self.http_methods = frozenset(m for m in view_class.http_method_names if m != 'options')
+        self.func_classes = view_class.get_func_classes()
+        instances = {}
+        for clz in set(self.func_classes.values()):
+            instances[clz] = clz()
+        self.funcs = {m: instances[clz] for m, clz in self.func_classes.items()}
+        self.permissions = {m: self.flatten_permissions(func, m) for m, func in self.funcs.items()}
+        for func in instances.values():
+            func.share()
+
+        self.serializers = {
+            attr: (s, {m: method_to_serializer(m, s) for m in self.http_methods})
+            for attr, s in (
+                ('API_SERIALIZER', view_class.API_SERIALIZER), ('RESULT_SERIALIZER', view_class.RESULT_SERIALIZER)
+            )
+        }
+        self.custom_determine_serializer = (
+            six.get_unbound_function(view_class.determine_serializer) is not _determine_serializer
+        )
+
+    @staticmethod
+    def flatten_permissions(func, method):
+        if isinstance(func, MethodRoutedFuncClass):
+            perms = func.get_permissions_for_method(method)
+            # The func reads them from its cache, filled before it is shared.
+            func._cached_permission_dict[method] = perms
+            return perms
         else:
-            return None
+            return list(func.PERMISSIONS)
+
+    @property
+    def api_serializers(self):
+        return self.serializers['API_SERIALIZER'][1]
+
+    @property
+    def result_serializers(self):
+        return self.serializers['RESULT_SERIALIZER'][1]
+
+
+class BatchItemSession(SessionBase):
+    """
+    Copy of the session of a batch request for one of its items run in parallel, sessions are not thread
+    safe. It is never stored, its changes are merged into the session of the batch request by merge_into.
+    """
+
+    def __init__(self, session):
+        super(BatchItemSession, self).__init__(session.session_key)
+        self.initial = dict(session.items())
+        self._session_cache = dict(self.initial)
+        self.cycled = self.flushed = False
+
+    def cycle_key(self):
+        self.cycled = self.modified = True
+
+    def flush(self):
+        self.clear()
+        self.flushed = True
+
+    def exists(self, session_key):
+        return False
+
+    def create(self):
+        pass
+
+    def save(self, must_create=False):
+        pass
+
+    def delete(self, session_key=None):
+        pass
+
+    def load(self):
+        return {}
+
+    def merge_into(self, session):
+        if not self.modified:
+            return
+        if self.flushed:
+            session.flush()
+        for key in self.initial:
+            if key not in self._session_cache:
+                session.pop(key, None)
+        for key, value in self._session_cache.items():
+            if key not in self.initial or self.initial[key] != value or self.flushed:
+                session[key] = value
+        if self.cycled:
+            session.cycle_key()
+
+
+class WLBatchAPIView(WLAPIGenericView):
+    """
+    Run several WLAPIGenericView calls in one round trip.
+
+    Each item of the requests list is resolved through the url conf and dispatched to its view
+    with the user and session of the batch request. The response envelopes are returned in order,
+    an item failing is reported in its own envelope via handle_exception. Items run in parallel are
+    given a copy of the session each, their changes are merged into it in the order of the items.
+    """
+    http_method_names = ['post', 'options']
+    API_SERIALIZER = BatchApiSerializer
+    # Headers of the batch request that shall not leak to the items.
+    EXCLUDED_META = (
+        'CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+    )
+
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls):
+        with cls._pool_lock:
+            if WLBatchAPIView._pool is None:
+                WLBatchAPIView._pool = ThreadPool(processes=getattr(settings, 'WL_BATCH_MAX_WORKERS', 4))
+        return WLBatchAPIView._pool
+
+    def run_func(self, request, user, args, serializer):
+        items = args['requests']
+        if args['parallel'] and len(items) > 1:
+            language = translation.get_language()
+            session = getattr(request._request, 'session', None)
+            sessions = [BatchItemSession(session) if session is not None else None for _ in items]
+
+            def run_in_thread(item_and_session):
+                try:
+                    with translation.override(language):
+                        return self.run_item(request, *item_and_session)
+                finally:
+                    connections.close_all()
+
+            responses = self.get_pool().map(run_in_thread, zip(items, sessions))
+            if session is not None:
+                for item_session in sessions:
+                    item_session.merge_into(session)
+        else:
+            responses = [self.run_item(request, item) for item in items]
+
+        return {
+            'responses': responses
+        }
+
+    def resolve_item(self, path):
+        try:
+            match = resolve(path)
+        except Resolver404:
+            raise WLException(code=404, message="%s is not found." % path)
+
+        view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+        if (
+            not isinstance(view_class, type)
+            or not issubclass(view_class, WLAPIGenericView)
+            or issubclass(view_class, WLBatchAPIView)
+        ):
+            raise WLException(code=400, message="%s cannot be called in batch." % path)
+
+        return match
+
+    def build_item_request(self, request, path, method, data, context, session=None):
+        parent = request._request
+        item_request = HttpRequest()
+        item_request.META = {k: v for k, v in parent.META.items() if k not in self.EXCLUDED_META}
+        item_request.META['REQUEST_METHOD'] = method.upper()
+        item_request.method = method.upper()
+        item_request.path = item_request.path_info = path
+        item_request.COOKIES = parent.COOKIES
+        item_request.GET = QueryDict(mutable=True)
+
+        if item_request.method in {"GET", "DELETE"}:
+            for k, v in data.items():
+                if isinstance(v, list):
+                    item_request.GET.setlist(k, v)
+                else:
+                    item_request.GET[k] = v
+            if context is not None:
+                item_request.GET['context'] = urllib.quote(json.dumps(context))
+            body = b''
+        else:
+            body = json.dumps({'data': data, 'context': context}).encode('utf-8')
+            item_request.META['CONTENT_TYPE'] = 'application/json'
+
+        item_request.META['CONTENT_LENGTH'] = str(len(body))
+        item_request._stream = BytesIO(body)
+        item_request._read_started = False
+
+        # Share the authenticated user and session of the batch request, or the copy of the session given.
+        item_request.user = request.user
+        if session is not None:
+            item_request.session = session
+        elif hasattr(parent, 'session'):
+            item_request.session = parent.session
+        item_request._dont_enforce_csrf_checks = True
+        return item_request
+
+    def run_item(self, request, item, session=None):
+        try:
+            path = urlparse.urlsplit(item['path']).path
+            match = self.resolve_item(path)
+            item_request = self.build_item_request(
+                request, path, item['method'], item['data'], item['context'], session
+            )
+            response = match.func(item_request, *match.args, **match.kwargs)
+        except Exception as e:
+            response = self.handle_exception(e)
+
+        return self.response_envelope(response)
+
+    def response_envelope(self, response):
+        data = getattr(response, 'data', None)
+        if isinstance(data, dict):
+            return data
+        elif isinstance(response, StreamingHttpResponse) and response.status_code == 200:
+            return json.loads(b''.join(response.streaming_content))
+        else:
+            return {
+                "response": {
+                    "result": response.status_code,
+                    "reason": response.content if not response.streaming else None,
+                },
+                "version": self.API_VERSION,
+            }
+
+
+class ChoiceBundleView(WLAPIView, APIView):
+    """
+    Values, aliases, verbose names and fieldsets of all the registered choices in one response,
+    encoded once per language and validated with its content hash as ETag.
+    The language is given by the lang parameter, settings.LANGUAGE_CODE by default.
+    """
+    API_VERSION = "2.0"
+    http_method_names = ['get', 'options']
+
+    @classmethod
+    def warm(cls):
+        for language in get_bundle_languages():
+            get_choice_bundle(language, cls.API_VERSION)
+
+    def get(self, request):
+        language = request.GET.get('lang') or settings.LANGUAGE_CODE
+        if language not in get_bundle_languages():
+            raise WLException(400, "Language %s is not supported." % language)
+
+        content, etag = get_choice_bundle(language, self.API_VERSION)
+        if WLAPIGenericView.etag_matches(request, etag):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(content, content_type='application/json; charset=utf-8')
+        response['ETag'] = etag
+        return response
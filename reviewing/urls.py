@@ -16,10 +16,12 @@ Including another URLconf
 from django.conf.urls import url
 from django.contrib import admin
 from django.conf.urls import include
+import base.urls
 import usersys.urls
 
 
 urlpatterns = [
     url(r'^bg/', admin.site.urls),
+    url(r'^base/', include(base.urls.urlpatterns)),
     url(r'^user/', include(usersys.urls.urlpatterns)),
 ]
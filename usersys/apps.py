@@ -8,3 +8,9 @@ from django.apps import AppConfig
 class UsersysConfig(AppConfig):
     name = 'usersys'
     verbose_name = _("用户管理")
+
+    def ready(self):
+        from base.util.model_version import track_model
+        from .models import UserBase
+        # Versions of users validate the responses of UserView.
+        track_model(UserBase)
@@ -4,6 +4,8 @@ from base.util import field_choice
 
 
 class _UserRoleChoice(field_choice.FieldChoice2):
+    BITMASK = True
+
     CLIENT = field_choice.FieldChoiceSelection(0, "C端客户", alias='client')
     RECYCLING_STAFF = field_choice.FieldChoiceSelection(1, "B端业务员", alias='recycling_staff')
     RECOMMENDER = field_choice.FieldChoiceSelection(2, "市场推广", alias='recommender')
@@ -1,6 +1,57 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from usersys.models import UserBase
+from usersys.views.user import UserView
 
 # Create your tests here.
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'usersys_tests',
+    }
+})
+class UserViewConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = UserBase.objects.create_user('conditional', role=0, pn='13000000000')
+
+    def get(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = APIRequestFactory().get('/user/user/', **headers)
+        request.user = self.user
+        return UserView.as_view()(request)
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['response']['user']['pn'], '13000000000')
+        etag = response['ETag']
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.get('W/' + etag).status_code, 304)
+
+    def test_invalidated_by_save(self):
+        etag = self.get()['ETag']
+
+        self.user.pn = '13100000000'
+        self.user.save()
+
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['response']['user']['pn'], '13100000000')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    })
+    def test_disabled_without_cache(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
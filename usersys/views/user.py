@@ -1,4 +1,5 @@
 from base.views import WLAPIGenericView
+from base.util.model_version import instance_version
 from ..serializers import user as user_serializers
 from ..funcs import user as user_funcs
 
@@ -12,3 +13,7 @@ class UserView(WLAPIGenericView):
         'get': user_serializers.UserDetailSerializer
     }
     FUNC_CLASS = user_funcs.UserFunc
+    RESULT_CACHE = 'default'
+
+    def get_result_version(self, request, user, args, result):
+        return instance_version(result['user'])